@@ -0,0 +1,258 @@
+import argparse
+import contextlib
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Benchmarks every pipeline stage on synthetic data (generate_station_data for the stations,
+# synthetic_cmip6 for the raw GCM files) over a grid of problem sizes. Each stage runs in a fresh
+# Python process, which reports its wall time and peak RSS; throughput is station-days per second.
+# Results are stored per commit in results/<commit>.json and two result files can be compared:
+#
+#   python run_benchmarks.py --grid quick
+#   python run_benchmarks.py --compare results/<old>.json results/<new>.json
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, os.path.join(ROOT, 'common'))
+from interchange import table_filename
+
+SCRIPTS = {
+    'generate': (os.path.join(ROOT, 'day1_foundations', 'scripts', 'python', '02_gcm_preprocessing.py'), 'generate_station_data'),
+    'qc': (os.path.join(ROOT, 'common', 'station_qc.py'), 'quality_control_stations'),
+    'extraction': (os.path.join(ROOT, 'day1_foundations', 'scripts', 'python', '01_02_gcm_preprocessing.py'), 'precipitation_gcm_data'),
+    'correction': (os.path.join(ROOT, 'day2_downscaling_bc', 'scripts', 'python', '03_bias_correction_python.py'), 'perform_bias_correction'),
+    'downscaling': (os.path.join(ROOT, 'day2_downscaling_bc', 'scripts', 'python', 'regression_downscaling.py'), 'regression_downscaling'),
+    'evaluation': (os.path.join(ROOT, 'day3_evaluation_visualization', 'scripts', 'pyhthon', '04_evaluation_python.py'), 'evaluate_bias_correction'),
+    'plotting': (os.path.join(ROOT, 'day3_evaluation_visualization', 'scripts', 'pyhthon', '05_visualization__python.py'), 'visualize_results'),
+}
+STAGES = list(SCRIPTS)
+
+# The visualization script plots ACCESS-CM2, so it is always the first model
+MODELS = ['ACCESS-CM2', 'MPI-ESM1-2-HR', 'EC-Earth3', 'NorESM2-MM']
+SCENARIOS = ['historical', 'ssp245', 'ssp585']
+HISTORICAL_START, FUTURE_START = 1991, 2041
+PERIODS = {'historical': '1991-2020'}
+FUTURE_PERIOD = '2041-2070'
+
+# Size axes; every combination is one benchmark case
+GRIDS = {
+    'quick': {'stations': [5], 'years': [2], 'models': [1], 'scenarios': [2]},
+    'default': {'stations': [10, 40], 'years': [5, 30], 'models': [1, 2], 'scenarios': [1, 3]},
+    'large': {'stations': [40, 200], 'years': [30], 'models': [1, 4], 'scenarios': [3]},
+}
+
+
+def grid_cases(grid):
+    axes = GRIDS[grid] if isinstance(grid, str) else grid
+    return [dict(zip(axes, values)) for values in itertools.product(*axes.values())]
+
+
+def _configs(case):
+    models = MODELS[:case['models']]
+    scenarios = SCENARIOS[:case['scenarios']]
+    return [{'model': m, 'scenario': s, 'time_period': PERIODS.get(s, FUTURE_PERIOD)} for m in models for s in scenarios]
+
+
+def stage_work(stage, case):
+    """
+    Station-days processed by a stage for one case (its throughput denominator).
+    """
+    station_days = case['stations'] * case['years'] * 365.25
+    if stage in ('extraction', 'correction', 'downscaling'):
+        return station_days * case['models'] * case['scenarios']
+    if stage == 'evaluation':
+        return station_days * case['models']        # historical runs only
+    return station_days
+
+
+def stage_kwargs(stage, case, work_dir):
+    """
+    Arguments of each stage's function for one case, with every path inside work_dir.
+    """
+    station_dir = os.path.join(work_dir, 'station_data')
+    station_data = os.path.join(station_dir, table_filename('station_data'))
+    processed_gcm_dir = os.path.join(work_dir, 'processed_gcm')
+    bias_corrected_dir = os.path.join(work_dir, 'bias_corrected')
+    return {
+        'generate': dict(num_station=case['stations'], start_date=f'{HISTORICAL_START}-01-01',
+                         end_date=f"{HISTORICAL_START + case['years'] - 1}-12-31", output_dir=station_dir, seed=42),
+        'qc': dict(station_data_path=station_data, output_dir=station_dir),
+        'extraction': dict(gcm_raw_dir=os.path.join(work_dir, 'raw_gcm'),
+                           station_metedata_path=os.path.join(station_dir, table_filename('station_metadata')),
+                           processed_gcm_dir=processed_gcm_dir, gcm_configs=_configs(case)),
+        'correction': dict(station_data_path=station_data, processed_gcm_dir=processed_gcm_dir,
+                           output_dir=bias_corrected_dir, gcm_config=_configs(case)),
+        'downscaling': dict(station_data_path=station_data, gcm_raw_dir=os.path.join(work_dir, 'raw_gcm'),
+                            output_dir=os.path.join(work_dir, 'downscaled'), gcm_config=_configs(case)),
+        'evaluation': dict(station_data_path=station_data, processed_gcm_dir=processed_gcm_dir,
+                           bias_corrected_dir=bias_corrected_dir, output_dir=os.path.join(work_dir, 'evaluation_results'),
+                           n_bootstrap=200, use_cache=False,
+                           gcm_config_to_eval=[c for c in _configs(case) if c['scenario'] == 'historical']),
+        'plotting': dict(station_data_path=station_data, processed_gcm_dir=processed_gcm_dir,
+                         bias_corrected_dir=bias_corrected_dir, output_dir=os.path.join(work_dir, 'plots')),
+    }[stage]
+
+
+def prepare_raw_gcm(case, work_dir):
+    """
+    Writes the synthetic CMIP6 files a case needs (setup, not timed).
+    """
+    from synthetic_cmip6 import write_synthetic_cmip6
+    for config in _configs(case):
+        start = HISTORICAL_START if config['scenario'] == 'historical' else FUTURE_START
+        write_synthetic_cmip6(os.path.join(work_dir, 'raw_gcm'), config['model'], config['scenario'], start, case['years'])
+
+
+def measure_call(script, function, kwargs_json):
+    """
+    Child-process side: calls the stage function (its output silenced) and prints one JSON line
+    with wall time, peak RSS of this process and of its own worker processes, and any error.
+    """
+    sys.path.insert(0, os.path.dirname(script))
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(script))[0].replace('.', '_'), script)
+    result = {'error': None}
+    start = time.perf_counter()
+    try:
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            getattr(module, function)(**json.loads(kwargs_json))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['wall_s'] = time.perf_counter() - start
+    try:
+        import resource
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+        result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+        result['children_peak_rss_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    except ImportError:
+        result['peak_rss_mb'] = result['children_peak_rss_mb'] = None
+    print('BENCHMARK_RESULT ' + json.dumps(result))
+
+
+def run_stage(stage, case, work_dir):
+    script, function = SCRIPTS[stage]
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--measure', script, function,
+         json.dumps(stage_kwargs(stage, case, work_dir))],
+        cwd=os.path.dirname(script), capture_output=True, text=True)
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('BENCHMARK_RESULT ')]
+    if not lines:
+        return {'error': f"stage process failed (exit {proc.returncode}): {proc.stderr.strip()[-500:]}",
+                'wall_s': None, 'peak_rss_mb': None, 'children_peak_rss_mb': None}
+    return json.loads(lines[-1][len('BENCHMARK_RESULT '):])
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_benchmarks(grid='quick', stages=STAGES, work_root=None, results_dir=RESULTS_DIR):
+    """
+    Runs the stages in pipeline order for every case of the size grid and writes
+    results/<commit>.json. Returns the result dict.
+    """
+    records = []
+    work_root = work_root or tempfile.mkdtemp(prefix='downscaling_bench_')
+    for case in grid_cases(grid):
+        case_id = '_'.join(f'{k}{v}' for k, v in case.items())
+        work_dir = os.path.join(work_root, case_id)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        print(f"\nCase {case_id}")
+        prepare_raw_gcm(case, work_dir)
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            result = run_stage(stage, case, work_dir)
+            work = stage_work(stage, case)
+            record = {'case': case_id, **case, 'stage': stage, 'station_days': work, **result,
+                      'station_days_per_s': work / result['wall_s'] if result['wall_s'] and not result['error'] else None}
+            records.append(record)
+            if result['error']:
+                print(f"  {stage:<11} ERROR {result['error']}")
+            else:
+                print(f"  {stage:<11} {result['wall_s']:8.2f}s  {result['peak_rss_mb']:8.1f} MB  "
+                      f"{record['station_days_per_s']:12.0f} station-days/s")
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    commit = _git_commit()
+    results = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'grid': GRIDS[grid] if isinstance(grid, str) else grid,
+        'records': records,
+    }
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f'{commit}.json')
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f"\nBenchmark results saved to: {path}")
+    return results
+
+
+def _throughput(record):
+    """
+    Station-days per second of a record (recomputed from its case for result files written
+    before the throughput was stored).
+    """
+    if record.get('station_days_per_s') is not None:
+        return record['station_days_per_s']
+    return stage_work(record['stage'], record) / record['wall_s'] if record['wall_s'] else float('nan')
+
+
+def compare_results(old_path, new_path):
+    """
+    Prints wall time, peak RSS and throughput (station-days/s) of two result files side by side
+    for the (case, stage) pairs they share; time and memory ratios below 1 mean the new run is
+    faster / smaller, throughput ratios above 1 mean it processes more station-days per second.
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_records = {(r['case'], r['stage']): r for r in old['records']}
+    print(f"{'case':<38}{'stage':<12}{'old s':>9}{'new s':>9}{'ratio':>7}{'old MB':>9}{'new MB':>9}"
+          f"{'old stn-d/s':>13}{'new stn-d/s':>13}{'ratio':>7}")
+    for r in new['records']:
+        o = old_records.get((r['case'], r['stage']))
+        if o is None or o['error'] or r['error']:
+            continue
+        old_rate, new_rate = _throughput(o), _throughput(r)
+        print(f"{r['case']:<38}{r['stage']:<12}{o['wall_s']:9.2f}{r['wall_s']:9.2f}{r['wall_s'] / o['wall_s']:7.2f}"
+              f"{o['peak_rss_mb']:9.1f}{r['peak_rss_mb']:9.1f}"
+              f"{old_rate:13.0f}{new_rate:13.0f}{new_rate / old_rate:7.2f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == '--measure':
+        measure_call(*sys.argv[2:])
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument('--grid', default='quick', choices=sorted(GRIDS))
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--work-dir', default=None, help="Scratch directory (a temporary one by default)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Compare two result files instead of running")
+    args = parser.parse_args()
+    if args.compare:
+        compare_results(*args.compare)
+    else:
+        run_benchmarks(args.grid, args.stages, args.work_dir)
@@ -0,0 +1,83 @@
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Writes CMIP6-style daily tas/pr NetCDF files for testing and benchmarking without ESGF access:
+# same file naming (var_table_model_experiment_variant_grid_YYYYMMDD-YYYYMMDD.nc), variables,
+# units (K, kg m-2 s-1), float32 data on a regular lat/lon grid and multi-year files.
+
+SUDAN_BOX = (20.0, 40.0, 8.0, 24.0)     # lon_min, lon_max, lat_min, lat_max
+SCENARIO_WARMING = {'historical': 0.0, 'ssp126': 1.0, 'ssp245': 1.8, 'ssp370': 2.4, 'ssp585': 3.0}
+
+
+def _has_netcdf4():
+    try:
+        import netCDF4  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def synthetic_fields(dates, lat, lon, model, scenario, rng):
+    """
+    Daily tas (K) and pr (kg m-2 s-1) arrays (time x lat x lon): seasonal cycle, a north-south
+    gradient, a model-specific bias, scenario warming, and gamma-distributed rain on wet days.
+    """
+    model_rng = np.random.default_rng(zlib.crc32(model.encode()))
+    model_bias = model_rng.normal(0, 1.5)
+    rain_scale = model_rng.uniform(0.7, 1.3)
+
+    doy = dates.dayofyear.to_numpy()[:, np.newaxis, np.newaxis]
+    lat3 = lat[np.newaxis, :, np.newaxis]
+    shape = (len(dates), len(lat), len(lon))
+
+    tas = (273.15 + 25 + 5 * np.sin(2 * np.pi * (doy - 80) / 365.25) + 0.3 * (lat3 - 16)
+           + model_bias + SCENARIO_WARMING.get(scenario, 0.0) + rng.normal(0, 2, shape))
+
+    # Wetter in the south and during the JJAS rainy season
+    wet_prob = np.clip(0.05 + 0.4 * np.exp(-((doy - 220) / 45.0) ** 2) * (24 - lat3) / 16, 0, 1)
+    wet = rng.random(shape) < wet_prob
+    pr = np.where(wet, rng.gamma(2.0, 4.0 * rain_scale, shape), 0.0) / 86400.0
+    return tas.astype(np.float32), pr.astype(np.float32)
+
+
+def write_synthetic_cmip6(output_dir, model, scenario, start_year, n_years, resolution=1.0,
+                          box=SUDAN_BOX, years_per_file=5, seed=0):
+    """
+    Writes tas_day_* and pr_day_* files for one model/scenario covering n_years from start_year,
+    split into years_per_file chunks. Returns the list of written paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    lon_min, lon_max, lat_min, lat_max = box
+    lon = np.arange(lon_min + resolution / 2, lon_max, resolution)
+    lat = np.arange(lat_min + resolution / 2, lat_max, resolution)
+    rng = np.random.default_rng([seed, zlib.crc32(f'{model}_{scenario}'.encode())])
+    compress = _has_netcdf4()
+
+    paths = []
+    for first in range(start_year, start_year + n_years, years_per_file):
+        last = min(first + years_per_file, start_year + n_years) - 1
+        dates = pd.date_range(f'{first}-01-01', f'{last}-12-31', freq='D')
+        tas, pr = synthetic_fields(dates, lat, lon, model, scenario, rng)
+        coords = {
+            'time': dates,
+            'lat': ('lat', lat, {'units': 'degrees_north', 'standard_name': 'latitude'}),
+            'lon': ('lon', lon, {'units': 'degrees_east', 'standard_name': 'longitude'}),
+        }
+        for var, data, attrs in [
+            ('tas', tas, {'units': 'K', 'standard_name': 'air_temperature', 'long_name': 'Near-Surface Air Temperature'}),
+            ('pr', pr, {'units': 'kg m-2 s-1', 'standard_name': 'precipitation_flux', 'long_name': 'Precipitation'}),
+        ]:
+            ds = xr.Dataset({var: (('time', 'lat', 'lon'), data, attrs)}, coords=coords,
+                            attrs={'source_id': model, 'experiment_id': scenario, 'variant_label': 'r1i1p1f1',
+                                   'frequency': 'day', 'comment': 'Synthetic data for testing and benchmarking'})
+            encoding = {'time': {'units': 'days since 1850-01-01', 'calendar': 'proleptic_gregorian'}}
+            if compress:
+                encoding[var] = {'zlib': True, 'complevel': 1}
+            path = os.path.join(output_dir, f'{var}_day_{model}_{scenario}_r1i1p1f1_gn_{first}0101-{last}1231.nc')
+            ds.to_netcdf(path, encoding=encoding)
+            paths.append(path)
+    return paths
@@ -0,0 +1,123 @@
+import queue
+import threading
+
+import pandas as pd
+
+from instrumentation import count
+from interchange import write_table
+
+# Background output writer: building output frames and writing files runs on a few threads while
+# the caller computes the next result.
+#
+#   with BackgroundWriter(n_threads=2, max_pending=8) as writer:
+#       for ...:
+#           result = compute(...)
+#           writer.submit(save, result, path, on_done=..., on_error=...)
+#           writer.append(frame, path, 'gcm_extracted')    # batched: one file per path ...
+#       writer.flush(path)                                  # ... written when flushed
+#
+# Jobs go through a bounded queue: when max_pending jobs are waiting, submit() blocks until a
+# thread takes one, so a slow disk throttles the producer instead of piling results up in memory.
+# append() collects frames per output path in memory and flush() (or close) writes each path once,
+# as one larger file instead of many small ones. on_done(result) / on_error(exception) run on the
+# writer thread after each job; errors without an on_error, and errors raised by on_done / on_error,
+# are kept and raised by close().
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    def __init__(self, n_threads=2, max_pending=8):
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.batches = {}
+        self.errors = []
+        self._lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name=f'background-writer-{i}', daemon=True)
+                        for i in range(n_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is _STOP:
+                self.jobs.task_done()
+                return
+            func, args, kwargs, on_done, on_error = job
+            try:
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    on_error(e)
+                else:
+                    if on_done is not None:
+                        on_done(result)
+            except Exception as e:
+                # Job errors without a handler and errors raised by the callbacks themselves
+                # are kept for close(); the thread goes on with the next job
+                with self._lock:
+                    self.errors.append(e)
+            finally:
+                self.jobs.task_done()
+
+    def submit(self, func, *args, on_done=None, on_error=None, **kwargs):
+        """
+        Queues func(*args, **kwargs) for a writer thread; blocks while the queue is full.
+        """
+        count('writes_queued')
+        self.jobs.put((func, args, kwargs, on_done, on_error))
+
+    def write_table(self, df, path, table, on_done=None, on_error=None):
+        """
+        Queues an interchange write_table; df may be a callable returning the frame, so that
+        building it (merges, reshaping) also happens off the caller's thread.
+        """
+        def build_and_write():
+            return write_table(df() if callable(df) else df, path, table)
+        self.submit(build_and_write, on_done=on_done, on_error=on_error)
+
+    def append(self, df, path, table):
+        """
+        Adds a frame to the batch of path; the batch is written as one table by flush(path).
+        """
+        self.batches.setdefault(path, (table, []))[1].append(df)
+
+    def flush(self, path=None, on_done=None, on_error=None):
+        """
+        Queues the write of the batch of path (of every batch when path is None).
+        """
+        paths = list(self.batches) if path is None else [path]
+        for p in paths:
+            table, frames = self.batches.pop(p, (None, []))
+            if frames:
+                self.write_table(lambda frames=frames: pd.concat(frames, ignore_index=True), p, table,
+                                 on_done=on_done, on_error=on_error)
+
+    def join(self):
+        """
+        Waits until every queued job has finished.
+        """
+        self.jobs.join()
+
+    def close(self, raise_errors=True):
+        """
+        Writes the remaining batches, waits for all jobs and stops the threads. Raises the first
+        error of a job that had no on_error handler or of an on_done / on_error callback.
+        """
+        self.flush()
+        for _ in self.threads:
+            self.jobs.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        if self.errors and raise_errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # On an exception in the with-block, still finish the queued writes but keep that exception
+        self.close(raise_errors=exc_type is None)
+        return False
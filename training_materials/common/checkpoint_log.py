@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+# Durable progress log for long runs made of many independent units of work (e.g. one
+# model/scenario/station/variable bias correction):
+#
+#   checkpoint = load_checkpoint(path)
+#   if not unit_done(checkpoint, key, signature):
+#       ... write the unit's outputs atomically ...
+#       append_record(path, {'unit': key, 'status': 'done', 'signature': signature, 'outputs': [...]})
+#
+# The log is JSON lines, appended and fsync'ed one record at a time after the unit's outputs are
+# committed, so a run that crashes or is killed leaves a log of exactly the finished units; a
+# partially written last line is ignored. The last record of a unit wins. A unit counts as done
+# only while its input signature (paths, sizes and mtimes) is unchanged and its outputs exist,
+# so a restart redoes the units whose inputs changed as well as the unfinished and failed ones.
+
+_append_lock = threading.Lock()     # records may come from background writer threads
+
+
+def unit_key(**fields):
+    return '/'.join(f'{name}={value}' for name, value in fields.items())
+
+
+def input_signature(paths, **settings):
+    """
+    Cheap identity of a unit's inputs: (path, size, mtime) of every file plus any settings
+    (None paths, i.e. optional inputs that are absent, are skipped).
+    """
+    files = []
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            st = os.stat(path)
+            files.append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+        except OSError:
+            files.append([os.path.abspath(path), None, None])
+    return {'files': files, **settings}
+
+
+def load_checkpoint(path):
+    """
+    {unit key: last record} from the log, or {} when there is none.
+    """
+    checkpoint = {}
+    if not os.path.exists(path):
+        return checkpoint
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue        # torn write of a killed run
+            checkpoint[record['unit']] = record
+    return checkpoint
+
+
+def append_record(path, record):
+    """
+    Appends one record and forces it to disk before returning (thread-safe).
+    """
+    record = {**record, 'time': datetime.now().isoformat(timespec='seconds')}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with _append_lock, open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    return record
+
+
+def unit_done(checkpoint, key, signature):
+    record = checkpoint.get(key)
+    return (record is not None and record['status'] == 'done' and record.get('signature') == signature
+            and all(os.path.exists(p) for p in record.get('outputs', [])))
+
+
+def write_report(path, report):
+    """
+    Writes a run report (JSON) under a temporary name, then renames it.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,293 @@
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+
+# Structured per-stage instrumentation for the pipeline scripts.
+#
+#   with stage('adjust', model=model, station=stn_id):
+#       ...
+#       count('rows', len(df))
+#
+# Each stage writes one JSON line when it ends: wall time, peak and delta RSS (sampled in a
+# background thread), counters (rows, files and bytes read/written, ...; a stage's counters are
+# added to its parent's when it ends) and the fields it was given. An optional profiler
+# (cProfile or pyinstrument) can be attached to named stages.
+#
+# Instrumentation is off unless configure() is called or PIPELINE_TRACE names the JSON-lines
+# file; the environment variables are inherited by stage subprocesses. When off, stage() returns
+# a shared no-op context manager and count() returns immediately, so the pipeline scripts import
+# and call stage() / count() / instrumented() unconditionally: they only record timings, memory
+# and counters when PIPELINE_TRACE is set.
+#
+#   PIPELINE_TRACE=trace.jsonl             events file
+#   PIPELINE_PROFILE=cprofile|pyinstrument  profiler attached to profiled stages
+#   PIPELINE_PROFILE_STAGES=adjust,...     stages to profile (all outermost stages by default)
+#   PIPELINE_PROFILE_DIR=profiles          where .prof / .html profiles go
+
+_config = {'enabled': False}
+_lock = threading.Lock()
+_local = threading.local()
+_active = []            # open stages of every thread, for the memory sampler
+_sampler = None
+
+
+def _read_rss():
+    """
+    Resident set size of this process in bytes, or None when it cannot be read
+    (psutil when installed, else /proc on Linux).
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _start_sampler():
+    global _sampler
+    if _config['enabled'] and (_sampler is None or not _sampler.is_alive()):
+        _sampler = _MemorySampler(_config['sample_interval'])
+        _sampler.start()
+
+
+class _MemorySampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='instrumentation-memory-sampler', daemon=True)
+        self.interval = interval
+
+    def run(self):
+        while _config['enabled']:
+            rss = _read_rss()
+            if rss is not None:
+                with _lock:
+                    for s in _active:
+                        if rss > s.peak_rss:
+                            s.peak_rss = rss
+            time.sleep(self.interval)
+
+
+def configure(trace_path=None, profile=None, profile_stages=None, profile_dir=None, sample_interval=0.01):
+    """
+    Enables instrumentation, writing events to trace_path (appended). profile is None,
+    'cprofile' or 'pyinstrument'; profile_stages limits profiling to the named stages (otherwise
+    every outermost stage is profiled). Passing trace_path=None disables instrumentation.
+    """
+    _config.update({
+        'enabled': trace_path is not None,
+        'trace_path': trace_path,
+        'profile': profile,
+        'profile_stages': set(profile_stages) if profile_stages else None,
+        'profile_dir': profile_dir or (os.path.join(os.path.dirname(os.path.abspath(trace_path)), 'profiles') if trace_path else None),
+        'sample_interval': sample_interval,
+    })
+    if _config['enabled']:
+        os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+        _start_sampler()
+
+
+def configure_from_env():
+    profile_stages = os.environ.get('PIPELINE_PROFILE_STAGES')
+    configure(os.environ.get('PIPELINE_TRACE') or None,
+              profile=os.environ.get('PIPELINE_PROFILE') or None,
+              profile_stages=profile_stages.split(',') if profile_stages else None,
+              profile_dir=os.environ.get('PIPELINE_PROFILE_DIR') or None)
+
+
+def enabled():
+    return _config['enabled']
+
+
+def _write_event(record):
+    line = json.dumps(record, default=str) + '\n'
+    with _lock:
+        # One write per line in append mode, so several processes can share the file
+        with open(_config['trace_path'], 'a') as f:
+            f.write(line)
+
+
+def event(name, **fields):
+    """
+    Writes a single point-in-time event (no timing).
+    """
+    if not _config['enabled']:
+        return
+    _write_event({'event': name, 'time': datetime.now().isoformat(), 'pid': os.getpid(), **fields})
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def count(key, n=1):
+    """
+    Adds n to a counter of the innermost open stage of this thread (or, from a thread with no
+    open stage, of the most recently opened stage of any thread).
+    """
+    if not _config['enabled']:
+        return
+    stack = _stack()
+    target = stack[-1] if stack else (_active[-1] if _active else None)
+    if target is not None:
+        with _lock:
+            target.counters[key] = target.counters.get(key, 0) + n
+
+
+class _NullStage:
+    fields = {}
+    counters = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, key, n=1):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.counters = {}
+        self.profiler = None
+
+    def count(self, key, n=1):
+        with _lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def _start_profiler(self, stack):
+        kind = _config['profile']
+        wanted = _config['profile_stages']
+        if not kind or (wanted is not None and self.name not in wanted) or (wanted is None and stack):
+            return
+        if any(s.profiler is not None for s in stack):
+            return      # one profiler at a time
+        if kind == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif kind == 'pyinstrument':
+            from pyinstrument import Profiler
+            self.profiler = Profiler()
+            self.profiler.start()
+
+    def _stop_profiler(self):
+        os.makedirs(_config['profile_dir'], exist_ok=True)
+        base = os.path.join(_config['profile_dir'], f"{self.name}_{os.getpid()}_{int(time.time() * 1000)}")
+        if _config['profile'] == 'cprofile':
+            self.profiler.disable()
+            self.profiler.dump_stats(base + '.prof')
+            return base + '.prof'
+        self.profiler.stop()
+        with open(base + '.html', 'w') as f:
+            f.write(self.profiler.output_html())
+        return base + '.html'
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1].name if stack else None
+        self.depth = len(stack)
+        self.started = datetime.now().isoformat()
+        self.start_rss = _read_rss() or 0
+        self.peak_rss = self.start_rss
+        with _lock:
+            _active.append(self)
+        self._start_profiler(stack)
+        stack.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.t0
+        profile_path = self._stop_profiler() if self.profiler is not None else None
+        stack = _stack()
+        stack.pop()
+        end_rss = _read_rss() or 0
+        with _lock:
+            _active.remove(self)
+            self.peak_rss = max(self.peak_rss, end_rss)
+            if stack:
+                parent = stack[-1]
+                for key, n in self.counters.items():
+                    parent.counters[key] = parent.counters.get(key, 0) + n
+                parent.peak_rss = max(parent.peak_rss, self.peak_rss)
+        record = {
+            'event': 'stage',
+            'name': self.name,
+            'parent': self.parent,
+            'depth': self.depth,
+            'status': 'ok' if exc_type is None else 'error',
+            'started': self.started,
+            'wall_s': round(wall, 6),
+            'peak_rss_mb': round(self.peak_rss / 2 ** 20, 2),
+            'rss_delta_mb': round((end_rss - self.start_rss) / 2 ** 20, 2),
+            'counters': self.counters,
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            **self.fields,
+        }
+        if exc_type is not None:
+            record['error'] = f"{exc_type.__name__}: {exc}"
+        if profile_path:
+            record['profile'] = profile_path
+        _write_event(record)
+        return False
+
+
+def stage(name, **fields):
+    """
+    Context manager timing one step; fields (model, scenario, station, ...) are added to its event.
+    """
+    if not _config['enabled']:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+def instrumented(name=None):
+    """
+    Decorator running the whole function as a stage (named after the function by default).
+    """
+    def decorate(func):
+        stage_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _config['enabled']:
+                return func(*args, **kwargs)
+            with _Stage(stage_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _after_fork_in_child():
+    # Threads do not survive fork: forked pool workers start their own sampler and stack
+    global _sampler, _lock
+    _lock = threading.Lock()
+    _sampler = None
+    _active.clear()
+    _local.stack = []
+    _start_sampler()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+configure_from_env()
@@ -0,0 +1,128 @@
+import json
+import os
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from instrumentation import count
+
+# Tables exchanged between the Python and R stages are stored as Arrow IPC (Feather v2) files
+# with the column layout defined once in interchange_schema.json, which interchange.R reads too.
+# Files are written uncompressed so readers can memory-map them: dates arrive as date32 and
+# values as float32 without any text parsing. CSV files from older runs are still read, with the
+# same column types, when no Feather file exists. The pipeline scripts read and write every
+# table shared with the R scripts through read_table() / write_table() / table_filename() here.
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'interchange_schema.json')
+FEATHER_EXT = '.feather'
+
+ARROW_TYPES = {
+    'date32': pa.date32(),
+    'string': pa.string(),
+    'float32': pa.float32(),
+    'float64': pa.float64(),
+    'uint8': pa.uint8(),
+}
+
+
+@lru_cache(maxsize=1)
+def load_schema(path=SCHEMA_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def table_columns(table):
+    """
+    {column: type name} of one interchange table, in file order.
+    """
+    return load_schema()['tables'][table]['columns']
+
+
+def table_filename(table, **fields):
+    """
+    File name of a table instance, e.g. table_filename('temp_bc', model=..., scenario=..., station=...).
+    """
+    return load_schema()['tables'][table]['file'].format(**fields)
+
+
+def arrow_schema(table):
+    return pa.schema([(name, ARROW_TYPES[type_name]) for name, type_name in table_columns(table).items()])
+
+
+def find_table(path):
+    """
+    Existing file for a table path: the Feather file, else a CSV with the same stem, else None.
+    """
+    stem = os.path.splitext(path)[0]
+    for candidate in (stem + FEATHER_EXT, stem + '.csv'):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def _to_arrow(values, type_name):
+    if type_name == 'date32':
+        return pa.array(pd.to_datetime(values).to_numpy(dtype='datetime64[ns]')).cast(pa.date32())
+    return pa.array(values, type=ARROW_TYPES[type_name], from_pandas=True)
+
+
+def write_table(df, path, table):
+    """
+    Writes df as a Feather file laid out as the schema table (columns cast to their declared
+    types; extra columns are kept after them with inferred types). The path's extension is
+    replaced by .feather and the file is written under a temporary name, then renamed.
+    Returns the written path.
+    """
+    columns = table_columns(table)
+    missing = [name for name in columns if name not in df.columns]
+    if missing:
+        raise ValueError(f"Columns missing for interchange table '{table}': {missing}")
+
+    arrays = [_to_arrow(df[name], type_name) for name, type_name in columns.items()]
+    names = list(columns)
+    for name in df.columns:
+        if name not in columns:
+            arrays.append(pa.array(df[name], from_pandas=True))
+            names.append(name)
+
+    path = os.path.splitext(path)[0] + FEATHER_EXT
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    feather.write_feather(pa.Table.from_arrays(arrays, names=names), tmp_path,
+                          compression=load_schema().get('compression', 'uncompressed'))
+    os.replace(tmp_path, path)
+    count('files_written')
+    count('bytes_written', os.path.getsize(path))
+    count('rows_written', len(df))
+    return path
+
+
+def read_table(path, table=None, columns=None):
+    """
+    Reads an interchange table as a DataFrame (date columns as datetime64[ns]), memory-mapping
+    the Feather file. Falls back to a CSV with the same stem, parsed with the schema's types
+    when table is given. Raises FileNotFoundError when neither exists.
+    """
+    found = find_table(path)
+    if found is None:
+        raise FileNotFoundError(f"No Feather or CSV file for {path}")
+
+    types = table_columns(table) if table else {}
+    if found.endswith(FEATHER_EXT):
+        df = feather.read_table(found, columns=columns, memory_map=True).to_pandas(date_as_object=False)
+    else:
+        usecols = list(columns) if columns else None
+        dtypes = {name: 'float32' for name, t in types.items() if t == 'float32' and (usecols is None or name in usecols)}
+        dtypes.update({name: str for name, t in types.items() if t == 'string' and (usecols is None or name in usecols)})
+        df = pd.read_csv(found, usecols=usecols, dtype=dtypes)
+
+    date_cols = [name for name, t in types.items() if t == 'date32'] or ['Date']
+    for name in date_cols:
+        if name in df.columns:
+            df[name] = pd.to_datetime(df[name]).astype('datetime64[ns]')
+    count('files_read')
+    count('bytes_read', os.path.getsize(found))
+    count('rows_read', len(df))
+    return df
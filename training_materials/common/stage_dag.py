@@ -0,0 +1,278 @@
+import hashlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+# A pipeline stage is a plain dict:
+#   {'name': ..., 'command': [argv], 'cwd': ..., 'env': {...},
+#    'inputs': [files or directories read], 'outputs': [files or directories written],
+#    'optional_inputs': [files or directories read when present]}
+# Dependencies are derived from the paths: a stage depends on every stage whose output is one
+# of its inputs or contains / is contained in one. Stages producing optional inputs are waited
+# for, but their failure does not stop the stage (it then runs without those inputs). Before
+# running, a stage's key is computed from the content digests of its inputs, its command and its
+# code files; when the key matches the last successful run and all outputs exist, the stage is
+# skipped. Independent stages run
+# concurrently, each as its own process.
+
+STATE_FILENAME = 'stage_cache.json'
+MEMO_FILENAME = 'digest_memo.json'
+COMMON_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _code_files(script):
+    """
+    Source files a stage's behaviour depends on: the scripts and helper modules next to it
+    (same language) plus the shared modules and schema in common/.
+    """
+    ext = os.path.splitext(script)[1]
+    script_dir = os.path.dirname(script)
+    files = [os.path.join(script_dir, f) for f in os.listdir(script_dir) if f.endswith(ext)]
+    files += [os.path.join(COMMON_DIR, f) for f in os.listdir(COMMON_DIR) if f.endswith(('.py', '.R', '.json'))]
+    return sorted(files)
+
+
+def python_stage(name, script, function, inputs, outputs, optional_inputs=(), **kwargs):
+    """
+    Stage that calls function(**kwargs) from a pipeline script in a fresh Python process
+    (scripts have numeric names, so they are loaded by path rather than imported).
+    """
+    script = os.path.abspath(script)
+    return {
+        'name': name,
+        'command': [sys.executable, os.path.abspath(__file__), 'call', script, function, json.dumps(kwargs, sort_keys=True)],
+        'cwd': os.path.dirname(script),
+        'code': _code_files(script),
+        'inputs': list(inputs),
+        'outputs': list(outputs),
+        'optional_inputs': list(optional_inputs),
+    }
+
+
+def r_stage(name, script, inputs, outputs, env=None, optional_inputs=()):
+    """
+    Stage that runs an R script with Rscript from its own directory (its default paths are
+    relative to it); paths can be overridden through environment variables.
+    """
+    script = os.path.abspath(script)
+    return {
+        'name': name,
+        'command': ['Rscript', os.path.basename(script)],
+        'cwd': os.path.dirname(script),
+        'env': dict(env or {}),
+        'code': _code_files(script),
+        'inputs': list(inputs),
+        'outputs': list(outputs),
+        'optional_inputs': list(optional_inputs),
+    }
+
+
+def _file_digest(path, memo, chunk_size=1 << 20):
+    """
+    SHA-256 of a file, reusing the memoized digest while its size and mtime are unchanged.
+    """
+    st = os.stat(path)
+    record = memo.get(path)
+    if record and record[0] == st.st_size and record[1] == st.st_mtime_ns:
+        return record[2]
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    memo[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    return memo[path][2]
+
+
+def path_digest(path, memo):
+    """
+    Content digest of a file or of a directory tree (relative paths and file digests),
+    or None when the path does not exist.
+    """
+    path = os.path.abspath(path)
+    if os.path.isfile(path):
+        return _file_digest(path, memo)
+    if not os.path.isdir(path):
+        return None
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.tmp'):
+                continue
+            file_path = os.path.join(root, name)
+            h.update(os.path.relpath(file_path, path).encode())
+            h.update(_file_digest(file_path, memo).encode())
+    return h.hexdigest()
+
+
+def stage_key(stage, memo):
+    payload = json.dumps({
+        'command': stage['command'],
+        'env': stage.get('env', {}),
+        'code': {p: path_digest(p, memo) for p in stage.get('code', [])},
+        'inputs': {p: path_digest(p, memo) for p in stage['inputs'] + stage.get('optional_inputs', [])},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _overlaps(a, b):
+    a, b = os.path.abspath(a), os.path.abspath(b)
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def _upstream(stage, stages, inputs):
+    return {u['name'] for u in stages if u is not stage
+            and any(_overlaps(i, o) for i in inputs for o in u['outputs'])}
+
+
+def stage_dependencies(stages, optional=True):
+    """
+    {stage name: set of upstream stage names} derived from overlapping input/output paths
+    (with optional=False, only through the required inputs).
+    Raises ValueError on duplicate names or a cycle.
+    """
+    names = [s['name'] for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names: {names}")
+    deps = {
+        s['name']: _upstream(s, stages, s['inputs'] + (s.get('optional_inputs', []) if optional else []))
+        for s in stages
+    }
+    # Cycle check (Kahn)
+    remaining = {name: set(d) for name, d in deps.items()}
+    while remaining:
+        ready = [name for name, d in remaining.items() if not d]
+        if not ready:
+            raise ValueError(f"Stage dependency cycle among: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for d in remaining.values():
+            d.difference_update(ready)
+    return deps
+
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _execute(stage, log_path):
+    """
+    Runs one stage's command, with stdout/stderr going to its log file. Returns (returncode, wall seconds).
+    """
+    start = time.perf_counter()
+    env = dict(os.environ, **stage.get('env', {}))
+    with open(log_path, 'w') as log:
+        try:
+            returncode = subprocess.run(stage['command'], cwd=stage.get('cwd'), env=env,
+                                        stdout=log, stderr=subprocess.STDOUT).returncode
+        except OSError as e:
+            log.write(f"Could not start stage: {e}\n")
+            returncode = -1
+    return returncode, time.perf_counter() - start
+
+
+def run_dag(stages, state_dir, max_workers=None, force=False):
+    """
+    Runs the stages in dependency order, concurrently where independent, skipping stages whose
+    inputs, command and code are unchanged since their last successful run (force=True reruns all).
+    Stages downstream of a failure are not run, unless the failed stage only produces their
+    optional inputs.
+    The run report (status and wall time per stage) is written to state_dir/reports/ and returned.
+    """
+    os.makedirs(os.path.join(state_dir, 'logs'), exist_ok=True)
+    os.makedirs(os.path.join(state_dir, 'reports'), exist_ok=True)
+    state_path = os.path.join(state_dir, STATE_FILENAME)
+    memo_path = os.path.join(state_dir, MEMO_FILENAME)
+    state = _load_json(state_path, {})
+    memo = _load_json(memo_path, {})
+
+    deps = stage_dependencies(stages)
+    required = stage_dependencies(stages, optional=False)
+    by_name = {s['name']: s for s in stages}
+    report = {'started': datetime.now().isoformat(timespec='seconds'), 'stages': {}}
+    run_start = time.perf_counter()
+    pending = set(by_name)
+    running = {}
+
+    def record(name, status, wall=0.0, key=None):
+        report['stages'][name] = {'status': status, 'wall_s': round(wall, 3), 'key': key,
+                                  'upstream': sorted(deps[name])}
+        print(f"  [{status:>15}] {name} ({wall:.1f}s)")
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+        while pending or running:
+            for name in sorted(pending):
+                upstream = {d: report['stages'].get(d, {}).get('status') for d in deps[name]}
+                if any(s is None for s in upstream.values()):
+                    continue
+                pending.discard(name)
+                if any(upstream[d] not in ('ran', 'cached') for d in required[name]):
+                    record(name, 'upstream_failed')
+                    continue
+                missing = sorted(d for d, s in upstream.items() if s not in ('ran', 'cached'))
+                if missing:
+                    print(f"  {name}: running without the optional inputs of {', '.join(missing)}")
+                stage = by_name[name]
+                key = stage_key(stage, memo)
+                if (not force and state.get(name) == key
+                        and all(os.path.exists(p) for p in stage['outputs'])):
+                    record(name, 'cached', key=key)
+                    continue
+                future = pool.submit(_execute, stage, os.path.join(state_dir, 'logs', f'{name}.log'))
+                running[future] = (name, key)
+                print(f"  [{'started':>15}] {name}")
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, key = running.pop(future)
+                returncode, wall = future.result()
+                if returncode == 0:
+                    state[name] = key
+                    record(name, 'ran', wall, key)
+                else:
+                    state.pop(name, None)
+                    record(name, 'failed', wall, key)
+                    report['stages'][name]['returncode'] = returncode
+            _save_json(state_path, state)
+
+    report['wall_s'] = round(time.perf_counter() - run_start, 3)
+    _save_json(memo_path, {p: record for p, record in memo.items() if os.path.exists(p)})
+    report_path = os.path.join(state_dir, 'reports', f"run_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json")
+    _save_json(report_path, report)
+    _save_json(os.path.join(state_dir, 'reports', 'latest.json'), report)
+    print(f"Pipeline finished in {report['wall_s']:.1f}s. Run report: {report_path}")
+    return report
+
+
+def call_script_function(script, function, kwargs_json):
+    """
+    Entry point of a python_stage process: loads the script by path and calls the function.
+    """
+    sys.path.insert(0, os.path.dirname(script))
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(script))[0].replace('.', '_'), script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    getattr(module, function)(**json.loads(kwargs_json))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == 'call':
+        call_script_function(*sys.argv[2:])
+    else:
+        sys.exit("Usage: stage_dag.py call <script> <function> <json kwargs>")
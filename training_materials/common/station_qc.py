@@ -0,0 +1,208 @@
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, instrumented, stage
+from interchange import find_table, read_table, table_filename, write_table
+
+# Quality control of the station observations, run between station ingest and bias correction.
+#
+# All stations are checked at once: the long (Date, Station_ID, value) table is scattered into
+# dense (station x day) arrays over the full daily calendar, and every check is an array or
+# rolling-window operation on those blocks. The result is one uint8 bit-flag per station, day and
+# variable, stored (only for flagged cells) as the station_qc interchange table next to the
+# station data. Later stages read it with load_qc_flags() and apply_qc_flags(), which drops
+# duplicate dates and blanks the values carrying any REJECT flag.
+
+GAP = 1             # no valid observation on this day (missing date or value)
+RANGE = 2           # outside physical limits (e.g. negative rainfall)
+SPIKE = 4           # isolated jump (temperature) / extreme outlier (rainfall)
+STEP = 8            # shift of the running mean (inhomogeneity)
+FLATLINE = 16       # the same value repeated for many days
+DUPLICATE = 32      # several rows for this date; only the first is kept
+FLAG_NAMES = {GAP: 'gap', RANGE: 'range', SPIKE: 'spike', STEP: 'step', FLATLINE: 'flatline', DUPLICATE: 'duplicate'}
+REJECT = RANGE | SPIKE | STEP | FLATLINE
+
+QC_LIMITS = {
+    'Temperature_C': {
+        'range': (-15.0, 55.0),
+        'spike': 10.0,          # degC jump to and back from a day
+        'step': 6.0,            # degC between the means of the step_window days before and after
+        'step_window': 15,
+        'flatline': 5,          # identical consecutive values
+    },
+    'Precipitation_mm_day': {
+        'range': (0.0, 500.0),
+        'spike_factor': 4.0,    # times the station's 99th percentile of wet days
+        'flatline': 5,          # identical consecutive non-zero values
+    },
+}
+
+
+def station_day_block(df, variables):
+    """
+    Scatters a long frame into (station x day) arrays over its full daily calendar.
+    Returns station IDs, dates, {var: float array} (first row of a duplicated date) and a
+    boolean array marking the duplicated (station, day) cells.
+    """
+    station_ids = np.sort(pd.unique(df['Station_ID'].astype(str)))
+    dates = pd.date_range(df['Date'].min(), df['Date'].max(), freq='D')
+    n_days = len(dates)
+    stn_codes = pd.Categorical(df['Station_ID'].astype(str), categories=station_ids).codes
+    day_idx = ((pd.to_datetime(df['Date']) - dates[0]) // pd.Timedelta(days=1)).to_numpy()
+    cell = stn_codes.astype(np.int64) * n_days + day_idx
+
+    # First occurrence of each cell in file order (stable sort); the rest are duplicates
+    order = np.argsort(cell, kind='stable')
+    first = np.ones(len(cell), dtype=bool)
+    first[1:] = cell[order][1:] != cell[order][:-1]
+    keep = order[first]
+    duplicated = np.zeros(len(station_ids) * n_days, dtype=bool)
+    duplicated[cell[order][~first]] = True
+
+    values = {}
+    for var in variables:
+        block = np.full(len(station_ids) * n_days, np.nan)
+        block[cell[keep]] = df[var].to_numpy(dtype=float)[keep]
+        values[var] = block.reshape(len(station_ids), n_days)
+    return station_ids, dates, values, duplicated.reshape(len(station_ids), n_days)
+
+
+def _rolling_mean(x, window, before):
+    """
+    NaN-aware mean of the window days before (excluding) or from (including) each day,
+    with the number of valid days, via cumulative sums along the time axis.
+    """
+    valid = np.isfinite(x)
+    csum = np.concatenate([np.zeros((x.shape[0], 1)), np.cumsum(np.where(valid, x, 0.0), axis=1)], axis=1)
+    ccount = np.concatenate([np.zeros((x.shape[0], 1)), np.cumsum(valid, axis=1)], axis=1)
+    t = np.arange(x.shape[1])
+    lo, hi = (np.maximum(t - window, 0), t) if before else (t, np.minimum(t + window, x.shape[1]))
+    total, n = csum[:, hi] - csum[:, lo], ccount[:, hi] - ccount[:, lo]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / n, n
+
+
+def run_lengths(x, ignore_zero=False):
+    """
+    Length of the run of identical consecutive values each day belongs to (1 for NaN days).
+    """
+    same = np.zeros(x.shape, dtype=bool)
+    same[:, 1:] = (x[:, 1:] == x[:, :-1]) & np.isfinite(x[:, 1:])
+    if ignore_zero:
+        same[:, 1:] &= x[:, 1:] != 0
+    run_id = np.cumsum(~same.ravel())       # the first day of every station starts a run
+    return np.bincount(run_id)[run_id].reshape(x.shape)
+
+
+def qc_flags(x, limits, precipitation=False):
+    """
+    Bit flags (uint8, station x day) of one variable's (station x day) array.
+    """
+    flags = np.zeros(x.shape, dtype=np.uint8)
+    valid = np.isfinite(x)
+    flags[~valid] |= GAP
+
+    lo, hi = limits['range']
+    out_of_range = valid & ((x < lo) | (x > hi))
+    flags[out_of_range] |= RANGE
+    x = np.where(out_of_range, np.nan, x)
+
+    if precipitation:
+        with np.errstate(invalid='ignore'):
+            wet = np.where(x > 0, x, np.nan)
+        if np.isfinite(wet).any():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)     # stations without wet days
+                q99 = np.nanpercentile(wet, 99, axis=1)
+            flags[x > limits['spike_factor'] * q99[:, np.newaxis]] |= SPIKE
+    else:
+        # A spike jumps away from the previous day and back on the next one
+        d = np.diff(x, axis=1)
+        thr = limits['spike']
+        spike = np.zeros(x.shape, dtype=bool)
+        spike[:, 1:-1] = (np.abs(d[:, :-1]) > thr) & (np.abs(d[:, 1:]) > thr) & (np.sign(d[:, :-1]) != np.sign(d[:, 1:]))
+        flags[spike] |= SPIKE
+
+        window = limits['step_window']
+        before, n_before = _rolling_mean(x, window, before=True)
+        after, n_after = _rolling_mean(x, window, before=False)
+        enough = (n_before >= window // 2) & (n_after >= window // 2)
+        with np.errstate(invalid='ignore'):
+            flags[enough & (np.abs(after - before) > limits['step'])] |= STEP
+
+    flags[run_lengths(x, ignore_zero=precipitation) >= limits['flatline']] |= FLATLINE
+    return flags
+
+
+@instrumented()
+def quality_control_stations(station_data_path='../../data/station_data/generated_station_data.feather',
+                             output_dir=None, limits=None):
+    """
+    Flags every station's observations (range, spike, step, flat-line, duplicate and gap checks)
+    and writes the station_qc table (flagged cells only) to output_dir (default: next to the
+    station data). Returns the written path.
+    """
+    limits = {var: dict(QC_LIMITS[var], **(limits or {}).get(var, {})) for var in QC_LIMITS}
+    output_dir = output_dir or os.path.dirname(os.path.abspath(station_data_path))
+    print("Running quality control on the station observations ....")
+    obs_df = read_table(station_data_path, 'station_data')
+
+    with stage('qc_checks', stations=obs_df['Station_ID'].nunique()):
+        station_ids, dates, values, duplicated = station_day_block(obs_df, list(limits))
+        flags = {}
+        for var, var_limits in limits.items():
+            flags[var] = qc_flags(values[var], var_limits, precipitation=var.startswith('Precipitation'))
+            flags[var][duplicated] |= DUPLICATE
+        count('rows', len(obs_df))
+        count('cells', values[var].size)
+
+    # Compact output: one row per (station, day) with any flag set
+    flagged = np.logical_or.reduce([f != 0 for f in flags.values()])
+    stn_idx, day_idx = np.nonzero(flagged)
+    qc_df = pd.DataFrame({'Date': dates[day_idx], 'Station_ID': station_ids[stn_idx]})
+    for var in limits:
+        qc_df[f'{var}_QC'] = flags[var][stn_idx, day_idx]
+    output_path = write_table(qc_df, os.path.join(output_dir, table_filename('station_qc')), 'station_qc')
+
+    print(f"  {len(station_ids)} stations x {len(dates)} days checked.")
+    for var in limits:
+        counts = ', '.join(f"{name} {int(((flags[var] & bit) != 0).sum())}" for bit, name in FLAG_NAMES.items())
+        print(f"  {var}: {counts}")
+    print(f"QC flags saved to: {output_path}")
+    return output_path
+
+
+def load_qc_flags(station_data_path, qc_flags_path=None):
+    """
+    The station_qc table for the station data (by default the one next to it).
+    Returns (flags frame, path), or (None, None) when there is none.
+    """
+    path = find_table(qc_flags_path or os.path.join(os.path.dirname(os.path.abspath(station_data_path)), table_filename('station_qc')))
+    if path is None:
+        return None, None
+    return read_table(path, 'station_qc'), path
+
+
+def apply_qc_flags(obs_df, flags_df, reject=REJECT):
+    """
+    Observations with duplicate dates dropped (first row kept) and values whose flags
+    intersect reject set to NaN. obs_df is a long frame with Date and Station_ID columns.
+    """
+    obs_df = obs_df.drop_duplicates(['Station_ID', 'Date'], keep='first')
+    if flags_df is None or flags_df.empty:
+        return obs_df
+    obs_df = obs_df.copy()
+    merged = obs_df[['Station_ID', 'Date']].merge(flags_df, on=['Station_ID', 'Date'], how='left')
+    for column in flags_df.columns:
+        var = column[:-len('_QC')] if column.endswith('_QC') else None
+        if var in obs_df.columns:
+            rejected = (merged[column].fillna(0).to_numpy(dtype=np.uint8) & reject) != 0
+            obs_df[var] = obs_df[var].where(~rejected)
+    return obs_df
+
+
+if __name__ == "__main__":
+    quality_control_stations()
@@ -3,166 +3,239 @@ import pandas as pd
 import numpy as np
 from cmethods import adjust       # For bias correction
 import os
+import sys
+from datetime import datetime
+from functools import partial
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common'))
+from interchange import find_table, read_table, table_filename
+from instrumentation import instrumented, stage
+from checkpoint_log import append_record, input_signature, load_checkpoint, unit_done, unit_key, write_report
+from background_writer import BackgroundWriter
+from station_qc import apply_qc_flags, load_qc_flags
+from gridded_bias_correction import gridded_bias_correction
+
+# Corrected variables: (cmethods kind, interchange table of the output)
+BC_VARIABLES = {
+    'Temperature_C': ('+', 'temp_bc'),              # Additive correction for temperature
+    'Precipitation_mm_day': ('*', 'precip_bc'),     # Multiplicative correction for precipitation
+}
+CHECKPOINT_FILENAME = 'bias_correction_checkpoint.jsonl'
+REPORT_FILENAME = 'bias_correction_report.json'
+
+
+def correct_series(obs, simh, simp, kind):
+    """
+    Quantile-maps one station's simulated series (date-indexed Series).
+    Returns the corrected and the raw simulated series as DataArrays.
+    """
+    # Convert observations and model data to xarray DataArray for cmethods, sorted by time
+    # (days masked by the station QC are left out of the observed distribution)
+    obs_xr = obs.dropna().to_xarray().rename({'Date': 'time'}).sortby('time')
+    simh_xr = simh.to_xarray().rename({'Date': 'time'}).sortby('time')
+    simp_xr = simp.to_xarray().rename({'Date': 'time'}).sortby('time')
+    
+    # cmethods' quantile_mapping handles zeros by default for multiplicative kind
+    bc = adjust(
+        method= "quantile_mapping",
+        obs = obs_xr,
+        simh = simh_xr,
+        simp = simp_xr,
+        kind = kind,
+        group = "time.month"     # Apply monthly
+    )
+    return bc, simp_xr
+
+
+def bc_frame(bc, simp_xr, variable, model, scenario, stn_id):
+    """
+    Raw and bias-corrected values of one station/scenario/model as an interchange frame.
+    """
+    bc_df = bc.to_dataframe(name=f'{variable}_BC')
+    bc_df['Station_ID'] = stn_id
+    bc_df['Scenario'] = scenario
+    bc_df['Model'] = model
+    bc_df['Variable'] = variable
+    
+    # Combine raw (for comparison) and bias-corrected for this station/scenario/model
+    raw_df = simp_xr.to_dataframe(name=f'{variable}_Raw')
+    combined_df = pd.merge(raw_df[[f'{variable}_Raw']], bc_df, left_index=True, right_index=True, how='outer')
+    return combined_df.reset_index().rename(columns={'time': 'Date'})
+
+
+@instrumented()
 def perform_bias_correction(
-    station_data_path = '../../data/station_data/generated_station_data.csv',
+    station_data_path = '../../data/station_data/generated_station_data.feather',
     processed_gcm_dir= '../../data/processed_gcm',
-    output_dir = '../../output/bias_corrected'
+    output_dir = '../../output/bias_corrected',
+    gcm_config = None,
+    mode = 'station',
+    gcm_raw_dir = '../../data/raw_gcm',
+    reference_paths = None,
+    grid_chunks = None,
+    n_workers = None,
+    output_format = 'netcdf',
+    resume = True,
+    raise_on_failure = True,
+    write_threads = 2,
+    qc_flags_path = None,
+    historical_period = '1991-2020'
 ):
     """
     Performs bias correction using Quantile Mapping from python-cmethods library.
-    Trains on hostorical period (1991-2020) and applies to future scenarios (2041-2070) 
+    Trains on hostorical period (historical_period, 1991-2020 by default) and applies to future scenarios
+    gcm_config: list of {'model', 'scenario', 'time_period'} dicts (defaults to the list below);
+    each model's training run is its historical config whose time_period is historical_period.
+    mode='gridded' corrects the raw GCM fields on every grid cell against a gridded reference
+    dataset instead of the station series: reference_paths = {'tas': file/glob, 'pr': ...},
+    processed in (lat, lon) blocks of grid_chunks on n_workers threads; the corrected cubes
+    are written to output_dir/gridded as output_format 'netcdf' or 'zarr' (see gridded_bias_correction.py).
+    Each (model, scenario, station, variable) is recorded in output_dir/bias_correction_checkpoint.jsonl
+    once its output is written; with resume, a rerun skips the recorded units whose inputs are
+    unchanged (resume=False starts over). Failed units are listed in bias_correction_report.json
+    and, with raise_on_failure, make the run raise at the end. Returns the report.
+    Output frames are built and written on write_threads background threads while the next
+    unit is corrected.
+    Observations flagged by the station QC (qc_flags_path, by default the station_qc table next
+    to the station data, when present) are masked out before training.
     """
+    if mode == 'gridded':
+        print("Starting gridded bias correction ....")
+        return gridded_bias_correction(gcm_raw_dir, reference_paths, os.path.join(output_dir, 'gridded'),
+                                       gcm_config or [], historical_period=historical_period,
+                                       chunks=grid_chunks, n_workers=n_workers, output_format=output_format)
+
     print("Starting bias correction using python-cmethods library ....")
     
     # Load observed station data
-    obs_df = pd.read_csv(station_data_path, parse_dates=True)
+    station_data_path = find_table(station_data_path) or station_data_path
+    obs_df = read_table(station_data_path, 'station_data')
+    qc_flags, qc_flags_path = load_qc_flags(station_data_path, qc_flags_path)
+    if qc_flags is not None:
+        obs_df = apply_qc_flags(obs_df, qc_flags)
+        print(f"   Applied station QC flags from {qc_flags_path}.")
     obs_df = obs_df.set_index('Date')
-    print(f"   Loaded observed data for {obs_df.unique()} stations.")
+    print(f"   Loaded observed data for {obs_df['Station_ID'].nunique()} stations.")
     
     os.makedirs(output_dir, exist_ok= True)
     
-    # Define historical and future periods
-    historical_period = '1991-2020'
-    future_period = '2041-2070'           # Example future period
-    
     # Define GCM models and scenarios to process (must match preprocessed files)
     
-    gcm_config= []
+    if gcm_config is None:
+        gcm_config= []
     
     # Group GCM data by model for eaiser processing
-    gcm_data_by_model = {}
-    for config in gcm_config:
-        model = config['model']
-        scenario = config['scenario']
-        time_period = config['time_period']
-        filename = f"gcm_extracted_{model}_{scenario}_{time_period}.csv"
-        filepath = os.path.join(processed_gcm_dir, filename)
-        
-        if not os.path.exists(filepath):
-            print(f"Warning: Preprocessed GCM file not found: {filepath}. Skipping this config.")
-            continue
-        df = pd.read_csv(filepath, parse_dates = True)
-        df = df.set_index('Date')
-        
-        if model not in gcm_data_by_model:
-            gcm_data_by_model[model] = {}
-        gcm_data_by_model[model][(scenario, time_period)] = df
+    with stage('load_gcm_tables', configs=len(gcm_config)):
+        gcm_data_by_model = {}
+        gcm_paths = {}
+        for config in gcm_config:
+            model = config['model']
+            scenario = config['scenario']
+            time_period = config['time_period']
+            filename = table_filename('gcm_extracted', model=model, scenario=scenario, period=time_period)
+            filepath = os.path.join(processed_gcm_dir, filename)
+        
+            if find_table(filepath) is None:
+                print(f"Warning: Preprocessed GCM file not found: {filepath}. Skipping this config.")
+                continue
+            df = read_table(filepath, 'gcm_extracted')
+            df = df.set_index('Date')
+        
+            if model not in gcm_data_by_model:
+                gcm_data_by_model[model] = {}
+            gcm_data_by_model[model][(scenario, time_period)] = df
+            gcm_paths[(model, scenario, time_period)] = find_table(filepath)
         
     if not gcm_data_by_model:
         print("No preprocessed GCM data to perfrom bias correction. Exiting.")
         return
         
+    # Every (model, scenario, station, variable) is one unit of work, logged in the checkpoint
+    # once its output file is committed; a rerun only does the units not yet done
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILENAME)
+    if not resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = load_checkpoint(checkpoint_path)
+    outcomes = {'done': [], 'resumed': 0, 'failed': []}
+    
+    # Called on the writer threads once a unit's output is written (or failed)
+    def unit_written(key, signature, label, output_path):
+        append_record(checkpoint_path, {'unit': key, 'status': 'done', 'signature': signature, 'outputs': [output_path]})
+        outcomes['done'].append(key)
+        print(f"  {label['variable']} BC saved for {label['station']} ({label['scenario']}).")
+    
+    def unit_failed(key, label, e):
+        error = f"{type(e).__name__}: {e}"
+        print(f"  Error in {label['variable']} BC for {label['station']} {label['scenario']}: {error}")
+        append_record(checkpoint_path, {'unit': key, 'status': 'failed', 'error': error})
+        outcomes['failed'].append({**label, 'error': error})
+    
     # Loop through each model, station, and variable
-    for model, scenarios_data in gcm_data_by_model.items():
-        print(f"\nProcessing bias correction for model: {model}")
-        
-        # Get historical GCM data for training
-        hist_key = ('historical, historical_period')
-        if hist_key not in scenarios_data:
-            print(f"    Historical data for {model} not found. Skpping bias correction for this model.")
-            continue
-        gcm_hist_df = scenarios_data[hist_key]
-        
-        # Get unique station IDs from observed data
-        station_ids = obs_fd.unique()
-        
-        for stn_id in station_ids:
-            print(f"     Bias correction for station: {stn_id}")
-            obs_stn = [obs_df == stn_id]
-            gcm_hist_stn = [gcm_hist_df == stn_id]
-            
-            # Convert observations and model data to xarray DataArray for cmethods
-            # Ensure 'time' dimension is present and data is aligned
-            
-            obs_tas_xr = obs_stn['Temperature_C'].to_xarray().rename({'Date': 'time'})
-            obs_pr_xr = obs_stn['Precipitation_mm_day'].to_xarray().rename({'Date':'time'})
+    with BackgroundWriter(n_threads=write_threads) as writer:
+        for model, scenarios_data in gcm_data_by_model.items():
+            print(f"\nProcessing bias correction for model: {model}")
+        
+            # Get historical GCM data for training
+            hist_key = ('historical', historical_period)
+            if hist_key not in scenarios_data:
+                print(f"    Historical data ({historical_period}) for {model} not found. Skpping bias correction for this model.")
+                continue
+            gcm_hist_df = scenarios_data[hist_key]
+        
+            # Get unique station IDs from observed data
+            station_ids = obs_df['Station_ID'].unique()
+        
+            for stn_id in station_ids:
+                units = []
+                for (scenario, period) in scenarios_data:
+                    for variable, (kind, table) in BC_VARIABLES.items():
+                        key = unit_key(model=model, scenario=scenario, station=stn_id, variable=variable)
+                        signature = input_signature([station_data_path, qc_flags_path, gcm_paths[(model, scenario, period)], gcm_paths[(model, *hist_key)]],
+                                                    method='quantile_mapping', kind=kind, group='time.month')
+                        if unit_done(checkpoint, key, signature):
+                            outcomes['resumed'] += 1
+                        else:
+                            units.append((scenario, period, variable, key, signature))
+                if not units:
+                    print(f"     Bias correction for station: {stn_id} already done (checkpoint).")
+                    continue
             
-            gcm_hist_tas_xr = gcm_hist_stn.to_xarray().rename({'Date':'time'})
-            gcm_hist_pr_xr = gcm_hist_stn['Precipitation_mm_day'].to_xarray().rename({'Date':'time'})
-            
-            
-            # Ensure data is by time
-            obs_tas_xr = obs_tas_xr.sortby('time')
-            obs_pr_xr = obs_pr_xr.sortby('time')
-            gcm_hist_tas_xr = gcm_hist_tas_xr.sortby('time')
-            gcm_hist_pr_xr = gcm_hist_pr_xr.sortby('time')
-            
-            # Apply bias correction for future scenarios (and historical for aevaluation purposes)
-            for (scenario, period), gcm_sim_df in scenarios_data.items():
-                gcm_sim_stn = [gcm_sim_df == stin_id]
-                gcm_sim_tas_xr = gcm_sim_stn.to_xarray().rename({'Date':'time'})
-                gcm_sim_pr_xr = gcm_sim_stn['Precipitation_mm_day'].to_xarray().rename({'Date':'time'})
-                
-                gcm_sim_tas_xr = gcm_sim_tas_xr.sortby('time')
-                gcm_sim_pr_xr = gcm_sim_pr_xr.sortby('time')
+                with stage('correct_station', model=model, station=stn_id, units=len(units)):
+                    print(f"     Bias correction for station: {stn_id}")
+                    obs_stn = obs_df[obs_df['Station_ID'] == stn_id]
+                    gcm_hist_stn = gcm_hist_df[gcm_hist_df['Station_ID'] == stn_id]
                 
-                # --- Temperature Bias Correction (Quantile Mapping, Additive) -----#
-                try:
-                    bc_tas = adiust(
-                        method= "quantile_mapping",
-                        obs = obs_yas_xr,
-                        simh = gcm_hist_tas_xr,
-                        simp = gcm_sim_tas_xr,
-                        kind = "+",             # Additive correction for temperature
-                        group = "time.month"     # Apply monthly  
-                    )
-                    bc_tas_df = bc_tas.to_dataframe(name='Temperature_C_BC')
-                    bc_tas_df = stn_id
-                    bc_tas_df = scenario
-                    bc_tas_df['Model'] = model
-                    bc_tas_df['Variable'] = 'Temperature_C'
-                    
-                    # Save raw GCM data for comparison
-                    raw_tas_df = gcm_sim_tas_xr.to_dataframe(name='Temperature_C_Raw')
-                    raw_tas_df = stn_id
-                    raw_tas_df = dcenario
-                    raw_tas_df['Model'] = model
-                    raw_tas_df['Variable'] = 'Temperature_C'
-                    
-                    # Combine raw and bias-corrected for this station/scenario/model
-                    combined_tas_df = pd.merge(raw_tas_df, bc_tas_df, left_index = True, right_index=True, how='outer')
-                    combined_tas_df = combined_tas_df.reset_index().rename(columns={'index':'Date'})
-                    combined_tas_df.to_csv(os.path.join(output_dir, f'temp_bc_{model}_{scenario}_{stn_id}.csv'), index = False)
-                    print(f"  Temperature BC saved for {stn_id} ({scenario}).")
-                    
-                except Exception as e:
-                    print(f"  Error in Temperature BC {stn_id} {scenario} : {e}")
-                # --- Precipitation Bias Correction (Quantile Mapping, Multiplicative) ----#
-                try:
-                    # cmethods' quantile_mapping handles zeros by default for multiplicative kind
-                    bc_pr = adjust(
-                        method= "quantile_mapping",
-                        obs = obs_pr_xr,
-                        simh = gcm_hist_pr_xr,
-                        simp = gcm_sim_pr_xr,
-                        kind = "*",            # Multiplicative correction for precipitation
-                        group = "time.month"    # Apply monthly  
-                    )        
-                    bc_pr_df = bc_pr.to_dataframe(name='Precipitation_mm_day_BC')
-                    bc_pr_df = stn_id
-                    bc_pr_df = scenario
-                    bc_pr_df['Model'] = model
-                    bc_pr_df['Variable'] = 'Precipitation_mm_day'
-                    
-                    
-                    # Save raw GCM data for comparison
-                    raw_pr_df = gcm_sim_pr_xr.to_dataframe(name='Precipitation_mm_day_Raw')
-                    raw_pr_df = stn_id
-                    raw_pr_df = scenario
-                    raw_pr_df['Model'] = model
-                    raw_pr_df['Variable'] = 'Precipitation_mm_day'
-                    
-                    
-                    # Combine raw and bias-corrected for this station/scenario/model
-                    combined_pr_df = pd.merge(raw_pr_df, bc_pr_df, left_index=True, right_index=True, how='outer')
-                    combined_pr_df = combined_pr_df.reset_index().rename(columns={'index':'Date'})
-                    combined_pr_df.to_csv(os.path.join(output_dir, f'precip_bc_{model}_{scenario}_{stn_id}.csv'), index=False)
-                    print(f"    Precipitation BC saved for {stn_id} {scenario}.")
-                    
-                except Exception as e:
-                    print(f"    Error in Precipitation BC for {stn_id} {scenario}: {e}")
-                    
+                    # Apply bias correction for future scenarios (and historical for aevaluation purposes)
+                    for scenario, period, variable, key, signature in units:
+                        kind, table = BC_VARIABLES[variable]
+                        gcm_sim_df = scenarios_data[(scenario, period)]
+                        gcm_sim_stn = gcm_sim_df[gcm_sim_df['Station_ID'] == stn_id]
+                        output_path = os.path.join(output_dir, table_filename(table, model=model, scenario=scenario, station=stn_id))
+                        label = {'model': model, 'scenario': scenario, 'station': stn_id, 'variable': variable}
+                        try:
+                            with stage('adjust', variable=variable, scenario=scenario):
+                                bc, simp_xr = correct_series(obs_stn[variable], gcm_hist_stn[variable], gcm_sim_stn[variable], kind)
+                        except Exception as e:
+                            unit_failed(key, label, e)
+                            continue
+                        # Frame building and the write overlap the next correction; blocks when the writer is behind
+                        writer.write_table(partial(bc_frame, bc, simp_xr, variable, model, scenario, stn_id), output_path, table,
+                                           on_done=partial(unit_written, key, signature, label),
+                                           on_error=partial(unit_failed, key, label))
+    
+    # Run report: units done now, taken from the checkpoint, and failed (with their errors)
+    report = {'finished': datetime.now().isoformat(timespec='seconds'), 'checkpoint': checkpoint_path,
+              'units_done': len(outcomes['done']), 'units_resumed': outcomes['resumed'],
+              'units_failed': len(outcomes['failed']), 'failed': outcomes['failed']}
+    report_path = write_report(os.path.join(output_dir, REPORT_FILENAME), report)
+    print(f"\nBias correction: {len(outcomes['done'])} units done, {outcomes['resumed']} already done (checkpoint), "
+          f"{len(outcomes['failed'])} failed. Report saved to: {report_path}")
+    for failure in outcomes['failed']:
+        print(f"  FAILED {failure['model']} {failure['scenario']} {failure['station']} {failure['variable']}: {failure['error']}")
+    if outcomes['failed'] and raise_on_failure:
+        raise RuntimeError(f"{len(outcomes['failed'])} bias-correction units failed; rerun to retry them (see {report_path}).")
+    return report
+
 if __name__ == "__main__":
     # Ensure station data and preprocessed GCM data are available
     # Run 01_generate_station_data.py and 02_gcm_preprocessing.py before this script
@@ -0,0 +1,269 @@
+import glob
+import os
+import shutil
+import sys
+import warnings
+
+import dask
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common'))
+from instrumentation import count, stage
+
+# Gridded (full-domain) quantile mapping: every grid cell of the GCM fields is corrected against a
+# gridded reference dataset (e.g. CHIRPS / ERA5 regridded, in place of the station series).
+#
+# The fields are dask arrays chunked over (lat, lon) with the whole time axis in each chunk, and
+# the correction runs through xarray.apply_ufunc(dask='parallelized'): one task per spatial chunk,
+# spread over the cores by the threaded scheduler. A task holds the reference, historical and
+# projected series of its cells only, so memory is bounded by the chunk size, not the domain.
+# The corrected cube is written chunk by chunk to a chunked NetCDF (or Zarr) store.
+#
+# Per calendar month, the simulated value's position among n_quantiles quantiles of the
+# historical run is mapped onto the same position among the reference quantiles (empirical
+# quantile mapping, as cmethods' quantile_mapping with group='time.month'). Values beyond the
+# historical range are extrapolated with the end quantiles' offset ('+', temperature) or
+# ratio ('*', precipitation), so projected warming is not clipped to the historical maximum.
+
+VARIABLES = {
+    # GCM variable: (pipeline column, correction kind)
+    'tas': ('Temperature_C', '+'),
+    'pr': ('Precipitation_mm_day', '*'),
+}
+DEFAULT_CHUNKS = {'lat': 16, 'lon': 16}
+COORD_NAMES = {'latitude': 'lat', 'longitude': 'lon', 'y': 'lat', 'x': 'lon'}
+
+
+def gcm_files(gcm_raw_dir, var, model, scenario):
+    prefix = f'{var}_day_{model}_{scenario}_r1i1p1f1_gn_'
+    return sorted(os.path.join(gcm_raw_dir, f) for f in os.listdir(gcm_raw_dir) if f.startswith(prefix) and f.endswith('.nc'))
+
+
+def to_pipeline_units(da):
+    """
+    Converts K to degC and kg m-2 s-1 to mm/day (the station tables' units); other units are kept.
+    """
+    units = da.attrs.get('units', '')
+    if units == 'K':
+        da = da - 273.15
+        da.attrs['units'] = 'degC'
+    elif units in ('kg m-2 s-1', 'kg m**-2 s**-1', 'kg/m2/s'):
+        da = da * 86400
+        da.attrs['units'] = 'mm/day'
+    return da
+
+
+def _standard_coords(da):
+    """
+    lat/lon named coordinates, ascending, with longitudes in -180..180.
+    """
+    da = da.rename({k: v for k, v in COORD_NAMES.items() if k in da.dims})
+    if float(da['lon'].max()) > 180:
+        da = da.assign_coords(lon=((da['lon'] + 180) % 360) - 180)
+    return da.sortby('lat').sortby('lon')
+
+
+def open_gcm(gcm_raw_dir, var, model, scenario, period):
+    files = gcm_files(gcm_raw_dir, var, model, scenario)
+    if not files:
+        return None
+    count('files_opened', len(files))
+    count('bytes_opened', sum(os.path.getsize(f) for f in files))
+    ds = xr.open_mfdataset(files, combine='by_coords', decode_times=True)
+    start, end = period.split('-')
+    return to_pipeline_units(_standard_coords(ds[var]).sel(time=slice(start, end)))
+
+
+def open_reference(path, var, period):
+    """
+    Reference field of one variable from a file or glob pattern, in pipeline units.
+    """
+    files = sorted(glob.glob(path))
+    if not files:
+        raise FileNotFoundError(f"No reference files match {path}")
+    count('files_opened', len(files))
+    count('bytes_opened', sum(os.path.getsize(f) for f in files))
+    ds = xr.open_mfdataset(files, combine='by_coords', decode_times=True)
+    start, end = period.split('-')
+    return to_pipeline_units(_standard_coords(ds[var]).sel(time=slice(start, end)))
+
+
+def _map_quantiles(obs, simh, simp, probs, kind):
+    """
+    Quantile mapping of simp (cells x time) from the simh to the obs distribution, all cells at once.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)     # all-NaN (masked) cells
+        q_obs = np.moveaxis(np.nanquantile(obs, probs, axis=-1), 0, -1)
+        q_simh = np.moveaxis(np.nanquantile(simh, probs, axis=-1), 0, -1)
+
+    # Bracketing quantiles of every value, from a (cells x time x quantiles) comparison
+    n_q = len(probs)
+    idx = np.clip((q_simh[:, np.newaxis, :] <= simp[:, :, np.newaxis]).sum(axis=-1), 1, n_q - 1)
+    h_lo = np.take_along_axis(q_simh, idx - 1, axis=-1)
+    h_hi = np.take_along_axis(q_simh, idx, axis=-1)
+    o_lo = np.take_along_axis(q_obs, idx - 1, axis=-1)
+    o_hi = np.take_along_axis(q_obs, idx, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.clip(np.where(h_hi > h_lo, (simp - h_lo) / (h_hi - h_lo), 0.5), 0, 1)
+        mapped = o_lo + frac * (o_hi - o_lo)
+
+        below, above = simp < q_simh[:, :1], simp > q_simh[:, -1:]
+        if kind == '+':
+            mapped = np.where(below, q_obs[:, :1] + (simp - q_simh[:, :1]), mapped)
+            mapped = np.where(above, q_obs[:, -1:] + (simp - q_simh[:, -1:]), mapped)
+        else:
+            ratio = np.where(q_simh[:, -1:] > 0, q_obs[:, -1:] / q_simh[:, -1:], 1.0)
+            mapped = np.where(above, simp * ratio, mapped)
+            mapped = np.where(below | (simp <= 0), 0.0, np.maximum(mapped, 0.0))
+    return np.where(np.isnan(simp), np.nan, mapped)
+
+
+def quantile_map_block(obs, simh, simp, obs_months, simh_months, simp_months, probs, kind):
+    """
+    apply_ufunc kernel: (..., time) blocks of reference, historical and projected series; each
+    calendar month is mapped separately. Returns float32 (..., time) like simp.
+    """
+    shape = simp.shape
+    obs = obs.reshape(-1, obs.shape[-1])
+    simh = simh.reshape(-1, simh.shape[-1])
+    simp = simp.reshape(-1, shape[-1])
+    result = np.full(simp.shape, np.nan, dtype=np.float32)
+    for month in range(1, 13):
+        target = simp_months == month
+        if not target.any():
+            continue
+        result[:, target] = _map_quantiles(obs[:, obs_months == month], simh[:, simh_months == month],
+                                           simp[:, target], probs, kind)
+    return result.reshape(shape)
+
+
+def quantile_map_grid(obs, simh, simp, kind, n_quantiles=100, chunks=None):
+    """
+    Lazily quantile-maps every cell of simp (time x lat x lon) given obs and simh on the same grid,
+    with per-month quantiles. Returns a dask-backed DataArray chunked as chunks over (lat, lon).
+    """
+    chunks = dict(DEFAULT_CHUNKS, **(chunks or {}))
+    spatial = {'lat': chunks['lat'], 'lon': chunks['lon']}
+    # The time axis is the ufunc's core dimension: one chunk along it, distinct names per input
+    obs = obs.rename(time='time_obs').chunk({'time_obs': -1, **spatial})
+    simh = simh.rename(time='time_simh').chunk({'time_simh': -1, **spatial})
+    simp_chunked = simp.chunk({'time': -1, **spatial})
+    result = xr.apply_ufunc(
+        quantile_map_block, obs, simh, simp_chunked,
+        input_core_dims=[['time_obs'], ['time_simh'], ['time']],
+        output_core_dims=[['time']],
+        kwargs={
+            'obs_months': obs['time_obs'].dt.month.values,
+            'simh_months': simh['time_simh'].dt.month.values,
+            'simp_months': simp['time'].dt.month.values,
+            'probs': np.linspace(0, 1, n_quantiles),
+            'kind': kind,
+        },
+        dask='parallelized',
+        output_dtypes=[np.float32],
+    )
+    return result.transpose('time', 'lat', 'lon')
+
+
+def write_cube(ds, path, chunks=None):
+    """
+    Writes the corrected cube (computing it chunk by chunk) as chunked NetCDF, or as Zarr when the
+    path ends in .zarr, under a temporary name that is renamed when complete. Returns the path.
+    """
+    chunks = dict(DEFAULT_CHUNKS, **(chunks or {}))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    if path.endswith('.zarr'):
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        ds.to_zarr(tmp_path, mode='w')
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+        return path
+
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        encoding[name] = {'dtype': 'float32', 'chunksizes': (min(365, da.sizes['time']), min(chunks['lat'], da.sizes['lat']), min(chunks['lon'], da.sizes['lon']))}
+        try:
+            import netCDF4  # noqa: F401
+            encoding[name].update({'zlib': True, 'complevel': 1})
+        except ImportError:
+            pass
+    ds.to_netcdf(tmp_path, encoding=encoding)
+    os.replace(tmp_path, path)
+    count('files_written')
+    count('bytes_written', os.path.getsize(path))
+    return path
+
+
+def gridded_output_path(output_dir, model, scenario, period, output_format='netcdf'):
+    return os.path.join(output_dir, f"gridded_bc_{model}_{scenario}_{period}" + ('.zarr' if output_format == 'zarr' else '.nc'))
+
+
+def gridded_bias_correction(gcm_raw_dir, reference_paths, output_dir, gcm_config, historical_period='1991-2020',
+                            reference_vars=None, grid='reference', chunks=None, n_quantiles=100,
+                            n_workers=None, output_format='netcdf'):
+    """
+    Quantile-maps the raw GCM fields of every {'model', 'scenario', 'time_period'} config on every
+    grid cell against the reference dataset and writes one corrected cube per model/scenario.
+
+    reference_paths: {'tas': file or glob, 'pr': ...} for the variables to correct (variable names
+    in the files default to the same keys, see reference_vars). The reference covers
+    historical_period; each model's historical config is the training run. grid='reference'
+    interpolates the GCM onto the reference grid (downscaled output), grid='gcm' coarsens the
+    reference to the GCM grid instead. chunks sets the (lat, lon) block size of each task and
+    n_workers the number of threads (all cores by default). Returns the written paths.
+    """
+    reference_vars = reference_vars or {var: var for var in reference_paths}
+    chunks = dict(DEFAULT_CHUNKS, **(chunks or {}))
+    os.makedirs(output_dir, exist_ok=True)
+    hist_config = {config['model']: config for config in gcm_config if config['scenario'] == 'historical'}
+    written = []
+
+    references = {var: open_reference(path, reference_vars[var], historical_period) for var, path in reference_paths.items()}
+    for config in gcm_config:
+        model, scenario, period = config['model'], config['scenario'], config['time_period']
+        if model not in hist_config:
+            print(f"    Historical data for {model} not found. Skipping gridded bias correction for this model.")
+            continue
+        print(f"\nGridded bias correction: {model} - {scenario} ({period})")
+
+        with stage('gridded_correction', model=model, scenario=scenario):
+            corrected = {}
+            for var, ref in references.items():
+                simh = open_gcm(gcm_raw_dir, var, model, 'historical', hist_config[model]['time_period'])
+                simp = open_gcm(gcm_raw_dir, var, model, scenario, period)
+                if simh is None or simp is None:
+                    print(f"  No {var} GCM files for {model} {scenario} in {gcm_raw_dir}. Skipping.")
+                    continue
+                if grid == 'reference':
+                    # Only the GCM cells around the reference domain are interpolated; reference
+                    # cells beyond the outermost GCM cell centres are extrapolated from them
+                    margin = 2 * float(abs(simh['lat'].diff('lat')).max())
+                    box = {'lat': slice(float(ref['lat'].min()) - margin, float(ref['lat'].max()) + margin),
+                           'lon': slice(float(ref['lon'].min()) - margin, float(ref['lon'].max()) + margin)}
+                    simh = simh.sel(box).interp(lat=ref['lat'], lon=ref['lon'], kwargs={'fill_value': 'extrapolate'})
+                    simp = simp.sel(box).interp(lat=ref['lat'], lon=ref['lon'], kwargs={'fill_value': 'extrapolate'})
+                    obs = ref
+                else:
+                    obs = ref.interp(lat=simh['lat'], lon=simh['lon'])
+
+                column, kind = VARIABLES[var]
+                da = quantile_map_grid(obs, simh, simp, kind, n_quantiles, chunks)
+                da.attrs = {'units': 'degC' if kind == '+' else 'mm/day',
+                            'long_name': f'{column} bias-corrected (quantile mapping, {kind})'}
+                corrected[var] = da
+
+            if not corrected:
+                continue
+            ds = xr.Dataset(corrected, attrs={'source_id': model, 'experiment_id': scenario, 'period': period,
+                                              'method': f'empirical quantile mapping, monthly, {n_quantiles} quantiles',
+                                              'reference': ', '.join(reference_paths.values())})
+            path = gridded_output_path(output_dir, model, scenario, period, output_format)
+            with dask.config.set(scheduler='threads', num_workers=n_workers):
+                write_cube(ds, path, chunks)
+            count('cells', ds.sizes['lat'] * ds.sizes['lon'])
+        print(f"  Gridded corrected cube saved to: {path}")
+        written.append(path)
+    return written
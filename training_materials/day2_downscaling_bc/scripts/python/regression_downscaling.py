@@ -0,0 +1,359 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common'))
+from interchange import find_table, read_table, table_filename
+from instrumentation import count, instrumented, stage
+from background_writer import BackgroundWriter
+from station_qc import apply_qc_flags, load_qc_flags, station_day_block
+from gridded_bias_correction import open_gcm, open_reference
+
+# Perfect-prognosis (regression) statistical downscaling: every station's daily temperature and
+# precipitation is predicted from the large-scale fields around it.
+#
+# Predictors are the window x window GCM cells centred on each station's nearest cell, for every
+# predictor variable, standardized per station and calendar month with the historical run's
+# climatology (so a scenario's shift shows up as a shift of the standardized predictors). One
+# linear (alpha=0) or ridge model is fitted per station, calendar month and predictand against
+# the observations of the historical period, and applied to every configured scenario.
+#
+# The fits are batched: the normal equations (X'X + alpha n I) b = X'y of all stations of a block
+# and one month are built with batched matrix products and solved together by one np.linalg.solve
+# call on a (stations x 12) stack of small systems, so thousands of station models fit in seconds.
+# Training pairs days by date, which is meaningful for reanalysis predictors (training_predictors,
+# regridded onto the GCM cells so the models are applied to the cells they were fitted on) or
+# reanalysis-driven runs; with a free-running GCM historical run it only captures the seasonal and
+# spatial structure of the relationship, a warning says so and the file names carry 'gcm_paired'
+# instead of 'reanalysis' so such output is not read as real skill. Model calendars (noleap,
+# 360_day) are converted to real dates; days that do not exist in the other calendar are gaps.
+
+PREDICTOR_VARS = ('tas', 'pr')
+PREDICTANDS = {
+    # station column: lower bound of the predictions
+    'Temperature_C': None,
+    'Precipitation_mm_day': 0.0,
+}
+
+
+def standard_calendar(field):
+    """
+    field on the standard calendar: model calendars (cftime time axes) are converted date by
+    date, dropping the days the standard calendar does not have (e.g. 30 February).
+    """
+    if isinstance(field.indexes['time'], xr.CFTimeIndex):
+        field = field.convert_calendar('standard', align_on='date', use_cftime=False)
+    return field
+
+
+def regrid(field, lat, lon):
+    """
+    field interpolated bilinearly onto the lat/lon cell centres; cells beyond field's outermost
+    centres are extrapolated from them. Only the part of field around the target cells is read.
+    """
+    margin = 2 * max(float(abs(field['lat'].diff('lat')).max()), float(abs(field['lon'].diff('lon')).max()))
+    near = field.sel(lat=slice(lat.min() - margin, lat.max() + margin), lon=slice(lon.min() - margin, lon.max() + margin))
+    return near.interp(lat=lat, lon=lon, kwargs={'fill_value': 'extrapolate'})
+
+
+def predictor_windows(field, stn_lat, stn_lon, window, grid=None):
+    """
+    Grid indices (stations x window^2) of the window x window cells centred on each station's
+    nearest cell (clipped at the domain edge), and the (time x lat x lon) values of the box
+    covering all of them. With grid (a field on another grid, e.g. the GCM's), the cells are
+    grid's and field is first interpolated onto the cells of the box.
+    """
+    cells = field if grid is None else grid
+    lat, lon = cells['lat'].values, cells['lon'].values
+    offsets = np.arange(window) - window // 2
+    i = np.abs(lat[np.newaxis, :] - stn_lat[:, np.newaxis]).argmin(axis=1)
+    j = np.abs(lon[np.newaxis, :] - stn_lon[:, np.newaxis]).argmin(axis=1)
+    lat_idx = np.clip(i[:, np.newaxis, np.newaxis] + offsets[np.newaxis, :, np.newaxis], 0, len(lat) - 1)
+    lon_idx = np.clip(j[:, np.newaxis, np.newaxis] + offsets[np.newaxis, np.newaxis, :], 0, len(lon) - 1)
+    lat_idx, lon_idx = np.broadcast_arrays(lat_idx, lon_idx)
+    lat_idx, lon_idx = lat_idx.reshape(len(stn_lat), -1), lon_idx.reshape(len(stn_lat), -1)
+
+    lat_box, lon_box = slice(lat_idx.min(), lat_idx.max() + 1), slice(lon_idx.min(), lon_idx.max() + 1)
+    if grid is None:
+        box = field.isel(lat=lat_box, lon=lon_box)
+    else:
+        box = regrid(field, lat[lat_box], lon[lon_box])
+    values = box.transpose('time', 'lat', 'lon').values.astype(np.float32)
+    return lat_idx - lat_idx.min(), lon_idx - lon_idx.min(), values
+
+
+def load_predictors(fields, stn_lat, stn_lon, window, grid=None):
+    """
+    Predictor boxes of every variable of fields ({var: DataArray}) around the stations:
+    {'dates', 'windows': [(lat_idx, lon_idx, values) per variable]}. Only the boxes are read.
+    With grid ({var: DataArray}, e.g. the GCM fields), the fields are regridded onto its cells.
+    """
+    fields = {var: standard_calendar(fields[var]) for var in PREDICTOR_VARS}
+    time = fields[PREDICTOR_VARS[0]]['time']
+    dates = pd.DatetimeIndex(time.values).normalize()
+    windows = []
+    for var in PREDICTOR_VARS:
+        windows.append(predictor_windows(fields[var].sel(time=time), stn_lat, stn_lon, window,
+                                         None if grid is None else grid[var]))
+        count('values_read', windows[-1][2].size)
+    return {'dates': dates, 'windows': windows}
+
+
+def block_predictors(predictors, block, days=None):
+    """
+    (stations x time x predictors) float32 array of the stations in block (a slice), optionally
+    for the given day indices only.
+    """
+    columns = []
+    for lat_idx, lon_idx, values in predictors['windows']:
+        values = values if days is None else values[days]
+        columns.append(np.moveaxis(values[:, lat_idx[block], lon_idx[block]], 0, 1))
+    return np.concatenate(columns, axis=-1)
+
+
+def monthly_climatology(X, months, std_floor=0.25):
+    """
+    Mean and standard deviation (stations x 12 x predictors) of X per calendar month. The
+    standard deviation is at least std_floor times the all-months one, so that a rare rain day
+    in a dry month does not become a predictor value of dozens of standard deviations.
+    """
+    # Per-month sums as one matrix product with a (time x 12) month indicator
+    valid = np.isfinite(X)
+    X = np.where(valid, X, 0.0).astype(np.float64).transpose(0, 2, 1)
+    month_of_day = (months[:, np.newaxis] == np.arange(1, 13)).astype(np.float64)
+    n = (valid.transpose(0, 2, 1) @ month_of_day).transpose(0, 2, 1)
+    total = (X @ month_of_day).transpose(0, 2, 1)
+    total_sq = (X ** 2 @ month_of_day).transpose(0, 2, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / n
+        std = np.sqrt(np.maximum(total_sq / n - mean ** 2, 0.0))
+        all_mean = total.sum(axis=1) / n.sum(axis=1)
+        all_std = np.sqrt(np.maximum(total_sq.sum(axis=1) / n.sum(axis=1) - all_mean ** 2, 0.0))
+    std = np.maximum(std, std_floor * all_std[:, np.newaxis, :])
+    return mean, np.where(std > 0, std, 1.0)      # constant predictors are left at 0
+
+
+def standardize(X, months, mean, std):
+    mean, std = mean.astype(np.float32), std.astype(np.float32)
+    return (X - mean[:, months - 1]) / std[:, months - 1]
+
+
+def fit_batched(Z, y, months, alpha=0.1, min_days=60):
+    """
+    Ridge regression of y (stations x time) on Z (stations x time x predictors) plus an intercept,
+    per station and calendar month, solving all normal equations in one batch. alpha is the
+    penalty per training day on the standardized predictors (0: ordinary least squares); the
+    intercept is not penalized. Returns coefficients (stations x 12 x 1+predictors), NaN where a
+    station/month has fewer than min_days valid days, and the number of training days.
+    """
+    n_stations, _, n_pred = Z.shape
+    valid = np.isfinite(y) & np.isfinite(Z).all(axis=-1)
+    A = np.zeros((n_stations, 12, n_pred + 1, n_pred + 1))
+    b = np.zeros((n_stations, 12, n_pred + 1))
+    n = np.zeros((n_stations, 12))
+    for m in range(1, 13):
+        sel = months == m
+        w = valid[:, sel]
+        X = np.concatenate([np.ones(w.shape + (1,)), Z[:, sel]], axis=-1)
+        X = np.where(w[..., np.newaxis], X, 0.0)
+        # Batched matrix products (BLAS) over the stations: X'X and X'y
+        Xt = X.transpose(0, 2, 1)
+        A[:, m - 1] = Xt @ X
+        b[:, m - 1] = (Xt @ np.where(w, y[:, sel], 0.0)[..., np.newaxis])[..., 0]
+        n[:, m - 1] = w.sum(axis=1)
+
+    # A negligible jitter keeps systems with constant predictors solvable when alpha is 0
+    penalty = np.ones(n_pred + 1)
+    penalty[0] = 0.0
+    A += (alpha + 1e-9) * n[..., np.newaxis, np.newaxis] * np.diag(penalty)
+    enough = n >= max(min_days, n_pred + 2)
+    A[~enough] = np.eye(n_pred + 1)
+    coef = np.linalg.solve(A, b[..., np.newaxis])[..., 0]
+    coef[~enough] = np.nan
+    return coef, n
+
+
+def predict_batched(Z, coef, months, lower=None):
+    """
+    Predictions (stations x time) of the per-month models coef for standardized predictors Z.
+    """
+    pred = np.full(Z.shape[:2], np.nan)
+    for m in range(1, 13):
+        sel = months == m
+        pred[:, sel] = coef[:, m - 1, np.newaxis, 0] + (Z[:, sel] @ coef[:, m - 1, 1:, np.newaxis])[..., 0]
+    if lower is not None:
+        pred = np.maximum(pred, lower)      # NaN stays NaN
+    return pred
+
+
+def explained_variance(y, pred, months):
+    """
+    Training R^2 per station and calendar month (stations x 12).
+    """
+    r2 = np.full((y.shape[0], 12), np.nan)
+    for m in range(1, 13):
+        sel = months == m
+        ym, pm = y[:, sel], pred[:, sel]
+        ok = np.isfinite(ym) & np.isfinite(pm)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(np.where(ok, ym, 0), axis=1) / ok.sum(axis=1)
+            ss_res = np.where(ok, (ym - pm) ** 2, 0).sum(axis=1)
+            ss_tot = np.where(ok, (ym - mean[:, np.newaxis]) ** 2, 0).sum(axis=1)
+            r2[:, m - 1] = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.nan)
+    return r2
+
+
+def downscaled_frame(dates, station_ids, predictions):
+    """
+    Long (Date, Station_ID, predictand...) interchange frame of (stations x time) predictions.
+    """
+    df = pd.DataFrame({'Date': np.tile(dates.values, len(station_ids)),
+                       'Station_ID': np.repeat(station_ids, len(dates))})
+    for column, pred in predictions.items():
+        df[column] = pred.ravel().astype(np.float32)
+    return df
+
+
+@instrumented()
+def regression_downscaling(
+    station_data_path = '../../data/station_data/generated_station_data.feather',
+    gcm_raw_dir = '../../data/raw_gcm',
+    output_dir = '../../output/downscaled',
+    gcm_config = None,
+    historical_period = '1991-2020',
+    training_predictors = None,
+    window = 3,
+    alpha = 0.1,
+    min_days = 60,
+    station_block = 500,
+    qc_flags_path = None
+):
+    """
+    Perfect-prognosis downscaling of the station temperature and precipitation from the raw GCM
+    fields (tas, pr) around each station.
+    gcm_config: list of {'model', 'scenario', 'time_period'} dicts; each model's historical config
+    provides the predictor climatology and (unless training_predictors is given) the training
+    predictors. training_predictors = {'tas': file/glob, 'pr': ...} trains on reanalysis fields
+    instead (regridded onto the GCM grid); without them observed and free-running GCM days are
+    paired by date, which is warned about, and the output files are tagged 'gcm_paired' instead
+    of 'reanalysis' (a seasonal / structural fit, not a perfect-prognosis skill). Models are
+    fitted per station and calendar month on historical_period (window x window cells per
+    variable, ridge penalty alpha, stations in blocks of station_block) and every config is
+    written as a downscaled table to output_dir. Observations flagged by the station QC are left
+    out of the training. Returns the written paths.
+    """
+    print("Starting regression (perfect-prognosis) downscaling ....")
+
+    # Observed predictands as dense (station x day) arrays
+    station_data_path = find_table(station_data_path) or station_data_path
+    obs_df = read_table(station_data_path, 'station_data')
+    qc_flags, qc_flags_path = load_qc_flags(station_data_path, qc_flags_path)
+    if qc_flags is not None:
+        obs_df = apply_qc_flags(obs_df, qc_flags)
+        print(f"   Applied station QC flags from {qc_flags_path}.")
+    station_ids, obs_dates, obs_values, _ = station_day_block(obs_df, list(PREDICTANDS))
+    coords = obs_df.groupby('Station_ID')[['Latitude', 'Longitude']].first().loc[station_ids]
+    stn_lat, stn_lon = coords['Latitude'].to_numpy(float), coords['Longitude'].to_numpy(float)
+    print(f"   Loaded observed data for {len(station_ids)} stations.")
+
+    os.makedirs(output_dir, exist_ok=True)
+    if gcm_config is None:
+        gcm_config = []
+    hist_config = {config['model']: config for config in gcm_config if config['scenario'] == 'historical'}
+    start, end = historical_period.split('-')
+    blocks = [slice(i, i + station_block) for i in range(0, len(station_ids), station_block)]
+    written = []
+    training = 'reanalysis' if training_predictors else 'gcm_paired'
+    if not training_predictors:
+        message = ("No training_predictors given: the models are trained by pairing observed days with the "
+                   "GCM historical run's days of the same date. A free-running GCM is not in phase with the "
+                   "observed weather, so the fits only capture seasonal and spatial structure; pass "
+                   "reanalysis fields as training_predictors for a perfect-prognosis fit.")
+        print(f"Warning: {message}")
+        warnings.warn(message)
+
+    with BackgroundWriter(n_threads=1) as writer:
+        for model, config in hist_config.items():
+            print(f"\nFitting regression models for {model}")
+            hist_fields = {var: open_gcm(gcm_raw_dir, var, model, 'historical', config['time_period']) for var in PREDICTOR_VARS}
+            if any(field is None for field in hist_fields.values()):
+                print(f"  No historical GCM files for {model} in {gcm_raw_dir}. Skipping.")
+                continue
+
+            with stage('load_predictors', model=model, scenario='historical', stations=len(station_ids)):
+                gcm_hist = load_predictors(hist_fields, stn_lat, stn_lon, window)
+                if training_predictors:
+                    train_fields = {var: open_reference(training_predictors[var], var, historical_period) for var in PREDICTOR_VARS}
+                    train = load_predictors(train_fields, stn_lat, stn_lon, window, grid=hist_fields)
+                else:
+                    train = gcm_hist
+
+            # Training days: observed and predictor dates of the historical period
+            train_dates = train['dates'][(train['dates'] >= start) & (train['dates'] <= f'{end}-12-31')]
+            train_dates = train_dates.intersection(obs_dates)
+            if len(train_dates) == 0:
+                print(f"  No common dates of observations and predictors in {historical_period}. Skipping {model}.")
+                continue
+            train_days = train['dates'].get_indexer(train_dates)
+            obs_days = obs_dates.get_indexer(train_dates)
+            train_months = train_dates.month.to_numpy()
+            hist_months = gcm_hist['dates'].month.to_numpy()
+
+            # Per block: climatologies, batched fits and training skill
+            climatology = []
+            coefs = {column: np.full((len(station_ids), 12, 1 + len(PREDICTOR_VARS) * window ** 2), np.nan) for column in PREDICTANDS}
+            r2 = {column: np.full((len(station_ids), 12), np.nan) for column in PREDICTANDS}
+            with stage('fit_models', model=model, stations=len(station_ids), days=len(train_dates)):
+                for block in blocks:
+                    X = block_predictors(train, block, train_days)
+                    train_mean, train_std = monthly_climatology(X, train_months)
+                    Z = standardize(X, train_months, train_mean, train_std)
+                    if train is gcm_hist:
+                        climatology.append((train_mean, train_std))
+                    else:
+                        climatology.append(monthly_climatology(block_predictors(gcm_hist, block), hist_months))
+                    for column in PREDICTANDS:
+                        y = obs_values[column][block][:, obs_days]
+                        coefs[column][block], _ = fit_batched(Z, y, train_months, alpha, min_days)
+                        r2[column][block] = explained_variance(y, predict_batched(Z, coefs[column][block], train_months), train_months)
+                count('station_models', len(station_ids) * 12 * len(PREDICTANDS))
+            for column in PREDICTANDS:
+                print(f"  {column}: mean training R^2 {np.nanmean(r2[column]):.2f} "
+                      f"({int(np.isfinite(coefs[column][:, :, 0]).sum())} station-month models)")
+
+            # Apply to every configured run of the model with the historical run's climatology
+            for sim_config in [c for c in gcm_config if c['model'] == model]:
+                scenario, period = sim_config['scenario'], sim_config['time_period']
+                if scenario == 'historical' and period == config['time_period']:
+                    sim = gcm_hist
+                else:
+                    sim_fields = {var: open_gcm(gcm_raw_dir, var, model, scenario, period) for var in PREDICTOR_VARS}
+                    if any(field is None for field in sim_fields.values()):
+                        print(f"  No GCM files for {model} {scenario} in {gcm_raw_dir}. Skipping.")
+                        continue
+                    with stage('load_predictors', model=model, scenario=scenario, stations=len(station_ids)):
+                        sim = load_predictors(sim_fields, stn_lat, stn_lon, window)
+
+                with stage('predict', model=model, scenario=scenario):
+                    sim_months = sim['dates'].month.to_numpy()
+                    predictions = {column: np.full((len(station_ids), len(sim['dates'])), np.nan) for column in PREDICTANDS}
+                    for block, (mean, std) in zip(blocks, climatology):
+                        Z = standardize(block_predictors(sim, block), sim_months, mean, std)
+                        for column, lower in PREDICTANDS.items():
+                            predictions[column][block] = predict_batched(Z, coefs[column][block], sim_months, lower)
+
+                output_path = os.path.join(output_dir, table_filename('downscaled', model=model, scenario=scenario, period=period, training=training))
+                writer.write_table(lambda sim=sim, predictions=predictions: downscaled_frame(sim['dates'], station_ids, predictions),
+                                   output_path, 'downscaled',
+                                   on_done=lambda path: print(f"  Downscaled series saved to: {path}"))
+                written.append(output_path)
+    return written
+
+
+if __name__ == "__main__":
+    # Ensure station data and raw GCM data are available (see day 1)
+    regression_downscaling()
@@ -1,210 +1,234 @@
 import pandas as pd
-from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import numpy as np
 import os
+import sys
 
+from evaluation_metrics import evaluate_block
+from evaluation_alignment import read_station_files, align_sources
+from climate_indices import evaluate_indices
+from distribution_scores import distribution_scores_frame
+from bootstrap_ci import bootstrap_ci_frame
+from evaluation_cache import (load_cache_index, save_cache_index, station_slice_digests, file_digest,
+                              combination_key, load_cached_result, store_cached_result)
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common'))
+from interchange import find_table, read_table, table_filename
+from background_writer import BackgroundWriter
+from station_qc import apply_qc_flags, load_qc_flags
+from instrumentation import count, instrumented, stage
+
+# Variables evaluated and the sources compared against the observations
+VARIABLES = ['Temperature_C', 'Precipitation_mm_day']
+SOURCE_TYPES = ['Raw GCM', 'Bias-Corrected (Python)', 'Bias-Corrected (R/CDFt)']
+EVALUATION_START, EVALUATION_END = '1991-01-01', '2020-12-31'
+RESULT_KEYS = ['Model', 'Scenario', 'Variable', 'Station_ID', 'Type']
+
+
+def bc_filepaths(bias_corrected_dir, model, scenario, stn_id, bias_corrected_r_dir=None):
+    """
+    Paths of the Python and R/CDFt bias-corrected temperature and precipitation files of one station.
+    The R/CDFt files are read from bias_corrected_r_dir (default: bias_corrected_dir/r_cdft).
+    """
+    if bias_corrected_r_dir is None:
+        bias_corrected_r_dir = os.path.join(bias_corrected_dir, 'r_cdft')
+    return {
+        'py_tas': os.path.join(bias_corrected_dir, table_filename('temp_bc', model=model, scenario=scenario, station=stn_id)),
+        'py_pr': os.path.join(bias_corrected_dir, table_filename('precip_bc', model=model, scenario=scenario, station=stn_id)),
+        'r_tas': os.path.join(bias_corrected_r_dir, table_filename('temp_bc_cdft', model=model, scenario=scenario, station=stn_id)),
+        'r_pr': os.path.join(bias_corrected_r_dir, table_filename('precip_bc_cdft', model=model, scenario=scenario, station=stn_id)),
+    }
+
+
+@instrumented()
+def score_stations(obs_df, raw_gcm_df, bias_corrected_dir, model, scenario, station_ids,
+                   n_bootstrap, bootstrap_block_length, bootstrap_seed, n_workers, bias_corrected_r_dir=None):
+    """
+    Aligns all sources for the given stations and computes every score for them:
+    metrics, distributional scores, bootstrap intervals and climate-extremes indices.
+    """
+    def read_bc(kind, value_col, out_col):
+        return read_station_files(lambda stn_id: bc_filepaths(bias_corrected_dir, model, scenario, stn_id, bias_corrected_r_dir)[kind],
+                                  station_ids, value_col, out_col)
+    
+    # Load bias-corrected data for the historical scenario into long frames covering all stations
+    # This assumes thisat 03_bias_correction_python.py also produced BC data for the historical period
+    bc_py_df = read_bc('py_tas', 'Temperature_C_BC', 'Temperature_C').merge(
+        read_bc('py_pr', 'Precipitation_mm_day_BC', 'Precipitation_mm_day'), on=['Date', 'Station_ID'], how='outer')
+    
+    # Also load R-based BC data for comparison
+    bc_r_df = read_bc('r_tas', 'Temperature_C_BC', 'Temperature_C').merge(
+        read_bc('r_pr', 'Precipitation_mm_day_BC', 'Precipitation_mm_day'), on=['Date', 'Station_ID'], how='outer')
+    
+    if bc_py_df.empty:
+        print(f"Python Bias-Corrected historical data not found for {model}. Skipping Python BC evaluation.")
+    if bc_r_df.empty:
+        print(f"R Bias-corrected historical data not found for {model}. Skipping R BC evaluation.")
+    
+    # Align data by date (important for metrics): one join on (Station_ID, day index) for all stations
+    aligned = align_sources(
+        obs_df[obs_df['Station_ID'].isin(station_ids)],
+        dict(zip(SOURCE_TYPES, [raw_gcm_df, bc_py_df, bc_r_df])),
+        VARIABLES, EVALUATION_START, EVALUATION_END
+    )
+    
+    metrics_df = pd.concat([
+        evaluate_block(
+            aligned['obs'][var], aligned['sim'][var], aligned['sources'], aligned['station_ids'],
+            Model=model, Scenario=scenario, Variable=var
+        )
+        for var in VARIABLES
+    ], ignore_index=True)
+    
+    # Distributional skill (KS, quantile errors, Perkins score, wet-day errors) from one sort per series
+    distribution_df = distribution_scores_frame(aligned, Model=model, Scenario=scenario)
+    metrics_df = metrics_df.merge(distribution_df, on=RESULT_KEYS, how='left')
+    
+    # Block-bootstrap confidence intervals; the Diff columns compare each source with R/CDFt
+    if n_bootstrap:
+        ci_df = pd.concat([
+            bootstrap_ci_frame(
+                aligned['obs'][var], aligned['sim'][var], aligned['sources'], aligned['station_ids'],
+                n_replicates=n_bootstrap, block_length=bootstrap_block_length,
+                reference='Bias-Corrected (R/CDFt)', n_workers=n_workers, seed=bootstrap_seed,
+                Model=model, Scenario=scenario, Variable=var
+            )
+            for var in VARIABLES
+        ], ignore_index=True)
+        metrics_df = metrics_df.merge(ci_df, on=RESULT_KEYS, how='left')
+    
+    # Climate-extremes indices (Rx1day, CDD, TG90p, ...) scored on their annual series
+    indices_df = evaluate_indices(aligned, Model=model, Scenario=scenario)
+    return pd.concat([metrics_df, indices_df], ignore_index=True)
+
+
+@instrumented()
 def evaluate_bias_correction(
-    station_data_path = "../../data/station_data/generated_station_data.csv",
+    station_data_path = "../../data/station_data/generated_station_data.feather",
     processed_gcm_dir = "../../data/processed_gcm",
     bias_corrected_dir = "../../output/bias_corrected",
-    output_dir = "../../output/evaluation_results"
+    output_dir = "../../output/evaluation_results",
+    n_bootstrap = 0,
+    bootstrap_block_length = 30,
+    bootstrap_seed = 42,
+    n_workers = None,
+    use_cache = True,
+    gcm_config_to_eval = None,
+    qc_flags_path = None,
+    bias_corrected_r_dir = None
 ):
     """
     Evaluate the perfromance of bias correction using various metrics.
     Compares raw GCM and bias-corrected GCM data against observed data for the historical period.
+    All sources are aligned into (source x station x time) arrays and scored in one pass.
+    n_bootstrap block-bootstrap replicates (blocks of bootstrap_block_length days) give confidence
+    intervals for each metric (off by default, e.g. n_bootstrap=1000); set n_workers to spread
+    them over a process pool.
+    With use_cache, results are cached per model/scenario/station under the content hashes of their
+    inputs and only stations whose observations, raw GCM or corrected data changed are recomputed.
+    gcm_config_to_eval: list of {'model', 'scenario', 'time_period'} dicts (defaults to the list below).
+    The R/CDFt outputs are read from bias_corrected_r_dir (default: bias_corrected_dir/r_cdft).
+    Observations flagged by the station QC (qc_flags_path, by default the station_qc table next to
+    the station data, when present) are masked out, so those days are not scored.
     """
     print("Starting bias correction evaluation ....")
     
-    # Load observed station data (historical period for evaluation)
-    obs_df = pd.read_csv(station_data_path, parse_dates = True)
-    obs_df = obs_df.set_index('Date').loc['1991-01-01':'2020-12-31']      # Ensure historical period
-    print("Loaded observed data for {obs_df.nunique()} stations for evaluation.")
-    
     os.makedirs(output_dir, exist_ok=True)
+    cache_dir = os.path.join(output_dir, 'metric_cache')
+    cache_index = load_cache_index(cache_dir) if use_cache else {'files': {}}
+    settings = {'n_bootstrap': n_bootstrap, 'block_length': bootstrap_block_length, 'seed': bootstrap_seed,
+                'period': [EVALUATION_START, EVALUATION_END]}
+    
+    # Station slices of the observations are hashed up front; the file itself is only
+    # parsed when some station actually needs recomputing (or its bytes changed)
+    station_data_path = find_table(station_data_path)
+    qc_flags, qc_flags_path = load_qc_flags(station_data_path, qc_flags_path)
+    settings['qc_flags'] = file_digest(qc_flags_path)
+    with stage('hash_observations'):
+        obs_digests = station_slice_digests(station_data_path, cache_index)
+    station_ids = sorted(obs_digests)
+    obs_df = None
+    print(f"Found observed data for {len(station_ids)} stations for evaluation.")
     
     evaluation_results = []
     # Define GCM models and scenario to evaluate (only historical for direct comparison)
-    gcm_config_to_eval = []
+    if gcm_config_to_eval is None:
+        gcm_config_to_eval = []
     
-    for config in gcm_config_to_eval:
-        model = config['model']
-        scenario = config['scenario']
-        time_period = config['time_period']
+    with BackgroundWriter(n_threads=1) as writer:
+        for config in gcm_config_to_eval:
+            model = config['model']
+            scenario = config['scenario']
+            time_period = config['time_period']
         
-        print(f"\nEvaluating {model} - {scenario} ({time_period}) ...")
+            print(f"\nEvaluating {model} - {scenario} ({time_period}) ...")
         
-        # Load raw GCM historical data
-        raw_gcm_filepath = os.path.join(processed_gcm_dir, f'gcm_extracted_{model}_{scenarion}_{time_period}.csv')
-        if not os.path.exists(raw_gcm_filepath):
-            print(f"Raw GCM historical data not found: {raw_gcm_filepath}. Skipping evaluation for this model.")
-            continue
-        raw_gcm_df = pd.read_csv(raw_gcm_filepath, parse_dates=True).set_index('Date')
-        
-        station_ids = obs_df.unique()
-        
-        for stn_id in station_ids:
-            obs_stn_tas = [obs_df == stn_id]
-            obs_stn_pr = [obs_df == stn_id]['Precipitation_mm_day']
-            
-            raw_gcm_stn_tas = [raw_gcm_df == stn_id]
-            raw_gcm_stn_pr = [raw_gcm_df == stn_id]['Precipitation_mm_day']
-            
-            # Load bias-corrected data for this station and historical scenario
-            # This assumes thisat 03_bias_correction_python.py also produced BC data for the historical period
-            bc_tas_filepath = os.path.join(bias_corrected_dir, f'temp_bc_{model}_{scenario}_{stn_id}.csv')
-            bc_pr_filepath = os.path.join(bias_corrected_dir, f'precip_bc_{model}_{scenario}_{stn_id}.csv')
-            
-            # Also load R-based BC data for comparison
-            bc_r_tas_filepath = os.path.join(bias_corrected_dir, 'r_cdft', f'temp_bc_cdft_{model}_{scenario}_{stn_id}.csv')
-            bc_r_pr_filepath = os.path.join(bias_corrected_dir, 'r_cdft', f'precip_bc_cdft_{model}_{scenario}_{stn_id}.csv')
-            
-            
-            if not os.path.exists(bc_tas-filepath) or not os.path.exists(bc_pr_filepath):
-                print(f"Python Bias-Corrected historical data not found for {stn_id} ({model}). Skipping Python BC evaluation.")
-                bc_stn_tas = pd.Series(dtype = float)     # Empty series
-                bc_stn_pr = pd.Series(dtype = float)      # Empty series
-            else:
-                bc_tas_df = pd.read_csv(bc_tas_filepath, parse_dates = True).set_index('Date')
-                bc_pr_df = pd.read_csv(bc_pr_filepath, parse_dates = True).set_index('Date')
-                bc_stn_tas = [bc_tas-df == stn_id]
-                bc_stn_pr = [bc_pr_df == stn_id]
-            if not os.path.exists(bc_r_tas_filepath) or not os.path.exists(bc_r_pr_filepath):
-                print(f"R Bias-corrected historical data not found for {stn_id} ({model}). Skipping R BC evaluation.")
-                bc_r_stn_tas = pd.Series(dtype = float)       # Empty series
-                bc_r_stn_pr = pd.Series(dtype = float)        # Empty series
-            else:
-                bc_r_tas_df = pd.read_csv(bc_r_tas_filepath, parse_dates=True).set_index('Date')
-                bc_r_pr_df = pd.read_csv(bc_r_pr_filepath, parse_dates=True).set_index('Date')
-                bc_r_stn_tas = [bc_r_tas_df == stn-id]
-                bc_r_pr_pr = [bc_r_pr_df == stn_id]
-            # Align data by date (important for metrics)
-            all_series = [obs_stn_tas, raw_gcm_stn_tas, bc_stn_tas, bc_r_stn_tas, obs_stn_pr, raw_gcm_stn_pr, bc_stn_pr, bc_r_stn_pr]
-            
-            # Filter out empty series before finding common dates
-            non_empty_series = [s for s in all_series if not empty]
-            if not non_empty_series:
-                print(f" No valid data series for {stn_id}. Skipping.")
+            # Load raw GCM historical data
+            raw_gcm_filepath = os.path.join(processed_gcm_dir, table_filename('gcm_extracted', model=model, scenario=scenario, period=time_period))
+            if find_table(raw_gcm_filepath) is None:
+                print(f"Raw GCM historical data not found: {raw_gcm_filepath}. Skipping evaluation for this model.")
                 continue
-            common_dates = non_empty_series.index
-            for s in non_empty_series[1:]:
-                common_dates = common_dates.intersection(s.index)
-            if len(common_dates) == 0:
-                print(f"No common dates for {stn_id}. Skipping.")
-                continue
-            obs_tas_aligned = obs_stn_tas.loc[common_dates]
-            raw_tas_aligned = raw_gcm_stn_tas.loc[common_dates]
-            bc_py_tas_aligned = bc_stn_tas.loc[common_dates]
-            bc_r_tas_aligned = bc_r_stn_tas.loc[common_dates]
-            
-            
-            obs_pr_aligned = obs_stn_pr.loc[common_dates]
-            raw_pr_aligned = raw_gcm_stn_pr.loc[common_dates]
-            bc_py_pr_aligned = bc_stn_pr.loc[common_dates]
-            bc_r_pr_aligned = bc_r_stn_pr.loc[common_dates]
-            
-            #--- Temperature Evaluation ----#
-            metrics_tas_raw = {
-                'MAE': mean_absolute_error(obs_tas_aligned, raw_tas_aligned), 
-                'RMSE':np.sqrt(mean_squared_error(obs_tas_aligned, raw_tas_aligned)),
-                'Bias': np.mean(raw_tas_aligned - obs_tas_aligned),
-                'R2': r2_score(obs_tas_aligned, raw_tas_aligned)
-            }
-            evaluation_results.append({
-                'Model': model, 'Scenario': scenario, 'Station_ID': stn_id, 'Variable': Temperature_C,
-                'Type': 'Raw GCM', **metrics_tas_raw
-            })
-            
-            if not bc_py_tas_aligned.empty:
-                metrics_tas_bc_py = {
-                    'MAE': mean_absolute_error(obs_tas_aligned, bc_py_tas_aligned),
-                    'RMSE': np.sqrt(mean_squared_error(obs_tas_aligned, bc-py_tas_aligned)),
-                    'Bias': np.mean(bc_py_tas_aligned - obs_tas_aligned),
-                    'R2': r2_score(obs_tas_aligned, bc_py_tas_aligned)
-                }
-                evaluation_results.append({
-                    'Model': model, 'Scenario': scenario, 'Station_ID': stn_id, 'Variable': 'Temperature_C', 'Type':'Bias-Corrected (Python)', **metrics_tas_bc_py
-                })
-                
-            if not bc_r_tas_aligned.empty:
-                metrcis_tas_bc_r = {
-                    'Model': model, 'Scenario':scenario, 'Station_ID': stn_id, 'Variable':'Temperature_C','Type':'Bias-Corrected (R/CDFt)', **metrics_tas_bc_r
-                }
-                evaluation_results.append({
-                    'Model': model, 'Scenario': scenario, 'Station_ID':stn_id, 'Variable': 'Temperature_C', 'Type':'Bias-Corrected (R/CDFt)', **metrics_tas_bc_r
-                })
-                
-                
-            #--- Precipitation Evaluation ----#
-            mertrics_pr_raw = {
-                'MAE': mean_absolute_error(obs_pr_aligned, raw_pr_aligned),
-                'RMSE': np.sqrt(mean_sqaured_error(obs_pr_aligned, raw_pr_aligned)),
-                'Bias_Percent': (np.mean(raw_pr_aligned) - np.mean(obs_pr_aligned))/ np.mean(obs_pr_aligned) * 100 if np.mean(obs_pr_aligned) != 0 else np.nan,
-                'R2': r2_score(obs_pr_aligned, raw_pr_aligned)
-            }
-            
-            evaluation_results.append({
-                'Model': model, 'Scenario': scenario, 'Station_ID': stn_id, 'Variable': 'Precipitation_mm_day',
-                'Type': 'Raw GCM', **metrics_pr_raw
-            })
-            
-            if not bc_py_pr_aligned.empty:
-                metrics_pr_bc_py = {
-                    'MAE': mean_absolute_error(obs_pr_aligned, bc_py_pr_aligned),
-                    'RMSE': np.sqrt(mean_squared_error(obs_pr_aligned, bc_py_pr_aligned)),
-                    'Bias_Percent': (np.mean(bc_py_pr_aligned) - np.mean(obs_pr_aligned))/ np.mean(obs_pr_aligned) * 100 if np.mean(obs_pr_aligned) != 0 else np.nan,
-                    'R2': r2_score(obs_pr_aligned, bc_py_pr_aligned)
-                }
-                evaluation_results.append({
-                    'Model': model, 'Scenario': scenario, 'Station_ID': stn_id, 'Variable':'Precipitation_mm_day',
-                    'Type': 'Bias-Corrected (Python)', **metrics_pr_bc_py
-                })
-                
-            if not bc_r_pr_aligned.mpty:
-                metrics_pr_bc_r = {
-                    'MAE': mean_absolute_error(obs_pr_aligned, bc_r_pr_aligned),
-                    'RMSE': np.sqrt(mean_squared_error(obs_pr_aligned, bc_r_pr_aligned)),
-                    'Bias_Percent': (np.mean(bc_r_pr_aligned) - np.mean(obs_pr_aligned)) / np.mean(obs_pr_aligned) * 100 if np.mean(obs_pr_aligned) != 0 else np.nan,
-                    'R2': r2_score(obs_pr_aligned, bc_r_pr_aligned)
+            raw_gcm_filepath = find_table(raw_gcm_filepath)
+            with stage('lookup_cache', model=model, scenario=scenario):
+                raw_digests = station_slice_digests(raw_gcm_filepath, cache_index)
+        
+                # One cache key per station from the hashes of all of its input slices
+                keys = {
+                    stn_id: combination_key(
+                        obs_digests.get(stn_id), raw_digests.get(stn_id),
+                        *[file_digest(find_table(p)) for p in bc_filepaths(bias_corrected_dir, model, scenario, stn_id, bias_corrected_r_dir).values()],
+                        model=model, scenario=scenario, **settings
+                    )
+                    for stn_id in station_ids
                 }
-                
-                evaluation_results.append({
-                    'Model': model, 'Scenario': scenario, 'Station_ID': stn_id, 'Variable': 'Precipitation_mm_day',
-                    'Type': 'Bias-Corrected (R/CDFt)', **metrics_pr_bc_r
-                })
-            print(f"   Metrics Calculated for {stn_id}.")
-        results_df = pd.DataFrame(evaluation_results)
-        output_path = os.path.join(output_dir, 'bias_correction_evaluation_results.csv')
-        results_df.to_csv(output_path, index = False)
-        print(f"\nEvaluation results saved to: {output_path}")
+                cached = {stn_id: load_cached_result(cache_dir, key) for stn_id, key in keys.items()} if use_cache else {}
+                stale = [stn_id for stn_id in station_ids if cached.get(stn_id) is None]
+                count('stations_cached', len(station_ids) - len(stale))
+            print(f"   {len(station_ids) - len(stale)} stations from cache, {len(stale)} to compute.")
         
+            if stale:
+                with stage('load_inputs', model=model, scenario=scenario):
+                    if obs_df is None:
+                        # Load observed station data (historical period for evaluation)
+                        obs_df = read_table(station_data_path, 'station_data')
+                        obs_df['Station_ID'] = obs_df['Station_ID'].astype(str)
+                        if qc_flags is not None:
+                            obs_df = apply_qc_flags(obs_df, qc_flags)
+                    raw_gcm_df = read_table(raw_gcm_filepath, 'gcm_extracted')
+                    raw_gcm_df['Station_ID'] = raw_gcm_df['Station_ID'].astype(str)
+                fresh_df = score_stations(obs_df, raw_gcm_df, bias_corrected_dir, model, scenario, stale,
+                                          n_bootstrap, bootstrap_block_length, bootstrap_seed, n_workers, bias_corrected_r_dir)
+                for stn_id in stale:
+                    cached[stn_id] = fresh_df[fresh_df['Station_ID'] == stn_id].reset_index(drop=True)
+                    if use_cache:
+                        # Cache entries are pickled in the background while the next model is scored
+                        writer.submit(store_cached_result, cache_dir, keys[stn_id], cached[stn_id])
         
-        # optional: Print summary statistics
-        print("\n---- Summary of Evaluation Results (Mean across stations) ---")
-        print(results_df.groupby().mean(numeric_only=True))
+            # The results table is assembled from the per-station entries
+            evaluation_results.extend(cached[stn_id] for stn_id in station_ids)
+            print(f"   Metrics Calculated for {len(station_ids)} stations.")
+    
+    if use_cache:
+        save_cache_index(cache_dir, cache_index)
+    evaluation_results = [df for df in evaluation_results if not df.empty]
+    if not evaluation_results:
+        print("No evaluation results were produced. Check GCM and bias-corrected files.")
+        return
+    results_df = pd.concat(evaluation_results, ignore_index=True)
+    output_path = os.path.join(output_dir, 'bias_correction_evaluation_results.csv')
+    with stage('write_results'):
+        results_df.to_csv(output_path, index = False)
+        count('files_written')
+        count('bytes_written', os.path.getsize(output_path))
+        count('rows_written', len(results_df))
+    print(f"\nEvaluation results saved to: {output_path}")
+    
+    
+    # optional: Print summary statistics
+    print("\n---- Summary of Evaluation Results (Mean across stations) ---")
+    print(results_df.groupby(['Model', 'Scenario', 'Variable', 'Type']).mean(numeric_only=True))
+    return results_df
         
-if __name__ ==== "__main__":
+if __name__ == "__main__":
     # Ensure station data, preprocessed GCM data, and bias-corrected data are available
     # Run 01_generate_station_data.py, 02_gcm_preprocessing.py, and 03_bias_correction_python.py (and 07_cdt_bias_correction_cdft.R) before running this script.
-    evaluate_bias_correction()
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
-            
+    evaluate_bias_correction(n_bootstrap=1000)
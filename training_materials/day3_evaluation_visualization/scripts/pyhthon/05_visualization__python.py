@@ -1,343 +1,245 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
 import numpy as np
+import xarray as xr
 import os
+import sys
 
+from plot_jobs import render_jobs
+from basemap_cache import SUDAN_EXTENT, get_base_layer
+from spatial_interpolation import get_interpolation_weights, interpolate_fields
+from timeseries_decimation import prepare_series, pixel_width, span_pixels
+from plot_aggregates import FILE_PREFIX, aggregates_path, aggregates_up_to_date, build_plot_aggregates, rebin_density
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common'))
+from interchange import read_table, table_filename
+from instrumentation import count, instrumented, stage
+
+# Variables plotted, their file-name prefix and unit label
+VARIABLES = ['Temperature_C', 'Precipitation_mm_day']
+UNITS = {'Temperature_C': '(°C)', 'Precipitation_mm_day': '(mm/day)'}
+
+
+@instrumented()
 def visualize_results(
-    station_data_path ='../../data/station_data/generated_station_data.csv',
+    station_data_path ='../../data/station_data/generated_station_data.feather',
     processed_gcm_dir = '../../data/processed_gcm',
     bias_corrected_dir = '../../output/bias_corrected',
-    output_dir = '../../output/plots'
+    output_dir = '../../output/plots',
+    natural_earth_dir = '../../data/natural_earth',
+    timeseries_view = 'daily',
+    interpolation_method = 'idw',
+    grid_resolution = 0.25,
+    n_workers = None,
+    bias_corrected_r_dir = None,
+    model_to_visualize = 'ACCESS-CM2',
+    scenarios_to_visualize = ('historical', 'ssp245', 'ssp585'),
+    historical_period = '1991-2020',
+    future_period = '2041-2070'
 ):
     """
     Generates time series plots, spatial maps, and distribution plots.    
+    The data for every figure is prepared first as a self-contained plot job; the jobs are then
+    rendered headless (Agg) across n_workers processes (one per core by default).
+    Spatial maps share one Sudan base layer rendered from the local Natural Earth shapefiles in
+    natural_earth_dir and cached under output_dir/basemap_cache.
+    Time series are drawn as 'daily' min/max envelopes sized to the figure width, or as
+    'monthly' / 'annual' means (timeseries_view).
+    Every figure reads a pre-aggregated cube per scenario (period means, monthly climatologies,
+    histogram counts and the selected stations' daily series per source/station/variable),
+    built in one read of each source table and rebuilt only when its inputs change.
+    Gridded maps interpolate the station means to a grid_resolution-degree grid with
+    interpolation_method ('idw' or 'kriging', None to skip); the interpolation weights are
+    cached under output_dir/interpolation_cache per station network and grid.
+    One model_to_visualize is plotted for scenarios_to_visualize (which must include 'historical'),
+    the historical run over historical_period and the others over future_period. The R/CDFt outputs
+    are read from bias_corrected_r_dir (default: bias_corrected_dir/r_cdft).
     """
+    if bias_corrected_r_dir is None:
+        bias_corrected_r_dir = os.path.join(bias_corrected_dir, 'r_cdft')
     print("Starting visualization of results ...")
-    os.makedirs(output_dir, exists_ok = True)
+    os.makedirs(output_dir, exist_ok = True)
     
     # Load observed station data
-    obs_df = pd.read_csv(station_data_path, parse_dates= True)
-    obs_df = obs_df.set_index('Date')
-    station_metadata = obs_df.drop_duplicates().set_index('Station_ID')
+    obs_df = read_table(station_data_path, 'station_data')
+    obs_df = obs_df.set_index('Date').sort_index()
+    station_metadata = obs_df.drop_duplicates('Station_ID').set_index('Station_ID')[['Latitude', 'Longitude']]
     
     # Select a few stations for time series and distribution plots
-    selected_stations = station_metadata.sample(3, random_state = 42).index.tolist()  # Randomly pick 3 stations for reproducibility
+    selected_stations = station_metadata.sample(min(3, len(station_metadata)), random_state = 42).index.tolist()  # Randomly pick 3 stations for reproducibility
     print(f"Selected stationd for detailed plots: {selected_stations}")
     
-    # Define GCM model and scenarios to visualize
-    model_to_visualize = 'ACCESS-CM2'        # Choose one model for visualization
-    scenarios_to_visualize = ['historical', 'ssp245', 'ssp585']
-    historical_period = '1991-2020'
-    future_period = '2041-2070'
+    # ---- Aggregation stage: one pass over every source of each scenario into a compact cube ----
+    aggregates_dir = os.path.join(output_dir, 'aggregates')
+    cubes = {}
+    for scenario in scenarios_to_visualize:
+        period = historical_period if scenario == 'historical' else future_period
+        cube_path = aggregates_path(aggregates_dir, model_to_visualize, scenario, period)
+        cube_inputs = [station_data_path, os.path.join(processed_gcm_dir, table_filename('gcm_extracted', model=model_to_visualize, scenario=scenario, period=period))]
+        for stn_id in station_metadata.index:
+            for prefix in FILE_PREFIX.values():
+                cube_inputs.append(os.path.join(bias_corrected_dir, table_filename(f'{prefix}_bc', model=model_to_visualize, scenario=scenario, station=stn_id)))
+                cube_inputs.append(os.path.join(bias_corrected_r_dir, table_filename(f'{prefix}_bc_cdft', model=model_to_visualize, scenario=scenario, station=stn_id)))
+        if not aggregates_up_to_date(cube_path, cube_inputs, selected_stations):
+            print(f"\nAggregating {scenario} means, climatologies, histograms and series ...")
+            with stage('build_plot_aggregates', model=model_to_visualize, scenario=scenario):
+                build_plot_aggregates(obs_df.reset_index(), station_metadata, processed_gcm_dir, bias_corrected_dir,
+                                      model_to_visualize, scenario, period, aggregates_dir, selected_stations,
+                                      bias_corrected_r_dir)
+        cubes[scenario] = xr.load_dataset(cube_path)
+    cube = cubes['historical']
+    
+    jobs = []
     
     # --- 1. Time Series Plots (for selected stations) -----
-    print("\nGenerating time series plots ...")
+    print("\nPreparing time series plots ...")
+    ts_figsize = (12, 6)
+    n_pixels = pixel_width(ts_figsize)
+    view_title = '' if timeseries_view == 'daily' else f' - {timeseries_view} means'
     for stn_id in selected_stations:
-        obs_stn_df = [obs_df == stn_id]
+        obs_stn_df = obs_df[obs_df['Station_ID'] == stn_id]
         
-        for var in:
-            plt.figure(figsize=(12,6))
-            plt.plot(obs_stn_df.index, obs_stn_df[var], label='Obsered', color='black', linewidth=1)
+        for var in VARIABLES:
+            prefix = FILE_PREFIX[var]
+            raw_series = [('Observed', obs_stn_df.index.values, obs_stn_df[var].values, {'color': 'black', 'linewidth': 1})]
             
             for scenario in scenarios_to_visualize:
-                period = historical_period if scenario == 'historical' else future_period
-                
-                # Load raw GCM data
-                raw_gcm_filepath = os.path.join(processed_gcm_dir, f'gcm_extracted_{model_to_visualize}_{scenario}_{period}.csv')
-                if os.path.exists(raw_gcm_filepath):
-                    raw_gcm_df = pd.read_csv(raw_gcm_filepath, parse_dates=True).set_index('Date')
-                    raw_gcm_stn_df = [raw_gcm_df == stn_id]
-                    plt.plot(raw_gcm_stn_df.index, raw_gcm_stn_df[var], label='Raw GCM ({scenario})', linestyle='--', alpha=0.7)
-                    
-                # Load Python bias-corrected GCM data
-                bc_py_filepath = os.path.join(bias_corrected_dir, f'{var.split("_").lower()}_bc_{model_to_visualize}_{scenario}_{stn_id}.csv')
-                if os.path.exissts(bc_py_filepath):
-                    bc_py_df = pd.read_csv(bc_py_filepath, parse_dates=True).set_index('Date')
-                    bc_py_df = [bc_py_df == stn_id]]
-                    plt.plot(bc_py_stn_df.index, bc_py_stn_df, label= f'BC (Python) ({scenario})', linestyle="-", alpha=0.8)
-                    
-                # Load R CDFt bias-corrected GCM data
-                bc_r_filepath = os.path.join(bias_corrected_dir, 'r_cdft', f'{var.split("_").lower()}_bc_cdft_{model_to_visualize}_{scenario}_{stn_id}.csv')
-                if os.path.exists(bc_r_filepath):
-                    bc_r_df = pd.read_csv(bc_r_filepath, parse_dates=True).set_index('Date')
-                    bc_r_stn_df = [bc_r_df == stn_id]
-                    plt.plot(bc_r_stn_df.inde, bc_r_stn_df, label= f'BC (R'CDFt) ({scenario})', linestyle=':', alpha=0.8)
-                    
-            plt.title(f'{var} Time Series for Station {stn_id} ({model_to_visualize})')
-            plt.xlabel('Date')
-            plt.ylabel(f'{var} {"(°C)" if "Temperature" in var else "(mm/day)"}')
-            plt.legend()
-            plt.grid(True)
-            plt.tight_layout()
-            plt.savefig(os.path.join(output_dir, f'timeseries_{var.split("_").lower()}_{stn_id}.png'))
-            plt.close()
-            print(f"    Saved time series for {var} at {stn_id}.")
+                # Raw GCM, Python and R/CDFt corrected series of this station from the scenario's cube
+                values = cubes[scenario][f'series_{var}'].sel(series_station=stn_id)
+                dates = cubes[scenario]['time'].values
+                for source, label, style in [
+                    ('Raw GCM', f'Raw GCM ({scenario})', {'linestyle': '--', 'alpha': 0.7}),
+                    ('Bias-Corrected (Python)', f'BC (Python) ({scenario})', {'linestyle': '-', 'alpha': 0.8}),
+                    ('Bias-Corrected (R/CDFt)', f'BC (R/CDFt) ({scenario})', {'linestyle': ':', 'alpha': 0.8}),
+                ]:
+                    y = values.sel(source=source).values
+                    valid = np.isfinite(y)
+                    if valid.any():
+                        first, last = np.flatnonzero(valid)[[0, -1]]
+                        raw_series.append((label, dates[first:last + 1], y[first:last + 1], style))
             
+            # Decimate/aggregate in NumPy so Matplotlib only sees about one point per pixel; each
+            # series gets the pixels of its own share of the axis' time span
+            axis_start = min(x.min() for _, x, _, _ in raw_series if len(x))
+            axis_end = max(x.max() for _, x, _, _ in raw_series if len(x))
+            series = []
+            for label, x, y, style in raw_series:
+                x, y = prepare_series(x, y, timeseries_view, span_pixels(x, axis_start, axis_end, n_pixels))
+                series.append({'label': label, 'x': x, 'y': y, 'style': style})
             
-    # ---- 2. Spatial Maps (Mean Temperature/Precipitation for Historical Period) ----
-    print("\nGenerating spatial maps ....")
-    
-    # Calculate mean for observed data (1991-2020)
-    obs_mean_temp = obs_df.loc[historical_period].groupby('Station_ID').mean()
-    obs_mean_pr = obs_df.loc[historical_period].groupby('Station_ID')['Precipitation_mm_day'].mean()
-    
-    # Get GCM historical data (raw) for spatial comparison
-    raw_gcm_hist_df = pd.read_csv(os.path.join(processed_gcm_dir, f'gcm_extracted_{model_to_visualize}_historical_{historical_period}.csv'), parse_dates=True).set_index('Date')
-    
-    # For bias-corrected historical, we need to aggregate the station-wise BC files.
-    bc_hist_temp_dfs_py = []
-    bc_hist_pr_dfs_py = []
-    bc_hist_temp_dfs_r = []
-    bc_hist_pr_dfs_r = []
-    
-    for stn_id in station_metadata.index:
-        # Python BC
-        temp_bc_py_path = os.path.join(bias_corrected_dir, f'temp_bc_{model_to_visualize}_historical_{stn_id}.csv')
-        pr_bc_py_path = os.path.join(bias_corrected_dir, f'precip_bc_{model_to_visualize}_historical_{stn_id}.csv')
-        
-        if os.path.exists(temp_bc_py_path):
-            bc_hist_temp_dfs_py.append(pd.read_csv(temp_bc_py_path, parse_dates=True))
-        if os.path.exists(pr_bc_py_path):
-            bc_hist_pr_dfs_py.append(pd.read_csv(pr_bc-py_path, parse_dates=True))
-            
-        # R CDFt BC
-        temp_bc_r_path = os.path.join(bias_corrected_dir, 'r_cdft', f'temp_bc_cdft_{model_to_visualize}_historical_{stn_id}.csv')
-        pr_bc_r_path = os.path.join(bias_corrected_dir, 'r_cdft', f'precip_bc_cdft_{model_to_visualize}_historical_{stn_id}.csv')
-        if os.path.exists(temp_bc_r_path):
-            bc_hist_temp_dfs_r.append(pd.read_csv(temp_bc_r_path, parse_dates=True))
-        if os.path.exists(pr_bc_r_path):
-            bc_hist_pr_dfs_r.append(pd.read_csv(pr_bc_r_path, parse_dates=True))
-        
-    bc_mean_temp_py = pd.Series(dtype=float)
-    bc_mean_pr_py = pd.Series(dtype=float)
-    bc_mean_temp_r = pd.Series(dtype=float)
-    bc_mean_pr_r = pd.Series(dtype=float)
-    
-    if bc_hist_temp_dfs_py:
-        bc_hist_temp_df_all_py = pd.concat(bc_hist_temp_dfs_py).set_index('Dae')
-        bc_mean_temp_py = bc_hist_temp_df_all_py.loc[historical_period].groupby('Station_ID').mean()
-    if bc_hist_pr_dfs_py:
-        bc_hist_pr_df_all_py = pd.concat(bc_hist_pr_dfs-py).set_index('Date')
-        bc_mean_pr_py = bc_hist_pr_df_all_py.loc[historical_period].groupby('Station_ID').mean()
+            jobs.append({
+                'kind': 'timeseries',
+                'path': os.path.join(output_dir, f'timeseries_{prefix}_{stn_id}.png'),
+                'title': f'{var} Time Series for Station {stn_id} ({model_to_visualize}){view_title}',
+                'figsize': ts_figsize,
+                'xlabel': 'Date',
+                'ylabel': f'{var} {UNITS[var]}',
+                'series': series,
+            })
     
-    if bc_hist_temp_dfs_r:
-        bc_hist_temp_df_all_r = pd.concat(bc_hist_temp_dfs_r).set_index('Date')
-        bc_mean_temp_r = bc_hist_temp_df_all_r.loc[historical_period].groupby('Station_ID').mean()
-    if bc_hist_pr_dfs_r:
-        bc_hist_pr_df_all_r = pd.concat(bc_hist_pr_dfs_r).set_index('Date')
-        bc_mean_pr_r = bc_hist_pr_df_all_r.loc[historical_period].groupby('Station_ID').mean()
-        
-    # Merg mean values with station metadata for plotting
-    plot_data_temp = station_metadata.merge(obs_mean_temp.rename('Observed'), left_index=True, right_index=True, how ='left')
-    plot_data_temp = plot_data_temp.merge(raw_gcm_hist_df.loc[historical_period].groupby('Station_ID').mean().rename('Raw_GCM'), left_index=True, right_index=True, how='left')
-    plot_data_temp = plot_data_temp.merge(bc_mean_temp_py.rename('Bias_Corrected_Python'), left_index=True, right_index+True, how=left')
-    plot_data_temp = plot_data_temp.merge(bc_mean_temp_r.rename('Bias_Corrected_R_CDFt'), left_index=True, right_index=True, how='left')
-    
-    plot_data_pr = station_metadata.merge(obs_mean_pr.rename('Observed'), left_index=True, right_index=True, how='left')
-    plot_data_pr = plot_data_pr.merge(raw_gcm_hist_df.loc[historical_period].groupby('Station_ID')['Precipitation_mm_day'].mean().rename('Raw_GCM'), left_index=True, right_index=True, how='left')
-    plot_data_pr = plot_data_pr.merge(bc_mean_pr_py.rename('Bias_Corrected_Python'), left_index+True, right_index=True, how='left')
-    plot_data_pr = plot_data_pr.merge(bc_mean_pr_r.rename('Bias_Corrected_R_CDFt'), left_index=True, right_index+True, how='left')
-    
-    # Plotting function for spatial maps
-    def plot_spatial_map(data_df, var_name, title_suffix, unit, filename_suffix):
-        if data_df.empty:
-            print(f" No data to plot for spatial map: {title_suffix}. Skipping")
-            return
-            
-        fig = plt.figure(figsize=(10, 8))
-        ax = fig.add_subplot(1,1,1, projection=ccrs.PlateCarree())
-        ax.set_extent([20.0, 39.5, 8.6, 24.5], crs=ccrs.PlateCarree())    $ Sudan extent
-        
-        ax.add_feature(cfeature.COASTLINE)
-        ax.add_feature(cfeature.BORDERS, linestyle=':')
-        ax.add_feature(cfeature.LAKES, alpha=0.5)
-        ax.add_feature(cfeature.RIVERS)
-        
-        # Add a light background for land
-        ax.add_feature(cfeature.LAND, edgecolors = 'black', facecolor='lightgray')
-        ax.add_feature(cfeature.OCEAN, facecolor='lightblue')
-        
-        sc = ax.scatter(data_df['Longitude'], data_df['Latitude'], c=data_df[var_name],
-        cmap= 'viridis' if 'Temperature' in var_name else 'Blues',
-        s=100, edgecolors='black', transform= ccrs.PlateCarree())
-        
-        plt.colorbar(sc, label=f'Mean {var_name.replace("_", " ")} {unit}')
-        ax.set_title(f'Mean {title_suffix}  ({historical_period})')
-        ax.gridlines(draw_labels=True, dms=Tue, x_inline=False, y_inline=False)
-        
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'spatial_map_{filename_suffix}.png'))
-        plt.close()
-        
-        print(f" Saved spatial map for {title_suffix}.")
-        
-    # Plot for Temperature
-    plot_spatial_map(plot_data_temp, 'Observed', 'Observed Temperature', '(°C)', 'temp_observed')
-    plot_spatial_map(plot_data_remp, 'Raw_GCM', 'Raw GCM Temperature', '(°C)', 'temp_raw_gcm')
-    plot_spatial_map(plot_data_temp, 'Bias_Corrected_Python', 'Bias Cprrected (Python) Temperature', '(°C)', 'temp_bc_python')
-    plot_spatial_map(plot_data_temp, 'Bias_Corrected_R_CDFt', 'Bias Corrected (R/CDFt) Temperature', '(°C)', 'temp_bc_r_cdft')
-    
-    
-    # Plot for Precipitation
-    plot_spatial_map(plot_data_pr, 'Observed', 'Observed Precipitation', '(mm/day)', 'precip_observed')
-    plot_spatial_map(plot_data_pr, 'Raw_GCM', 'Raw GCM Precipitation', '(mm/day)', 'precip_raw_gcm')
-    plot_spatial_map(plot_data_pr, 'Bias_Corrected_Python', 'Bias Corrected (Python) Precipitation', '(mm/day)', 'precip_bc_python')
-    plot_spatial_map(plot_data_pr, 'Bias_Corrected_R_CDFt', 'Bias Corrected (R/CDFt) Precipitation', '(mm/day)', 'precip_bc_r_cdft')
+    # ---- 2. Spatial Maps (Mean Temperature/Precipitation for Historical Period) ----
+    print("\nPreparing spatial maps ....")
+    
+    # The cartographic base layer is projected and rasterized once and reused under every map
+    try:
+        with stage('base_layer'):
+            basemap_path = get_base_layer(os.path.join(output_dir, 'basemap_cache'), natural_earth_dir)
+    except Exception as e:
+        print(f" Base layer unavailable ({e}). Maps will be drawn without it.")
+        basemap_path = None
+    
+    for var in VARIABLES:
+        prefix = FILE_PREFIX[var]
+        name = 'Temperature' if 'Temperature' in var else 'Precipitation'
+        for source, col, title, suffix in [
+            ('Observed', 'Observed', f'Observed {name}', 'observed'),
+            ('Raw GCM', 'Raw_GCM', f'Raw GCM {name}', 'raw_gcm'),
+            ('Bias-Corrected (Python)', 'Bias_Corrected_Python', f'Bias Corrected (Python) {name}', 'bc_python'),
+            ('Bias-Corrected (R/CDFt)', 'Bias_Corrected_R_CDFt', f'Bias Corrected (R/CDFt) {name}', 'bc_r_cdft'),
+        ]:
+            values = cube[f'mean_{var}'].sel(source=source).values
+            has_data = np.isfinite(values)
+            if not has_data.any():
+                print(f" No data to plot for spatial map: {title}. Skipping")
+                continue
+            jobs.append({
+                'kind': 'spatial_map',
+                'path': os.path.join(output_dir, f'spatial_map_{prefix}_{suffix}.png'),
+                'title': f'Mean {title}  ({historical_period})',
+                'lon': cube['longitude'].values[has_data],
+                'lat': cube['latitude'].values[has_data],
+                'values': values[has_data],
+                'basemap': basemap_path,
+                'cmap': 'viridis' if 'Temperature' in var else 'Blues',
+                'colorbar_label': f'Mean {col.replace("_", " ")} {UNITS[var]}',
+            })
+    
+    # ---- 2b. Gridded Maps (station means interpolated to a regular grid) ----
+    if interpolation_method:
+        print(f"\nPreparing gridded maps ({interpolation_method}) ....")
+        lon, lat = cube['longitude'].values, cube['latitude'].values
+        with stage('interpolation_weights', method=interpolation_method, resolution=grid_resolution):
+            weights, grid_lon, grid_lat = get_interpolation_weights(
+                lon, lat, SUDAN_EXTENT, grid_resolution, interpolation_method,
+                cache_dir=os.path.join(output_dir, 'interpolation_cache'))
+            # Kriging weights are signed: cells that lose too much weight to missing stations use IDW
+            fallback = None
+            if interpolation_method != 'idw':
+                fallback, _, _ = get_interpolation_weights(lon, lat, SUDAN_EXTENT, grid_resolution, 'idw',
+                                                           cache_dir=os.path.join(output_dir, 'interpolation_cache'))
+        suffixes = {'Observed': 'observed', 'Raw GCM': 'raw_gcm',
+                    'Bias-Corrected (Python)': 'bc_python', 'Bias-Corrected (R/CDFt)': 'bc_r_cdft'}
+        for var in VARIABLES:
+            prefix = FILE_PREFIX[var]
+            # station x source: every source's surface from one sparse product
+            means = cube[f'mean_{var}'].transpose('station', 'source')
+            fields = interpolate_fields(weights, means.values, (len(grid_lat), len(grid_lon)), fallback)
+            for k, source in enumerate(means['source'].values):
+                if not np.isfinite(fields[k]).any():
+                    continue
+                jobs.append({
+                    'kind': 'gridded_map',
+                    'path': os.path.join(output_dir, f'gridded_map_{prefix}_{suffixes[source]}_{interpolation_method}.png'),
+                    'title': f'Mean {source} {var} ({historical_period}, {interpolation_method.upper()})',
+                    'grid_lon': grid_lon,
+                    'grid_lat': grid_lat,
+                    'field': fields[k],
+                    'lon': lon,
+                    'lat': lat,
+                    'basemap': basemap_path,
+                    'cmap': 'viridis' if 'Temperature' in var else 'Blues',
+                    'colorbar_label': f'{var} {UNITS[var]}',
+                })
     
     #--- 3. Distribution Plots (Histograms/PDFs for selected stations) ----- #
-    print("\nGenerating distribution plots ....")
-    
+    print("\nPreparing distribution plots ....")
+    colors = {'Observed': 'black', 'Raw GCM': 'red', 'Bias-Corrected (Python)': 'blue', 'Bias-Corrected (R/CDFt)': 'darkgreen'}
     for stn_id in selected_stations:
-        obs_stn_df_hist = [obs_df == stn_id].loc[historical_period]
-        
-        for var in station_metadata:
-            plt.figure(figsize=(10,6))
-            
-            # Load raw GCM historical data for this station
-            raw_gcm_hist_df = pd.read_csv(os.path.join(processed_gcm_dir, f'gcm_extracted_{model_to_visualize}_historical_{historical_period}.csv'), parse_dates=True).set_index('Date')
-            raw_gcm_stn_hist_df = [raw_gcm_hist_df == stn_id].loc[historical_period]
-            
-            # Load Python bias-corrected historical data for this station
-            bc_py_filepath = os.path.join(bias_corrected_dir, f'{var.split("_").lower()}_bc_{model_to_visualize}_historical_{stn_id}.csv')
-            bc_py_df = pd.read_csv(bc_py_filepath, parse_dates=True).set_index('Date')
-            bc_py_stn_hist_df = [bc_py_df == stn_id].loc[historical_period]
-            
-            # Load R CDFt bias-corrected historical data for this station
-            bc_r_filepath = os.path.join(bias_corrected_dir, 'r_cdft', f'{var_split("_").lower()}_bc_cdft_{model_to_visualize}_historical_{stn_id}.csv')
-            bc_r_df = pd.read_csv(bc_r_filepath, parse_dates=True).set_index('Date')
-            bc_r_stn_hist_df = [bc_r_df == stn_id].loc[historical_period]
-            
-            # Plot histograms
-            bins = 30 if 'Temperature' in var_name else 50        # More bins for precipitation due to  zeros
+        for var in VARIABLES:
+            prefix = FILE_PREFIX[var]
+            counts = cube[f'hist_{var}'].sel(station=stn_id).values
             
-            # Determine common range for consistent plotting
-            all_data = []
-            if not obs_stn_df_hist[var_name],empty: all_data.extend(obs_stn_df_hist[var_name].tolist())
-            if not raw_gcm_stn_hist_df[var_name].empty: all_data.extend(raw_gcm_stn_hist_df[var_name].tolist())
-            if not bc_py_stn_hist_df.empty: all_data.extend(bc_py_stn_hist_df.tolist())
-            if not bc_r_stn_hist_df.empty: all_data.extend(bc_r_stn_hist_df.tolist())
-            
-            if not all_data:
-                print(f" No data for distirbution plot for {var_name} at {stn_id}. Skipping")
+            # Re-bin the shared fine bins over the common range for consistent plotting
+            bins = 30 if 'Temperature' in var else 50        # More bins for precipitation due to  zeros
+            edges, density = rebin_density(counts, cube[f'edges_{var}'].values, bins)
+            if edges is None:
+                print(f" No data for distirbution plot for {var} at {stn_id}. Skipping")
                 continue
-                
-            min_val = np.min(all_data)
-            max_val = np.max(all_data)
-            range_val = (min_val, max_val)
-            
-            plt.hist(obs_stn_df_hist[var_name], bins=bins, density=True, alpha=0.6, label='Observed', color+'black', range=range_val)
-            plt.hist(raw_gcm_stn_hist_df[var_name], bins=bins, density =True, alpha=0.6, label='Raw GCM', color='red', range=range_val)
-            plt.hist(bc_py_stn_hist_df, bins=bins, density =True, alpha=0.6, label = 'Bias-Corrected (Python)', color = 'blue', range=range_val)
-            plt.hist(bc_r_stn_hist_df, bins=bins, density= True, alpha =0.6, label= 'Bias-Corrected (R/CDFt)', color = 'darkgreen', range=range_val)
-            
-            plt.title(f 'Distribution of {var_name} for station {stn_id} ({model_to_visualize})')
-            plt.xlabel(f'{var_name} {"(°C)" if "Temperature" in var_name else "(mm/day)"}')
-            plt.ylabel('Density')
-            plt.legend()
-            plt.grid(True)
-            plt.tight_layout()
-            plt.savefig(os.path.join(output_dir, f'distribution_{var_name.split("_").lower()}_{stn_id}.png'))
-            plt.close()
-            print(f" Saved distribution plot for {var_name} at {stn_id}.")
-            
+            jobs.append({
+                'kind': 'distribution',
+                'path': os.path.join(output_dir, f'distribution_{prefix}_{stn_id}.png'),
+                'title': f'Distribution of {var} for station {stn_id} ({model_to_visualize})',
+                'xlabel': f'{var} {UNITS[var]}',
+                'edges': edges,
+                'series': [{'label': source, 'density': density[k], 'color': colors[source]}
+                           for k, source in enumerate(cube['source'].values) if counts[k].sum() > 0],
+            })
+    
+    print(f"\nRendering {len(jobs)} figures ...")
+    with stage('render_figures', figures=len(jobs)):
+        render_jobs(jobs, n_workers)
+        count('files_written', len(jobs))
+
 if __name__ == "__main__":
     # Ensure all previous scripts have been run and data is avilable.
     # Run 01_generate_station_data.py, 02_gcm_preprocessing.py, and 03_bias_correction_pythob.py (and 07_cdt_bias_correction_cdft.R) before this script.
     visualize_results()
-    
-    
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
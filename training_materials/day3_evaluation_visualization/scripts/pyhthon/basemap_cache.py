@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# The Sudan base layer (land, ocean, lakes, rivers, coastline, borders) is drawn with cartopy
+# once, rasterized to a PNG and cached on disk. Spatial maps then draw that image as a
+# background under their scatter layer on plain lon/lat axes: PlateCarree is an
+# equirectangular projection, so the image maps linearly onto longitude and latitude.
+#
+# Natural Earth shapefiles are read from a local directory (nothing is downloaded), laid out
+# the way cartopy stores them:
+#   {natural_earth_dir}/shapefiles/natural_earth/physical/ne_50m_land.shp, ...
+# The shapefiles are not shipped with the repository: fetch_natural_earth.py fills that
+# directory once (it needs network access). Without them the maps are drawn on a plain
+# background. The cached PNG is keyed on the shapefiles' sizes and modification times, so it
+# is redrawn when the data changes.
+
+SUDAN_EXTENT = [20.0, 39.5, 8.6, 24.5]     # lon_min, lon_max, lat_min, lat_max
+
+# (category, name) of every Natural Earth layer used by the base layer
+BASE_LAYERS = [
+    ('physical', 'land'),
+    ('physical', 'ocean'),
+    ('physical', 'lakes'),
+    ('physical', 'rivers_lake_centerlines'),
+    ('physical', 'coastline'),
+    ('cultural', 'admin_0_boundary_lines_land'),
+]
+# Files cartopy's shapefile reader needs for every layer
+SHAPEFILE_COMPONENTS = ('.shp', '.shx', '.dbf')
+
+
+def missing_natural_earth_files(natural_earth_dir, resolution='50m'):
+    """
+    Lists the Natural Earth shapefile components (.shp, .shx, .dbf) the base layer needs that
+    are not in natural_earth_dir.
+    """
+    return [path for path in _natural_earth_files(natural_earth_dir, resolution) if not os.path.exists(path)]
+
+
+def _natural_earth_files(natural_earth_dir, resolution):
+    return [os.path.join(natural_earth_dir, 'shapefiles', 'natural_earth', category, f'ne_{resolution}_{name}{ext}')
+            for category, name in BASE_LAYERS for ext in SHAPEFILE_COMPONENTS]
+
+
+def _cache_key(extent, resolution, width_px, natural_earth_dir):
+    files = {}
+    for path in _natural_earth_files(natural_earth_dir, resolution):
+        st = os.stat(path)
+        files[os.path.basename(path)] = [st.st_size, st.st_mtime_ns]
+    payload = json.dumps({'extent': list(extent), 'resolution': resolution, 'width': width_px,
+                          'data': os.path.abspath(natural_earth_dir), 'files': files}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _render_base_layer(path, extent, resolution, width_px, natural_earth_dir):
+    """
+    Draws the base features with cartopy on a frameless figure whose pixel grid covers
+    exactly the requested extent, and saves it as a PNG.
+    """
+    import cartopy
+    import cartopy.crs as ccrs
+    import cartopy.feature as cfeature
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    # Read shapefiles from the bundled directory only, never from the network
+    cartopy.config['pre_existing_data_dir'] = natural_earth_dir
+    cartopy.config['data_dir'] = natural_earth_dir
+
+    lon_min, lon_max, lat_min, lat_max = extent
+    dpi = 100
+    height_px = int(round(width_px * (lat_max - lat_min) / (lon_max - lon_min)))
+    fig = Figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree())
+    ax.set_extent(extent, crs=ccrs.PlateCarree())
+    ax.set_axis_off()
+
+    def feature(category, name, **kwargs):
+        return cfeature.NaturalEarthFeature(category, name, resolution, **kwargs)
+
+    ax.add_feature(feature('physical', 'ocean', facecolor='lightblue', edgecolor='none'))
+    # Add a light background for land
+    ax.add_feature(feature('physical', 'land', edgecolor='black', facecolor='lightgray'))
+    ax.add_feature(feature('physical', 'lakes', facecolor='lightblue', edgecolor='none', alpha=0.5))
+    ax.add_feature(feature('physical', 'rivers_lake_centerlines', facecolor='none', edgecolor='steelblue'))
+    ax.add_feature(feature('physical', 'coastline', facecolor='none', edgecolor='black'))
+    ax.add_feature(feature('cultural', 'admin_0_boundary_lines_land', facecolor='none', edgecolor='black', linestyle=':'))
+    fig.savefig(path, dpi=dpi)
+
+
+def get_base_layer(cache_dir, natural_earth_dir, extent=SUDAN_EXTENT, resolution='50m', width_px=1000):
+    """
+    Path of the cached base-layer PNG for this extent, resolution and Natural Earth data,
+    rendering it on first use. Raises FileNotFoundError naming the missing shapefiles when the
+    local Natural Earth data is incomplete (cartopy would otherwise try to download it).
+    """
+    missing = missing_natural_earth_files(natural_earth_dir, resolution)
+    if missing:
+        raise FileNotFoundError(f"Natural Earth data missing for the base layer: {', '.join(missing)} "
+                                f"(run fetch_natural_earth.py once to download it)")
+    path = os.path.join(cache_dir, f'basemap_{_cache_key(extent, resolution, width_px, natural_earth_dir)}.png')
+    if os.path.exists(path):
+        return path
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + '.tmp.png'
+    _render_base_layer(tmp_path, extent, resolution, width_px, natural_earth_dir)
+    os.replace(tmp_path, path)
+    return path
+
+
+def draw_base_layer(ax, basemap_path, extent=SUDAN_EXTENT):
+    """
+    Draws a cached base layer (or a plain land-coloured background without one) on ordinary
+    Matplotlib axes and fixes the axes to the map extent in lon/lat degrees.
+    """
+    import matplotlib.image as mpimg
+
+    lon_min, lon_max, lat_min, lat_max = extent
+    if basemap_path and os.path.exists(basemap_path):
+        ax.imshow(mpimg.imread(basemap_path), extent=extent, origin='upper', interpolation='antialiased', zorder=0)
+    else:
+        ax.set_facecolor('lightgray')
+    ax.set_xlim(lon_min, lon_max)
+    ax.set_ylim(lat_min, lat_max)
+    ax.set_aspect('equal')
+    ax.set_xticks(np.arange(np.ceil(lon_min / 5) * 5, lon_max + 1e-9, 5))
+    ax.set_yticks(np.arange(np.ceil(lat_min / 5) * 5, lat_max + 1e-9, 5))
+    ax.xaxis.set_major_formatter(lambda x, pos: f'{abs(x):g}°{"E" if x >= 0 else "W"}')
+    ax.yaxis.set_major_formatter(lambda y, pos: f'{abs(y):g}°{"N" if y >= 0 else "S"}')
+    ax.grid(True, linestyle='--', alpha=0.5)
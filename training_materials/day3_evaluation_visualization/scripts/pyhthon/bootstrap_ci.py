@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+from evaluation_metrics import compute_metrics
+
+# Metrics that get confidence intervals (N is fixed by the data and is not resampled)
+BOOTSTRAP_METRICS = ['MAE', 'RMSE', 'Bias', 'Bias_Percent', 'R2']
+
+# Bytes a chunk of (stations x replicates) may use for its resampled arrays; compute_metrics
+# holds about _TEMPORARIES float64 arrays of the resampled simulations' size at once
+MEMORY_BUDGET = 256 * 2**20
+_TEMPORARIES = 8
+
+# Arrays shared with pool workers, set once per worker by _init_worker instead of being
+# pickled with every chunk of replicates
+_WORKER_DATA = {}
+
+
+def block_bootstrap_indices(n_time, n_replicates=1000, block_length=30, seed=None):
+    """
+    Moving-block bootstrap resample indices as one (replicates x time) array.
+
+    Each replicate is built from randomly placed blocks of block_length consecutive days,
+    which keeps the day-to-day autocorrelation of the series inside each block.
+    """
+    rng = np.random.default_rng(seed)
+    block_length = max(1, min(block_length, n_time))
+    n_blocks = -(-n_time // block_length)
+    starts = rng.integers(0, n_time - block_length + 1, size=(n_replicates, n_blocks))
+    idx = (starts[..., np.newaxis] + np.arange(block_length)).reshape(n_replicates, -1)
+    return idx[:, :n_time].astype(np.int32)
+
+
+def chunk_shape(n_sources, n_stations, n_time, n_replicates, memory_budget=MEMORY_BUDGET):
+    """
+    (stations, replicates) per chunk such that its resampled arrays fit in memory_budget bytes:
+    all stations and as many replicates as fit, or fewer stations (one replicate) per chunk
+    for networks too large for a single replicate.
+    """
+    per_station_replicate = (n_sources * _TEMPORARIES + 1) * n_time * 8
+    cells = max(1, memory_budget // per_station_replicate)
+    if cells >= n_stations:
+        return n_stations, int(max(1, min(n_replicates, cells // n_stations)))
+    return int(cells), 1
+
+
+def _init_worker(obs, sim):
+    _WORKER_DATA['obs'] = obs
+    _WORKER_DATA['sim'] = sim
+
+
+def _resampled_metrics(chunk, obs=None, sim=None):
+    """
+    Metrics for a chunk (station slice, replicate indices): obs[stations][:, idx] is
+    (station x replicate x time) and sim[:, stations][:, :, idx] is (source x station x
+    replicate x time), so every source and station is resampled with the same days and scored
+    by one compute_metrics call. Returns {metric: (source x station x replicate)}.
+    """
+    stations, idx = chunk
+    obs = _WORKER_DATA['obs'] if obs is None else obs
+    sim = _WORKER_DATA['sim'] if sim is None else sim
+    metrics = compute_metrics(obs[stations][:, idx], sim[:, stations][:, :, idx])
+    return {m: metrics[m] for m in BOOTSTRAP_METRICS}
+
+
+def bootstrap_metrics(obs, sim, n_replicates=1000, block_length=30, chunk_size=None, n_workers=None, seed=None,
+                      memory_budget=MEMORY_BUDGET):
+    """
+    Bootstrap distribution of every metric for all sources and stations.
+
+    obs is (station x time) and sim (source x station x time). Replicates and stations are
+    processed in chunks sized by chunk_shape() so that each chunk stays within memory_budget
+    bytes (shared by the n_workers processes of the pool when n_workers > 1); chunk_size fixes
+    the replicates per chunk instead. Returns {metric: (source x station x replicate)}.
+    """
+    obs = np.asarray(obs, dtype=float)
+    sim = np.asarray(sim, dtype=float)
+    n_sources, n_stations, n_time = sim.shape
+    idx = block_bootstrap_indices(n_time, n_replicates, block_length, seed)
+    workers = n_workers if n_workers and n_workers > 1 else 1
+    station_step, replicate_step = chunk_shape(n_sources, n_stations, n_time, n_replicates, memory_budget // workers)
+    if chunk_size:
+        replicate_step = chunk_size
+    chunks = [(slice(s, s + station_step), slice(r, r + replicate_step))
+              for s in range(0, n_stations, station_step) for r in range(0, n_replicates, replicate_step)]
+    tasks = [(stations, idx[replicates]) for stations, replicates in chunks]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(obs, sim)) as pool:
+            results = list(pool.map(_resampled_metrics, tasks))
+    else:
+        results = (_resampled_metrics(task, obs, sim) for task in tasks)
+
+    boot = {m: np.empty((n_sources, n_stations, n_replicates)) for m in BOOTSTRAP_METRICS}
+    for (stations, replicates), result in zip(chunks, results):
+        for m in BOOTSTRAP_METRICS:
+            boot[m][:, stations, replicates] = result[m]
+    return boot
+
+
+def bootstrap_ci_frame(obs, sim, sources, station_ids, n_replicates=1000, block_length=30, confidence=0.95,
+                       reference=None, n_workers=None, chunk_size=None, seed=None, **labels):
+    """
+    Block-bootstrap confidence intervals as a tidy frame keyed by (Station_ID, Type).
+
+    Adds {metric}_CI_Low / {metric}_CI_High for every source. When reference names one of the
+    sources, {metric}_Diff_CI_Low / _High give the interval of (source - reference) computed on
+    the same replicates, e.g. whether Python QM differs from R/CDFt at a station beyond noise.
+    Extra keyword arguments (Model, Scenario, Variable) are added as constant columns.
+    """
+    boot = bootstrap_metrics(obs, sim, n_replicates, block_length, chunk_size, n_workers, seed)
+
+    alpha = (1 - confidence) / 2 * 100
+    sources = list(sources)
+    n_sources, n_stations = len(sources), len(station_ids)
+    frame = pd.DataFrame({
+        **labels,
+        'Station_ID': np.tile(np.asarray(station_ids), n_sources),
+        'Type': np.repeat(np.asarray(sources), n_stations),
+    })
+    with warnings.catch_warnings():
+        # Sources missing at a station give all-NaN replicates and NaN intervals
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for m in BOOTSTRAP_METRICS:
+            low, high = np.nanpercentile(boot[m], [alpha, 100 - alpha], axis=-1)
+            frame[f'{m}_CI_Low'] = low.reshape(-1)
+            frame[f'{m}_CI_High'] = high.reshape(-1)
+            if reference in sources:
+                diff = boot[m] - boot[m][sources.index(reference)]
+                low, high = np.nanpercentile(diff, [alpha, 100 - alpha], axis=-1)
+                frame[f'{m}_Diff_CI_Low'] = low.reshape(-1)
+                frame[f'{m}_Diff_CI_High'] = high.reshape(-1)
+    return frame
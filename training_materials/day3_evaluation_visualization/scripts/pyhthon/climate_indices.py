@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+
+from evaluation_metrics import evaluate_block
+
+# ETCCDI-style indices computed on every (source, station) series, per calendar year.
+# Only daily mean temperature is available, so the percentile indices use Tmean
+# (TG90p / TG10p) in place of TX90p / TN10p.
+PRECIP_INDICES = ['Rx1day', 'Rx5day', 'CDD', 'CWD', 'R10mm', 'SDII']
+TEMP_INDICES = ['TG90p', 'TG10p']
+
+WET_DAY_THRESHOLD = 1.0     # mm/day, ETCCDI wet-day definition
+HEAVY_PRECIP_THRESHOLD = 10.0
+PERCENTILE_WINDOW = 5       # days, centred calendar-day window for percentile thresholds
+
+
+def _year_starts(dates):
+    """
+    Start positions of each calendar year in a sorted daily DatetimeIndex, plus the years.
+    """
+    years = np.asarray(dates.year)
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    return starts, years[starts]
+
+
+def _annual_sum(values, starts):
+    return np.add.reduceat(values, starts, axis=-1)
+
+
+def _annual_max(values, starts):
+    # fmax ignores NaN, so a year is NaN only when it has no valid value at all
+    return np.fmax.reduceat(values, starts, axis=-1)
+
+
+def _spell_lengths(flag, starts):
+    """
+    Run-length encodes a boolean (..., time) array: returns the length of the current run of
+    True values ending at each day. Runs are reset on False and at every year boundary.
+    """
+    count = np.cumsum(flag, axis=-1)
+    resets = np.where(flag, 0, count)
+    # At the first day of each year start counting afresh from the previous day's total
+    resets[..., starts[1:]] = count[..., starts[1:]] - flag[..., starts[1:]]
+    return count - np.maximum.accumulate(resets, axis=-1)
+
+
+def _rolling_sum(values, window):
+    """
+    Trailing window sum along time via cumulative sums; NaN where any day in the window is missing.
+    """
+    valid = np.isfinite(values)
+    csum = np.cumsum(np.where(valid, values, 0.0), axis=-1)
+    cvalid = np.cumsum(valid, axis=-1)
+    out = np.full(values.shape, np.nan)
+    out[..., window - 1:] = csum[..., window - 1:]
+    out[..., window:] -= csum[..., :-window]
+    n_valid = cvalid[..., window - 1:].copy()
+    n_valid[..., 1:] -= cvalid[..., :-window]
+    out[..., window - 1:][n_valid < window] = np.nan
+    return out
+
+
+def _calendar_day(dates):
+    """
+    Calendar-day slot 0..365 for each date (Feb 29 keeps its own slot).
+    """
+    slot = np.asarray(dates.dayofyear) - 1
+    slot += np.asarray(~dates.is_leap_year & (dates.month > 2))
+    return slot, 366
+
+
+def percentile_thresholds(obs_tas, dates, percentiles=(10, 90), window=PERCENTILE_WINDOW):
+    """
+    Calendar-day percentile thresholds for each station from the observed base period.
+
+    All samples within a centred window around each calendar day are gathered into one padded
+    (station x calendar day x sample) array so every threshold comes out of a single
+    nanpercentile call. Returns {percentile: (station x calendar day)} and the calendar-day
+    slot of every date, so thresholds can be computed once and reused for all sources.
+    """
+    obs_tas = np.asarray(obs_tas, dtype=float)
+    slot, n_slots = _calendar_day(dates)
+    occurrence = pd.Series(slot).groupby(slot).cumcount().to_numpy()
+    n_occ = occurrence.max() + 1 if len(occurrence) else 0
+
+    half = window // 2
+    samples = np.full(obs_tas.shape[:-1] + (n_slots, window * n_occ), np.nan)
+    for k, shift in enumerate(range(-half, half + 1)):
+        shifted = np.full(obs_tas.shape, np.nan)
+        if shift >= 0:
+            shifted[..., :obs_tas.shape[-1] - shift] = obs_tas[..., shift:]
+        else:
+            shifted[..., -shift:] = obs_tas[..., :shift]
+        samples[..., slot, k * n_occ + occurrence] = shifted
+
+    with np.errstate(invalid='ignore'):
+        thresholds = {p: np.nanpercentile(samples, p, axis=-1) for p in percentiles}
+    return thresholds, slot
+
+
+def compute_indices(pr=None, tas=None, dates=None, thresholds=None, min_valid_fraction=0.8):
+    """
+    Computes the annual ETCCDI-style indices for (..., time) precipitation and temperature arrays.
+
+    pr and tas share the daily DatetimeIndex dates; missing days are NaN. thresholds is the
+    output of percentile_thresholds (required for TG90p / TG10p). Years with fewer than
+    min_valid_fraction valid days are set to NaN. Returns ({index: (..., year) array}, years).
+    """
+    starts, years = _year_starts(dates)
+    days_per_year = np.diff(np.r_[starts, len(dates)])
+    indices = {}
+
+    if pr is not None:
+        pr = np.asarray(pr, dtype=float)
+        valid = np.isfinite(pr)
+        enough = _annual_sum(valid, starts) >= min_valid_fraction * days_per_year
+        wet = valid & (pr >= WET_DAY_THRESHOLD)
+        dry = valid & (pr < WET_DAY_THRESHOLD)
+        n_wet = _annual_sum(wet, starts)
+
+        indices['Rx1day'] = _annual_max(pr, starts)
+        indices['Rx5day'] = _annual_max(_rolling_sum(pr, 5), starts)
+        indices['CDD'] = _annual_max(_spell_lengths(dry, starts).astype(float), starts)
+        indices['CWD'] = _annual_max(_spell_lengths(wet, starts).astype(float), starts)
+        indices['R10mm'] = _annual_sum(valid & (pr >= HEAVY_PRECIP_THRESHOLD), starts).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            indices['SDII'] = _annual_sum(np.where(wet, pr, 0.0), starts) / n_wet
+        for name in PRECIP_INDICES:
+            indices[name] = np.where(enough, indices[name], np.nan)
+
+    if tas is not None and thresholds is not None:
+        tas = np.asarray(tas, dtype=float)
+        limits, slot = thresholds
+        valid = np.isfinite(tas)
+        n_valid = _annual_sum(valid, starts)
+        enough = n_valid >= min_valid_fraction * days_per_year
+        with np.errstate(invalid='ignore', divide='ignore'):
+            indices['TG90p'] = _annual_sum(valid & (tas > limits[90][..., slot]), starts) / n_valid * 100
+            indices['TG10p'] = _annual_sum(valid & (tas < limits[10][..., slot]), starts) / n_valid * 100
+        for name in TEMP_INDICES:
+            indices[name] = np.where(enough, indices[name], np.nan)
+
+    return indices, years
+
+
+def evaluate_indices(aligned, pr_var='Precipitation_mm_day', tas_var='Temperature_C', **labels):
+    """
+    Scores the annual index series of every source against the observed ones.
+
+    aligned is the output of evaluation_alignment.align_sources. Thresholds come from the
+    observations once and are reused for every source. The rows follow the
+    bias_correction_evaluation_results.csv schema, with the index name in the Variable column.
+    """
+    dates = aligned['dates']
+    thresholds = None
+    if tas_var in aligned['obs']:
+        thresholds = percentile_thresholds(aligned['obs'][tas_var], dates)
+
+    obs_idx, _ = compute_indices(aligned['obs'].get(pr_var), aligned['obs'].get(tas_var), dates, thresholds)
+    sim_idx, _ = compute_indices(aligned['sim'].get(pr_var), aligned['sim'].get(tas_var), dates, thresholds)
+
+    frames = [
+        evaluate_block(obs_idx[name], sim_idx[name], aligned['sources'], aligned['station_ids'],
+                       **labels, Variable=name)
+        for name in obs_idx
+    ]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
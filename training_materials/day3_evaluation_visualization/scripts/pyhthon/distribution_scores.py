@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+# Percentiles at which the quantile-quantile error (simulated minus observed quantile) is reported
+QQ_PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+WET_DAY_THRESHOLD = 1.0     # mm/day
+PERKINS_BINS = 50
+
+
+def _sorted_rows(values):
+    """
+    Sorts every (..., time) series once along time. NaN sorts to the end, so the first n
+    entries of each row are its valid values in ascending order. Returns (sorted, n).
+    """
+    values = np.asarray(values, dtype=float)
+    return np.sort(values, axis=-1), np.isfinite(values).sum(axis=-1)
+
+
+def _quantiles(sorted_vals, n, percentiles):
+    """
+    Linear-interpolated quantiles (numpy's default method) read straight off the sorted rows.
+    Returns a (..., len(percentiles)) array; rows without valid values give NaN.
+    """
+    q = np.asarray(percentiles, dtype=float) / 100
+    pos = q * np.maximum(n[..., np.newaxis] - 1, 0)
+    lo = np.floor(pos).astype(int)
+    hi = np.ceil(pos).astype(int)
+    frac = pos - lo
+    v_lo = np.take_along_axis(sorted_vals, lo, axis=-1)
+    v_hi = np.take_along_axis(sorted_vals, hi, axis=-1)
+    out = v_lo + (v_hi - v_lo) * frac
+    return np.where(n[..., np.newaxis] > 0, out, np.nan)
+
+
+def _count_le(sorted_vals, queries, side='right'):
+    """
+    Row-wise searchsorted for many rows in a single call: how many valid values of each sorted
+    row are <= (side='right') or < (side='left') each query of the same row.
+
+    Each row's values and queries are merged by one lexsort along the last axis (ties put the
+    values before the queries for side='right', after them for side='left'); the count for a
+    query is then the integer running count of values up to its position. NaN values go last
+    and are never counted, NaN queries count 0.
+    """
+    rows = sorted_vals.reshape(-1, sorted_vals.shape[-1])
+    qs = np.broadcast_to(queries, sorted_vals.shape[:-1] + queries.shape[-1:]).reshape(rows.shape[0], -1)
+    n_valid = np.isfinite(rows).sum(axis=-1, keepdims=True)
+
+    merged = np.concatenate([np.where(np.isfinite(rows), rows, np.inf),
+                             np.where(np.isnan(qs), -np.inf, qs)], axis=-1)
+    is_value = np.zeros(merged.shape, dtype=bool)
+    is_value[:, :rows.shape[1]] = True
+    tie = ~is_value if side == 'right' else is_value
+    order = np.lexsort((tie, merged), axis=-1)
+    running = np.empty(merged.shape, dtype=np.int64)
+    np.put_along_axis(running, order, np.cumsum(np.take_along_axis(is_value, order, axis=-1), axis=-1), axis=-1)
+    counts = np.minimum(running[:, rows.shape[1]:], n_valid)
+    return counts.reshape(sorted_vals.shape[:-1] + queries.shape[-1:])
+
+
+def compute_distribution_scores(obs, sim, percentiles=QQ_PERCENTILES, wet_day=False, n_bins=PERKINS_BINS):
+    """
+    Distributional skill scores for every (source, station) series.
+
+    obs is (station x time) and sim (source x station x time), NaN for missing days. Each
+    station's observations and each simulated series are sorted exactly once; the KS statistic,
+    quantile-quantile errors, Perkins skill score and (for precipitation, wet_day=True) the
+    wet-day frequency and intensity errors are all derived from those sorted arrays.
+    Returns a dict of (source x station) arrays.
+    """
+    sim = np.asarray(sim, dtype=float)
+    if sim.ndim == 2:
+        sim = sim[np.newaxis]
+    obs_sorted, n_obs = _sorted_rows(obs)
+    sim_sorted, n_sim = _sorted_rows(sim)
+    obs_b = np.broadcast_to(obs_sorted, sim_sorted.shape)
+    n_obs_b = np.broadcast_to(n_obs, n_sim.shape)
+    scores = {}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Two-sample KS: both empirical CDFs evaluated at every point of both samples
+        points = np.concatenate([obs_b, sim_sorted], axis=-1)
+        cdf_obs = _count_le(obs_b, points) / n_obs_b[..., np.newaxis]
+        cdf_sim = _count_le(sim_sorted, points) / n_sim[..., np.newaxis]
+        gap = np.where(np.isfinite(points), np.abs(cdf_obs - cdf_sim), 0.0)
+        scores['KS'] = np.where((n_obs_b > 0) & (n_sim > 0), gap.max(axis=-1), np.nan)
+
+        # Quantile-quantile errors
+        qq_err = _quantiles(sim_sorted, n_sim, percentiles) - _quantiles(obs_sorted, n_obs, percentiles)[np.newaxis]
+        for k, p in enumerate(percentiles):
+            scores[f'QQ_P{p:02d}_Error'] = qq_err[..., k]
+
+        # Perkins skill score on shared equal-width bins spanning both samples of each pair
+        first = np.fmin(obs_b[..., 0], sim_sorted[..., 0])
+        last_obs = np.take_along_axis(obs_b, np.maximum(n_obs_b - 1, 0)[..., np.newaxis], axis=-1)[..., 0]
+        last_sim = np.take_along_axis(sim_sorted, np.maximum(n_sim - 1, 0)[..., np.newaxis], axis=-1)[..., 0]
+        last = np.fmax(last_obs, last_sim)
+        edges = first[..., np.newaxis] + (last - first)[..., np.newaxis] * np.linspace(0, 1, n_bins + 1)
+        edges[..., -1] = last
+        freq_obs = np.diff(_count_le(obs_b, edges), axis=-1) / n_obs_b[..., np.newaxis]
+        freq_sim = np.diff(_count_le(sim_sorted, edges), axis=-1) / n_sim[..., np.newaxis]
+        # The lowest value sits on the first edge and is not counted by diff, add it back to bin 0
+        freq_obs[..., 0] += _count_le(obs_b, edges[..., :1])[..., 0] / n_obs_b
+        freq_sim[..., 0] += _count_le(sim_sorted, edges[..., :1])[..., 0] / n_sim
+        scores['Perkins_SS'] = np.minimum(freq_obs, freq_sim).sum(axis=-1)
+        scores['Perkins_SS'] = np.where((n_obs_b > 0) & (n_sim > 0), scores['Perkins_SS'], np.nan)
+
+        if wet_day:
+            threshold = np.full(obs_sorted.shape[:-1] + (1,), WET_DAY_THRESHOLD)
+            dry_obs = _count_le(obs_sorted, threshold, side='left')[..., 0]
+            dry_sim = _count_le(sim_sorted, threshold, side='left')[..., 0]
+            wet_obs, wet_sim = n_obs - dry_obs, n_sim - dry_sim
+            total_obs = np.nansum(obs_sorted, axis=-1)
+            total_sim = np.nansum(sim_sorted, axis=-1)
+            # Dry days are the leading entries of each sorted row, so wet totals are total minus the dry prefix
+            prefix_obs = np.take_along_axis(np.nancumsum(obs_sorted, axis=-1), np.maximum(dry_obs - 1, 0)[..., np.newaxis], axis=-1)[..., 0]
+            prefix_sim = np.take_along_axis(np.nancumsum(sim_sorted, axis=-1), np.maximum(dry_sim - 1, 0)[..., np.newaxis], axis=-1)[..., 0]
+            prefix_obs = np.where(dry_obs > 0, prefix_obs, 0.0)
+            prefix_sim = np.where(dry_sim > 0, prefix_sim, 0.0)
+
+            scores['WetDay_Freq_Error'] = wet_sim / n_sim - wet_obs / n_obs
+            scores['WetDay_Intensity_Error'] = (total_sim - prefix_sim) / wet_sim - (total_obs - prefix_obs) / wet_obs
+
+    return scores
+
+
+def distribution_scores_frame(aligned, precip_var='Precipitation_mm_day', **labels):
+    """
+    Distributional scores for every variable of an aligned block (see
+    evaluation_alignment.align_sources) as a tidy frame keyed like the metrics rows
+    (labels, Variable, Station_ID, Type), ready to be merged onto them.
+    """
+    frames = []
+    n_stations = len(aligned['station_ids'])
+    for var, obs in aligned['obs'].items():
+        scores = compute_distribution_scores(obs, aligned['sim'][var], wet_day=(var == precip_var))
+        frame = pd.DataFrame({
+            **labels,
+            'Variable': var,
+            'Station_ID': np.tile(aligned['station_ids'], len(aligned['sources'])),
+            'Type': np.repeat(aligned['sources'], n_stations),
+        })
+        for name, values in scores.items():
+            frame[name] = np.asarray(values).reshape(-1)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common'))
+from interchange import find_table, read_table
+
+
+def read_station_files(path_for_station, station_ids, value_col, out_col=None):
+    """
+    Reads one per-station table (e.g. temp_bc_{model}_{scenario}_{stn_id}.feather) for every station
+    and returns a single long frame with Date, Station_ID and the value column.
+    path_for_station is a function mapping a station ID to its file path; missing files are skipped.
+    Returns an empty frame when no station has a file.
+    """
+    out_col = out_col or value_col
+    frames = []
+    for stn_id in station_ids:
+        filepath = find_table(path_for_station(stn_id))
+        if filepath is None:
+            continue
+        df = read_table(filepath, columns=['Date', value_col])
+        df['Station_ID'] = stn_id
+        frames.append(df.rename(columns={value_col: out_col}))
+    if not frames:
+        return pd.DataFrame(columns=['Date', 'Station_ID', out_col])
+    return pd.concat(frames, ignore_index=True)
+
+
+def _station_day_codes(df, station_ids, start_date, n_days):
+    """
+    Maps the (Station_ID, Date) pairs of a long frame onto (station row, day index) positions
+    of the dense block. Rows outside the station list or date range get a False keep flag.
+    """
+    stn_codes = pd.Categorical(df['Station_ID'], categories=station_ids).codes
+    day_idx = ((pd.to_datetime(df['Date']) - start_date) // pd.Timedelta(days=1)).to_numpy()
+    keep = (stn_codes >= 0) & (day_idx >= 0) & (day_idx < n_days)
+    return stn_codes[keep], day_idx[keep], keep
+
+
+def align_sources(obs_df, sources, variables, start_date, end_date, require_common=True):
+    """
+    Joins the observations and every GCM source for all stations at once on (Station_ID, day index).
+
+    obs_df and each value of the sources dict are long frames with Date, Station_ID and one
+    column per variable; a source may be None or lack a variable when it was not produced.
+    Every frame is scattered into a dense (station x day) block covering start_date..end_date,
+    so missing sources simply stay masked (NaN) instead of becoming empty Series.
+
+    With require_common=True a day is kept for a station only if every source that has data
+    for that station is valid on that day for all variables, which matches comparing all
+    sources over the same dates.
+
+    Returns a dict with 'station_ids', 'dates', 'sources', 'obs' ({var: station x time})
+    and 'sim' ({var: source x station x time}).
+    """
+    start_date = pd.Timestamp(start_date)
+    dates = pd.date_range(start_date, pd.Timestamp(end_date), freq='D')
+    station_ids = np.sort(pd.unique(obs_df['Station_ID']))
+    source_names = list(sources)
+    n_stn, n_days, n_src = len(station_ids), len(dates), len(source_names)
+
+    obs = {var: np.full((n_stn, n_days), np.nan) for var in variables}
+    sim = {var: np.full((n_src, n_stn, n_days), np.nan) for var in variables}
+
+    stn_codes, day_idx, keep = _station_day_codes(obs_df, station_ids, start_date, n_days)
+    for var in variables:
+        obs[var][stn_codes, day_idx] = obs_df[var].to_numpy(dtype=float)[keep]
+
+    for k, name in enumerate(source_names):
+        src_df = sources[name]
+        if src_df is None or src_df.empty:
+            continue
+        stn_codes, day_idx, keep = _station_day_codes(src_df, station_ids, start_date, n_days)
+        for var in variables:
+            if var in src_df.columns:
+                sim[var][k, stn_codes, day_idx] = src_df[var].to_numpy(dtype=float)[keep]
+
+    if require_common:
+        common = np.ones((n_stn, n_days), dtype=bool)
+        for var in variables:
+            common &= np.isfinite(obs[var])
+            valid = np.isfinite(sim[var])
+            # Sources with no data at a station do not restrict that station's dates
+            present = valid.any(axis=-1, keepdims=True)
+            common &= np.all(valid | ~present, axis=0)
+        for var in variables:
+            obs[var][~common] = np.nan
+            sim[var][:, ~common] = np.nan
+
+    return {
+        'station_ids': station_ids,
+        'dates': dates,
+        'sources': source_names,
+        'obs': obs,
+        'sim': sim,
+    }
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common'))
+from interchange import read_table
+
+# Bump when the metric code changes so results computed by an older version are not reused
+CACHE_VERSION = 1
+INDEX_FILENAME = 'cache_index.json'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    SHA-256 of a file's bytes, or None when there is no file (path is None or does not exist).
+    Hashing raw bytes is much cheaper than parsing the table.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def frame_digest(df):
+    """
+    Content hash of a DataFrame slice (values and index), independent of how it was read.
+    """
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=True).values.tobytes()).hexdigest()
+
+
+def load_cache_index(cache_dir):
+    """
+    Loads the cache index: per multi-station input file, its byte digest and the digest of
+    every station slice, so unchanged files never have to be parsed again.
+    """
+    path = os.path.join(cache_dir, INDEX_FILENAME)
+    if not os.path.exists(path):
+        return {'version': CACHE_VERSION, 'files': {}}
+    with open(path) as f:
+        index = json.load(f)
+    if index.get('version') != CACHE_VERSION:
+        return {'version': CACHE_VERSION, 'files': {}}
+    return index
+
+
+def save_cache_index(cache_dir, index):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, INDEX_FILENAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def station_slice_digests(path, index, station_col='Station_ID'):
+    """
+    Returns {station: digest} for a file holding many stations (station observations or an
+    extracted GCM file). The file is only parsed when its byte digest differs from the one
+    recorded in the index; otherwise the stored slice digests are reused.
+    """
+    digest = file_digest(path)
+    if digest is None:
+        return {}
+    key = os.path.abspath(path)
+    record = index['files'].get(key)
+    if record and record['digest'] == digest:
+        return record['stations']
+    df = read_table(path)
+    stations = {str(stn): frame_digest(group.reset_index(drop=True)) for stn, group in df.groupby(station_col)}
+    index['files'][key] = {'digest': digest, 'stations': stations}
+    return stations
+
+
+def combination_key(*digests, **settings):
+    """
+    Cache key of one evaluation unit (model, scenario, station) from the digests of all its
+    input slices plus the evaluation settings. Missing inputs (None) are part of the key, so a
+    correction output appearing later invalidates the entry.
+    """
+    payload = json.dumps({'inputs': list(digests), 'settings': settings, 'version': CACHE_VERSION},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, 'results', f'{key}.pkl')
+
+
+def load_cached_result(cache_dir, key):
+    """
+    Cached result rows for a combination key, or None on a cache miss.
+    """
+    path = _entry_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    return pd.read_pickle(path)
+
+
+def store_cached_result(cache_dir, key, df):
+    """
+    Stores result rows under a combination key. The file is written to a temporary name and
+    renamed so an interrupted run never leaves a truncated entry behind.
+    """
+    path = _entry_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
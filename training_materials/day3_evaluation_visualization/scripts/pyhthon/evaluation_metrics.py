@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+# Columns produced for every (source, station) pair, in the order they appear in
+# bias_correction_evaluation_results.csv
+METRIC_COLUMNS = ['MAE', 'RMSE', 'Bias', 'Bias_Percent', 'R2', 'N']
+
+
+def compute_metrics(obs, sim):
+    """
+    Computes MAE, RMSE, bias, percentage bias and R2 for every source and station at once.
+
+    obs is a (station x time) array of observations and sim a (source x station x time)
+    array of GCM values (raw or bias-corrected) aligned on the same days.
+    Missing values are NaN and are masked out pair-wise, so each (source, station)
+    uses only the days where both the observation and the simulation exist.
+    Returns a dict of (source x station) arrays keyed by METRIC_COLUMNS.
+    """
+    obs = np.asarray(obs, dtype=float)
+    sim = np.asarray(sim, dtype=float)
+    if sim.ndim == 2:
+        sim = sim[np.newaxis]
+    obs = np.broadcast_to(obs, sim.shape)
+
+    valid = np.isfinite(obs) & np.isfinite(sim)
+    n = valid.sum(axis=-1)
+    obs_v = np.where(valid, obs, 0.0)
+    sim_v = np.where(valid, sim, 0.0)
+    err = sim_v - obs_v
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_obs = obs_v.sum(axis=-1) / n
+        mean_sim = sim_v.sum(axis=-1) / n
+        sq_err = np.einsum('...t,...t->...', err, err)
+        mae = np.abs(err).sum(axis=-1) / n
+        rmse = np.sqrt(sq_err / n)
+        bias = mean_sim - mean_obs
+        bias_percent = np.where(mean_obs != 0, bias / mean_obs * 100, np.nan)
+
+        # R2 follows sklearn's r2_score(obs, sim): 1 - SS_res / SS_tot around the observed mean
+        anom = np.where(valid, obs - mean_obs[..., np.newaxis], 0.0)
+        ss_tot = np.einsum('...t,...t->...', anom, anom)
+        r2 = np.where(ss_tot > 0, 1 - sq_err / ss_tot, np.nan)
+
+    return {
+        'MAE': mae,
+        'RMSE': rmse,
+        'Bias': bias,
+        'Bias_Percent': bias_percent,
+        'R2': r2,
+        'N': n,
+    }
+
+
+def metrics_to_frame(metrics, sources, station_ids, **labels):
+    """
+    Flattens the (source x station) arrays from compute_metrics into a tidy DataFrame.
+    Extra keyword arguments (e.g. Model, Scenario, Variable) are added as constant columns.
+    Pairs without any valid day are dropped.
+    """
+    n_sources, n_stations = len(sources), len(station_ids)
+    frame = pd.DataFrame({
+        **labels,
+        'Station_ID': np.tile(np.asarray(station_ids), n_sources),
+        'Type': np.repeat(np.asarray(sources), n_stations),
+    })
+    for col in METRIC_COLUMNS:
+        frame[col] = np.asarray(metrics[col]).reshape(n_sources * n_stations)
+    return frame[frame['N'] > 0].reset_index(drop=True)
+
+
+def evaluate_block(obs, sim, sources, station_ids, **labels):
+    """
+    Convenience wrapper: compute_metrics followed by metrics_to_frame.
+    """
+    return metrics_to_frame(compute_metrics(obs, sim), sources, station_ids, **labels)
@@ -0,0 +1,52 @@
+import argparse
+import io
+import os
+import urllib.request
+import zipfile
+
+from basemap_cache import BASE_LAYERS, SHAPEFILE_COMPONENTS, missing_natural_earth_files
+
+# Downloads the Natural Earth layers of the map base layer once, into the local directory that
+# basemap_cache.py reads (the layout of cartopy's own cache), so the plotting runs never touch the
+# network. Run it once per machine, before the workshop:
+#
+#   python fetch_natural_earth.py --dir ../../data/natural_earth
+
+NATURAL_EARTH_URL = 'https://naciscdn.org/naturalearth/{resolution}/{category}/ne_{resolution}_{name}.zip'
+
+
+def fetch_natural_earth(natural_earth_dir='../../data/natural_earth', resolution='50m'):
+    """
+    Downloads and unpacks every base layer whose shapefile components are not all present.
+    Returns the list of layers fetched.
+    """
+    fetched = []
+    for category, name in BASE_LAYERS:
+        target_dir = os.path.join(natural_earth_dir, 'shapefiles', 'natural_earth', category)
+        stem = f'ne_{resolution}_{name}'
+        if all(os.path.exists(os.path.join(target_dir, stem + ext)) for ext in SHAPEFILE_COMPONENTS):
+            continue
+        url = NATURAL_EARTH_URL.format(resolution=resolution, category=category, name=name)
+        print(f"Downloading {url} ...")
+        with urllib.request.urlopen(url) as response:
+            archive = zipfile.ZipFile(io.BytesIO(response.read()))
+        os.makedirs(target_dir, exist_ok=True)
+        for member in archive.namelist():
+            if member.startswith(stem + '.'):
+                with open(os.path.join(target_dir, os.path.basename(member)), 'wb') as f:
+                    f.write(archive.read(member))
+        fetched.append(stem)
+
+    missing = missing_natural_earth_files(natural_earth_dir, resolution)
+    if missing:
+        raise FileNotFoundError(f"Natural Earth files still missing: {', '.join(missing)}")
+    print(f"Natural Earth {resolution} layers ready in {natural_earth_dir} ({len(fetched)} downloaded).")
+    return fetched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the Natural Earth layers of the map base layer.")
+    parser.add_argument('--dir', default='../../data/natural_earth')
+    parser.add_argument('--resolution', default='50m', choices=['10m', '50m', '110m'])
+    args = parser.parse_args()
+    fetch_natural_earth(args.dir, args.resolution)
@@ -0,0 +1,183 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from evaluation_alignment import _station_day_codes, read_station_files
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'common'))
+from interchange import find_table, read_table, table_filename
+
+# Shared, fixed histogram bin edges per variable so counts from every source and station
+# can be compared (and re-binned for plotting) without going back to the daily data.
+# Values outside the range are counted in the first/last bin.
+HIST_EDGES = {
+    'Temperature_C': np.arange(-10.0, 50.0 + 0.25, 0.25),
+    'Precipitation_mm_day': np.arange(0.0, 300.0 + 0.5, 0.5),
+}
+SOURCES = ['Observed', 'Raw GCM', 'Bias-Corrected (Python)', 'Bias-Corrected (R/CDFt)']
+FILE_PREFIX = {'Temperature_C': 'temp', 'Precipitation_mm_day': 'precip'}
+
+
+def aggregates_path(output_dir, model, scenario, period):
+    return os.path.join(output_dir, f'plot_aggregates_{model}_{scenario}_{period}.nc')
+
+
+def _summaries(df, var, station_ids, edges):
+    """
+    Period mean, monthly climatology and histogram counts of one variable for every station,
+    from a long (Date, Station_ID, value) frame in a single pass of np.bincount calls.
+    """
+    n_stn, n_bins = len(station_ids), len(edges) - 1
+    mean = np.full(n_stn, np.nan)
+    monthly = np.full((n_stn, 12), np.nan)
+    hist = np.zeros((n_stn, n_bins), dtype=np.int32)
+    if df is None or df.empty or var not in df.columns:
+        return mean, monthly, hist
+
+    values = df[var].to_numpy(dtype=float)
+    stn = pd.Categorical(df['Station_ID'], categories=station_ids).codes.astype(np.int64)
+    keep = np.isfinite(values) & (stn >= 0)
+    values, stn = values[keep], stn[keep]
+    month = pd.DatetimeIndex(df['Date'].to_numpy()[keep]).month.to_numpy() - 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(stn, values, n_stn) / np.bincount(stn, minlength=n_stn)
+        cell = stn * 12 + month
+        monthly = (np.bincount(cell, values, n_stn * 12) / np.bincount(cell, minlength=n_stn * 12)).reshape(n_stn, 12)
+    bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, n_bins - 1)
+    hist = np.bincount(stn * n_bins + bins, minlength=n_stn * n_bins).reshape(n_stn, n_bins).astype(np.int32)
+    return mean, monthly, hist
+
+
+def _series_block(df, var, station_ids, dates):
+    """
+    Daily values of one variable as a dense (station x day) float32 block over dates (NaN gaps).
+    """
+    block = np.full((len(station_ids), len(dates)), np.nan, dtype=np.float32)
+    if df is None or df.empty or var not in df.columns:
+        return block
+    stn, day, keep = _station_day_codes(df, station_ids, dates[0], len(dates))
+    block[stn, day] = df[var].to_numpy(dtype=float)[keep]
+    return block
+
+
+def build_plot_aggregates(obs_df, station_metadata, processed_gcm_dir, bias_corrected_dir,
+                          model, scenario, period, output_dir, series_stations=(), bias_corrected_r_dir=None):
+    """
+    Computes every summary the plots need for one model/scenario/period and stores it as a
+    compact NetCDF cube with dims (source, station, month, bin_<variable>):
+    mean_<var>, monthly_<var> and hist_<var> for Observed, Raw GCM, Python BC and R/CDFt BC,
+    plus the daily series_<var> (source, series_station, time) of the series_stations that get
+    time-series plots. Each source file is read exactly once. The R/CDFt outputs are read from
+    bias_corrected_r_dir (default: bias_corrected_dir/r_cdft).
+    """
+    if bias_corrected_r_dir is None:
+        bias_corrected_r_dir = os.path.join(bias_corrected_dir, 'r_cdft')
+    start, end = period.split('-')
+    period_slice = (pd.Timestamp(start), pd.Timestamp(f'{end}-12-31'))
+    station_ids = np.asarray(station_metadata.index)
+
+    def in_period(df):
+        if df is None or df.empty:
+            return df
+        return df[df['Date'].between(*period_slice)]
+
+    raw_path = find_table(os.path.join(processed_gcm_dir, table_filename('gcm_extracted', model=model, scenario=scenario, period=period)))
+    obs_period = in_period(obs_df) if scenario == 'historical' else None
+    raw_period = in_period(read_table(raw_path, 'gcm_extracted')) if raw_path else None
+
+    # frames[source][variable]: long (Date, Station_ID, variable) frames
+    frames = {src: {} for src in SOURCES}
+    for var, prefix in FILE_PREFIX.items():
+        frames['Observed'][var] = obs_period
+        frames['Raw GCM'][var] = raw_period
+        frames['Bias-Corrected (Python)'][var] = in_period(read_station_files(
+            lambda stn_id: os.path.join(bias_corrected_dir, table_filename(f'{prefix}_bc', model=model, scenario=scenario, station=stn_id)),
+            station_ids, f'{var}_BC', var))
+        frames['Bias-Corrected (R/CDFt)'][var] = in_period(read_station_files(
+            lambda stn_id: os.path.join(bias_corrected_r_dir, table_filename(f'{prefix}_bc_cdft', model=model, scenario=scenario, station=stn_id)),
+            station_ids, f'{var}_BC', var))
+
+    data_vars = {}
+    coords = {
+        'source': SOURCES,
+        'station': station_ids,
+        'month': np.arange(1, 13),
+        'latitude': ('station', station_metadata['Latitude'].to_numpy(dtype=float)),
+        'longitude': ('station', station_metadata['Longitude'].to_numpy(dtype=float)),
+    }
+    for var, edges in HIST_EDGES.items():
+        results = [_summaries(frames[src][var], var, station_ids, edges) for src in SOURCES]
+        data_vars[f'mean_{var}'] = (('source', 'station'), np.stack([r[0] for r in results]).astype(np.float32))
+        data_vars[f'monthly_{var}'] = (('source', 'station', 'month'), np.stack([r[1] for r in results]).astype(np.float32))
+        data_vars[f'hist_{var}'] = (('source', 'station', f'bin_{var}'), np.stack([r[2] for r in results]))
+        coords[f'edges_{var}'] = (f'edge_{var}', edges)
+
+    dates = pd.date_range(*period_slice, freq='D')
+    series_stations = np.asarray(list(series_stations), dtype=str)
+    coords['series_station'] = series_stations
+    coords['time'] = dates
+    for var in HIST_EDGES:
+        data_vars[f'series_{var}'] = (('source', 'series_station', 'time'),
+                                      np.stack([_series_block(frames[src][var], var, series_stations, dates) for src in SOURCES]))
+
+    ds = xr.Dataset(data_vars, coords=coords, attrs={'model': model, 'scenario': scenario, 'period': period})
+    os.makedirs(output_dir, exist_ok=True)
+    path = aggregates_path(output_dir, model, scenario, period)
+    encoding = {name: {'zlib': True} for name in data_vars} if _has_netcdf4() else None
+    ds.to_netcdf(path, encoding=encoding)
+    return path
+
+
+def _has_netcdf4():
+    try:
+        import netCDF4  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def aggregates_up_to_date(path, input_paths, series_stations=None):
+    """
+    True when the cube exists, is newer than every input table that exists (Feather, or a CSV
+    with the same stem) and holds the daily series of series_stations (when given).
+    """
+    if not os.path.exists(path):
+        return False
+    built = os.path.getmtime(path)
+    existing = [find_table(p) for p in input_paths]
+    if not all(os.path.getmtime(p) <= built for p in existing if p):
+        return False
+    if series_stations is not None:
+        with xr.open_dataset(path) as ds:
+            stored = list(ds['series_station'].values) if 'series_station' in ds.coords else None
+        return stored == [str(s) for s in series_stations]
+    return True
+
+
+def rebin_density(counts, edges, target_bins):
+    """
+    Turns fine shared-edge counts of several sources (source x bin) into plotting densities:
+    crops to the range where any source has data and merges adjacent bins so roughly
+    target_bins remain. Returns (coarse_edges, densities) with densities as (source x bin).
+    """
+    counts = np.asarray(counts)
+    nonzero = np.flatnonzero(counts.sum(axis=0))
+    if len(nonzero) == 0:
+        return None, None
+    lo, hi = nonzero[0], nonzero[-1] + 1
+    factor = max(1, -(-(hi - lo) // target_bins))
+    n_coarse = -(-(hi - lo) // factor)
+    padded = np.zeros((counts.shape[0], n_coarse * factor))
+    padded[:, :hi - lo] = counts[:, lo:hi]
+    coarse = padded.reshape(counts.shape[0], n_coarse, factor).sum(axis=-1)
+    coarse_edges = np.asarray(edges)[lo:lo + n_coarse * factor + 1:factor]
+    if len(coarse_edges) < n_coarse + 1:
+        step = edges[1] - edges[0]
+        coarse_edges = np.r_[coarse_edges, coarse_edges[-1] + step * factor * np.arange(1, n_coarse + 2 - len(coarse_edges))]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        density = coarse / coarse.sum(axis=1, keepdims=True) / np.diff(coarse_edges)
+    return coarse_edges, density
@@ -0,0 +1,141 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from basemap_cache import SUDAN_EXTENT, draw_base_layer
+
+# Each figure is described by a plain, picklable dict (a "plot job") holding only the
+# pre-aggregated arrays it needs, so jobs can be rendered in any process:
+#   {'kind': 'timeseries' | 'spatial_map' | 'gridded_map' | 'distribution', 'path': output PNG, 'title': ..., ...}
+# Rendering uses the object-oriented Matplotlib API on the Agg canvas and never touches
+# pyplot's global figure state.
+
+
+def _new_figure(figsize, dpi=100):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _render_timeseries(job):
+    """
+    job['series']: list of {'label', 'x', 'y', 'style'} where style holds Matplotlib line kwargs.
+    """
+    fig = _new_figure(job.get('figsize', (12, 6)), job.get('dpi', 100))
+    ax = fig.add_subplot(1, 1, 1)
+    for s in job['series']:
+        ax.plot(s['x'], s['y'], label=s['label'], **s.get('style', {}))
+    ax.set_title(job['title'])
+    ax.set_xlabel(job.get('xlabel', 'Date'))
+    ax.set_ylabel(job.get('ylabel', ''))
+    ax.legend()
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(job['path'])
+
+
+def _render_spatial_map(job):
+    """
+    job: 'lon', 'lat', 'values' arrays at station points, plus 'cmap', 'colorbar_label' and
+    'basemap' (path of the cached base-layer image drawn underneath, see basemap_cache).
+    """
+    fig = _new_figure(job.get('figsize', (10, 8)), job.get('dpi', 100))
+    ax = fig.add_subplot(1, 1, 1)
+    draw_base_layer(ax, job.get('basemap'), job.get('extent', SUDAN_EXTENT))    # Sudan extent
+    sc = ax.scatter(job['lon'], job['lat'], c=job['values'], cmap=job.get('cmap', 'viridis'),
+                    s=100, edgecolors='black', zorder=2)
+    fig.colorbar(sc, ax=ax, label=job.get('colorbar_label', ''))
+    ax.set_title(job['title'])
+    fig.tight_layout()
+    fig.savefig(job['path'])
+
+
+def _render_gridded_map(job):
+    """
+    job: 'grid_lon', 'grid_lat' cell centres and 'field' (lat x lon) of an interpolated surface,
+    optional station 'lon'/'lat' overlaid as points, plus 'cmap', 'colorbar_label' and 'basemap'.
+    """
+    fig = _new_figure(job.get('figsize', (10, 8)), job.get('dpi', 100))
+    ax = fig.add_subplot(1, 1, 1)
+    extent = job.get('extent', SUDAN_EXTENT)
+    draw_base_layer(ax, job.get('basemap'), extent)
+    mesh = ax.pcolormesh(job['grid_lon'], job['grid_lat'], np.ma.masked_invalid(job['field']),
+                         cmap=job.get('cmap', 'viridis'), shading='nearest', alpha=0.8, zorder=1)
+    if job.get('lon') is not None:
+        ax.scatter(job['lon'], job['lat'], s=12, c='black', zorder=2)
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    fig.colorbar(mesh, ax=ax, label=job.get('colorbar_label', ''))
+    ax.set_title(job['title'])
+    fig.tight_layout()
+    fig.savefig(job['path'])
+
+
+def _render_distribution(job):
+    """
+    job['edges']: shared bin edges; job['series']: list of {'label', 'density', 'color'} where
+    density holds the already-binned values (np.histogram(..., density=True)).
+    """
+    fig = _new_figure(job.get('figsize', (10, 6)), job.get('dpi', 100))
+    ax = fig.add_subplot(1, 1, 1)
+    edges = np.asarray(job['edges'])
+    for s in job['series']:
+        ax.stairs(s['density'], edges, fill=True, alpha=0.6, label=s['label'], color=s.get('color'))
+    ax.set_title(job['title'])
+    ax.set_xlabel(job.get('xlabel', ''))
+    ax.set_ylabel('Density')
+    ax.legend()
+    ax.grid(True)
+    fig.tight_layout()
+    fig.savefig(job['path'])
+
+
+RENDERERS = {
+    'timeseries': _render_timeseries,
+    'spatial_map': _render_spatial_map,
+    'gridded_map': _render_gridded_map,
+    'distribution': _render_distribution,
+}
+
+
+def render_job(job):
+    """
+    Renders one plot job to its PNG and returns (path, error message or None), so a failing
+    figure is reported without stopping the others.
+    """
+    try:
+        os.makedirs(os.path.dirname(job['path']) or '.', exist_ok=True)
+        RENDERERS[job['kind']](job)
+        return job['path'], None
+    except Exception as e:
+        return job['path'], f"{type(e).__name__}: {e}"
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_jobs(jobs, n_workers=None):
+    """
+    Renders all plot jobs, across a process pool when n_workers > 1 (defaults to one process per core).
+    Prints one line per figure and returns the list of (path, error) pairs.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if n_workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) as pool:
+            results = list(pool.map(render_job, jobs, chunksize=max(1, len(jobs) // (4 * n_workers))))
+    else:
+        _init_worker()
+        results = [render_job(job) for job in jobs]
+
+    for path, error in results:
+        if error:
+            print(f"    Error rendering {path}: {error}")
+        else:
+            print(f"    Saved {os.path.basename(path)}.")
+    return results
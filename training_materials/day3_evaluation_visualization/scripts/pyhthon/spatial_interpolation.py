@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+# Station values are interpolated to a regular lon/lat grid through a sparse
+# (grid cell x station) weight matrix. The weights depend only on the station network and the
+# grid, so they are computed once (KD-tree neighbour search), cached on disk, and every field
+# (variable x scenario x source) is then a single sparse matrix product.
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def target_grid(extent, resolution=0.25):
+    """
+    Cell-centre longitudes and latitudes of a regular grid covering extent
+    [lon_min, lon_max, lat_min, lat_max] at the given resolution in degrees.
+    """
+    lon_min, lon_max, lat_min, lat_max = extent
+    lon = np.arange(lon_min + resolution / 2, lon_max, resolution)
+    lat = np.arange(lat_min + resolution / 2, lat_max, resolution)
+    return lon, lat
+
+
+def _to_xyz(lon, lat):
+    """
+    Unit-sphere coordinates, so KD-tree (chord) distances follow great-circle distances.
+    """
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def _neighbours(stn_lon, stn_lat, grid_lon, grid_lat, k):
+    """
+    k nearest stations of every grid cell (rows follow the flattened lat x lon grid).
+    Returns (distances in km, station indices), each (n_cells x k).
+    """
+    lon2d, lat2d = np.meshgrid(grid_lon, grid_lat)
+    tree = cKDTree(_to_xyz(stn_lon, stn_lat))
+    k = min(k, len(stn_lon))
+    chord, idx = tree.query(_to_xyz(lon2d.ravel(), lat2d.ravel()), k=k)
+    return _chord_to_km(chord).reshape(-1, k), idx.reshape(-1, k)
+
+
+def idw_weights(stn_lon, stn_lat, grid_lon, grid_lat, k=8, power=2.0):
+    """
+    Inverse-distance weights over the k nearest stations, as a sparse (n_cells x n_stations) matrix.
+    """
+    dist, idx = _neighbours(stn_lon, stn_lat, grid_lon, grid_lat, k)
+    with np.errstate(divide='ignore'):
+        w = 1.0 / dist ** power
+    # A cell sitting on a station takes that station's value
+    on_station = ~np.isfinite(w)
+    w = np.where(on_station.any(axis=1, keepdims=True), on_station.astype(float), w)
+    w /= w.sum(axis=1, keepdims=True)
+    rows = np.repeat(np.arange(idx.shape[0]), idx.shape[1])
+    return sparse.csr_matrix((w.ravel(), (rows, idx.ravel())), shape=(idx.shape[0], len(stn_lon)))
+
+
+def _exponential_variogram(h, range_km, nugget):
+    return nugget + (1 - nugget) * (1 - np.exp(-h / range_km))
+
+
+def kriging_weights(stn_lon, stn_lat, grid_lon, grid_lat, k=12, range_km=None, nugget=0.0):
+    """
+    Ordinary-kriging weights with a local neighbourhood of the k nearest stations and an
+    exponential variogram (unit sill, nugget as a fraction of the sill). range_km defaults to a
+    third of the largest station separation. All cells' kriging systems are solved at once as a
+    batched (n_cells x (k+1) x (k+1)) np.linalg.solve. Returns a sparse (n_cells x n_stations) matrix.
+    Kriging weights can be negative, so use interpolate_fields with an IDW fallback when some
+    stations may be missing.
+    """
+    # Coincident stations would make the kriging system singular: krige on the distinct sites
+    # and share each site's weight equally among its stations
+    coords = np.round(np.column_stack([stn_lon, stn_lat]).astype(float), 6)
+    sites, site_of, n_at_site = np.unique(coords, axis=0, return_inverse=True, return_counts=True)
+    site_of = site_of.ravel()
+    stn_lon, stn_lat = sites[:, 0], sites[:, 1]
+    xyz = _to_xyz(stn_lon, stn_lat)
+    stn_dist = _chord_to_km(np.linalg.norm(xyz[:, np.newaxis] - xyz[np.newaxis], axis=-1))
+    if range_km is None:
+        range_km = max(stn_dist.max() / 3, 1.0)
+
+    dist, idx = _neighbours(stn_lon, stn_lat, grid_lon, grid_lat, k)
+    n_cells, k = idx.shape
+    lhs = np.ones((n_cells, k + 1, k + 1))
+    lhs[:, :k, :k] = _exponential_variogram(stn_dist[idx[:, :, np.newaxis], idx[:, np.newaxis, :]], range_km, nugget)
+    lhs[:, np.arange(k), np.arange(k)] = 0.0
+    lhs[:, k, k] = 0.0
+    rhs = np.ones((n_cells, k + 1, 1))
+    rhs[:, :k, 0] = _exponential_variogram(dist, range_km, nugget)
+    w = np.linalg.solve(lhs, rhs)[:, :k, 0]
+
+    rows = np.repeat(np.arange(n_cells), k)
+    site_weights = sparse.csr_matrix((w.ravel(), (rows, idx.ravel())), shape=(n_cells, len(stn_lon)))
+    return sparse.csr_matrix(site_weights[:, site_of] @ sparse.diags(1.0 / n_at_site[site_of]))
+
+
+def _weights_key(stn_lon, stn_lat, extent, resolution, method, params):
+    payload = json.dumps({
+        'stations': np.round(np.column_stack([stn_lon, stn_lat]), 6).tolist(),
+        'extent': list(extent), 'resolution': resolution, 'method': method, 'params': params,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def get_interpolation_weights(stn_lon, stn_lat, extent, resolution=0.25, method='idw', cache_dir=None, **params):
+    """
+    Weight matrix for one station network and target grid, loaded from cache_dir when the same
+    network, grid, method and parameters were used before. Returns (weights, grid_lon, grid_lat).
+    """
+    grid_lon, grid_lat = target_grid(extent, resolution)
+    path = None
+    if cache_dir:
+        path = os.path.join(cache_dir, f'weights_{method}_{_weights_key(stn_lon, stn_lat, extent, resolution, method, params)}.npz')
+        if os.path.exists(path):
+            return sparse.load_npz(path), grid_lon, grid_lat
+
+    if method == 'idw':
+        weights = idw_weights(stn_lon, stn_lat, grid_lon, grid_lat, **params)
+    elif method == 'kriging':
+        weights = kriging_weights(stn_lon, stn_lat, grid_lon, grid_lat, **params)
+    else:
+        raise ValueError(f"Unknown interpolation method: {method}")
+
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        sparse.save_npz(tmp_path, weights)
+        os.replace(tmp_path, path)
+    return weights, grid_lon, grid_lat
+
+
+def interpolate_fields(weights, values, grid_shape, fallback=None, min_weight=0.5):
+    """
+    Interpolates station values (n_stations x n_fields, NaN where a station has no value) to the
+    grid with one sparse product for all fields. Weights of missing stations are dropped and the
+    rest renormalised per cell. With signed (kriging) weights the remaining sum can approach 0 or
+    change sign; cells whose remaining sum is below min_weight then take the value interpolated
+    with the fallback weights (e.g. IDW) instead. Returns (n_fields x n_lat x n_lon).
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    valid = np.isfinite(values)
+    filled = np.where(valid, values, 0.0)
+    remaining = weights @ valid.astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fields = (weights @ filled) / remaining
+        if fallback is not None:
+            unstable = remaining < min_weight
+            if unstable.any():
+                fields = np.where(unstable, (fallback @ filled) / (fallback @ valid.astype(float)), fields)
+    return fields.T.reshape((values.shape[1],) + tuple(grid_shape))
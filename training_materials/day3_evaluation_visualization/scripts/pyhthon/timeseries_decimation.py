@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# Long daily series (30+ years, several sources) are reduced before they reach Matplotlib:
+# either to a per-pixel min/max envelope sized to the figure's width, or to monthly/annual means.
+
+AGGREGATE_FREQ = {'monthly': 'MS', 'annual': 'YS'}
+
+
+def pixel_width(figsize, dpi=100, axes_fraction=0.85):
+    """
+    Approximate number of horizontal pixels available to the plotting area of a figure.
+    """
+    return max(1, int(figsize[0] * dpi * axes_fraction))
+
+
+def span_pixels(x, axis_start, axis_end, n_pixels):
+    """
+    Pixels of an n_pixels wide axis from axis_start to axis_end covered by the time span of x,
+    so that series covering part of the axis (historical, future) get the same point density.
+    """
+    x = np.asarray(x)
+    if len(x) < 2 or not axis_end > axis_start:
+        return n_pixels
+    share = (x.max() - x.min()) / (axis_end - axis_start)
+    return max(1, int(round(n_pixels * float(share))))
+
+
+def minmax_decimate(x, y, n_pixels):
+    """
+    Per-pixel min/max envelope of a regularly sampled series.
+
+    The series is split into n_pixels consecutive buckets and, for each bucket, only the points
+    holding its minimum and maximum are kept (in time order), so every spike stays visible while
+    at most 2 * n_pixels points are drawn. Buckets are formed by one reshape, so the whole
+    reduction is a couple of vectorized argmin/argmax calls. NaN values are ignored.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= 2 * n_pixels:
+        keep = np.isfinite(y)
+        return x[keep], y[keep]
+
+    size = -(-n // n_pixels)
+    n_buckets = -(-n // size)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    buckets = padded.reshape(n_buckets, size)
+
+    valid = np.isfinite(buckets).any(axis=1)
+    i_min = np.argmin(np.where(np.isnan(buckets), np.inf, buckets), axis=1)
+    i_max = np.argmax(np.where(np.isnan(buckets), -np.inf, buckets), axis=1)
+    offsets = np.arange(n_buckets) * size
+    idx = np.sort(np.stack([offsets + i_min, offsets + i_max], axis=1), axis=1)[valid].ravel()
+    # Flat buckets pick the same point twice
+    idx = idx[np.r_[True, idx[1:] != idx[:-1]]]
+    return x[idx], y[idx]
+
+
+def aggregate_series(x, y, view):
+    """
+    Monthly or annual means of a daily series (view is 'monthly' or 'annual').
+    """
+    s = pd.Series(np.asarray(y, dtype=float), index=pd.DatetimeIndex(x))
+    s = s.resample(AGGREGATE_FREQ[view]).mean().dropna()
+    return s.index.values, s.values
+
+
+def prepare_series(x, y, view='daily', n_pixels=1000):
+    """
+    Reduces one series for plotting: 'daily' keeps the min/max envelope at the figure's pixel
+    resolution, 'monthly' and 'annual' plot aggregate means (decimated too if still too dense).
+    """
+    if view in AGGREGATE_FREQ:
+        x, y = aggregate_series(x, y, view)
+    return minmax_decimate(x, y, n_pixels)
@@ -0,0 +1,146 @@
+import argparse
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'common'))
+from interchange import table_filename
+from stage_dag import python_stage, r_stage, run_dag
+
+# Runs the whole workshop pipeline (01 -> 05 and the R CDF-t correction) as a stage DAG:
+#
+#   station_data -> station_qc ------------\--> regression_downscaling (with the raw GCM fields)
+#                \-> gcm_extraction -> bias_correction_python --> evaluation
+#                                  \-> bias_correction_r_cdft -/ \-> visualization
+#
+# Every stage gets its paths from here instead of the scripts' relative defaults, stages whose
+# inputs and code are unchanged are skipped, and independent branches (Python QM and R CDF-t,
+# evaluation and visualization) run at the same time. See common/stage_dag.py.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DAY1 = os.path.join(ROOT, 'day1_foundations', 'scripts', 'python')
+DAY2 = os.path.join(ROOT, 'day2_downscaling_bc', 'scripts')
+DAY3 = os.path.join(ROOT, 'day3_evaluation_visualization', 'scripts', 'pyhthon')
+COMMON = os.path.join(ROOT, 'common')
+
+# Models, scenarios and periods of the run, declared once here and passed to every stage
+# (the Python stages as arguments, the R stage through environment variables), so they are
+# part of every stage's cache key
+MODELS = ['ACCESS-CM2']
+SCENARIOS = ['historical', 'ssp245', 'ssp585']
+HISTORICAL_PERIOD = '1991-2020'
+FUTURE_PERIOD = '2041-2070'
+
+
+def gcm_configs(models=MODELS, scenarios=SCENARIOS, historical_period=HISTORICAL_PERIOD, future_period=FUTURE_PERIOD):
+    """
+    {'model', 'scenario', 'time_period'} dicts of every model and scenario: the historical run
+    over historical_period, the future scenarios over future_period.
+    """
+    return [{'model': model, 'scenario': scenario,
+             'time_period': historical_period if scenario == 'historical' else future_period}
+            for model in models for scenario in scenarios]
+
+
+def pipeline_stages(data_dir, output_dir, include_r=True):
+    """
+    Declares every stage with its inputs and outputs; dependencies follow from the paths.
+    """
+    station_dir = os.path.join(data_dir, 'station_data')
+    station_data = os.path.join(station_dir, table_filename('station_data'))
+    station_metadata = os.path.join(station_dir, table_filename('station_metadata'))
+    station_qc = os.path.join(station_dir, table_filename('station_qc'))
+    raw_gcm_dir = os.path.join(data_dir, 'raw_gcm')
+    processed_gcm_dir = os.path.join(data_dir, 'processed_gcm')
+    natural_earth_dir = os.path.join(data_dir, 'natural_earth')
+    bias_corrected_dir = os.path.join(output_dir, 'bias_corrected')
+    # The R stage gets a sibling directory: each stage owns its whole output tree
+    bias_corrected_r_dir = os.path.join(output_dir, 'bias_corrected_r_cdft')
+    downscaled_dir = os.path.join(output_dir, 'downscaled')
+    evaluation_dir = os.path.join(output_dir, 'evaluation_results')
+    plots_dir = os.path.join(output_dir, 'plots')
+    configs = gcm_configs()
+    historical_configs = [config for config in configs if config['scenario'] == 'historical']
+    # Evaluation and visualization read the R/CDFt outputs when that stage is part of the run,
+    # as optional inputs: a failed R stage does not hold back the Python results
+    r_outputs = [bias_corrected_r_dir] if include_r else []
+
+    stages = [
+        python_stage('station_data', os.path.join(DAY1, '02_gcm_preprocessing.py'), 'generate_station_data',
+                     inputs=[], outputs=[station_data, station_metadata],
+                     output_dir=station_dir),
+        python_stage('station_qc', os.path.join(COMMON, 'station_qc.py'), 'quality_control_stations',
+                     inputs=[station_data], outputs=[station_qc],
+                     station_data_path=station_data, output_dir=station_dir),
+        python_stage('gcm_extraction', os.path.join(DAY1, '01_02_gcm_preprocessing.py'), 'precipitation_gcm_data',
+                     inputs=[raw_gcm_dir, station_metadata], outputs=[processed_gcm_dir],
+                     gcm_raw_dir=raw_gcm_dir, station_metedata_path=station_metadata,
+                     processed_gcm_dir=processed_gcm_dir, gcm_configs=configs),
+        python_stage('bias_correction_python', os.path.join(DAY2, 'python', '03_bias_correction_python.py'), 'perform_bias_correction',
+                     inputs=[station_data, station_qc, processed_gcm_dir], outputs=[bias_corrected_dir],
+                     station_data_path=station_data, processed_gcm_dir=processed_gcm_dir,
+                     output_dir=bias_corrected_dir, qc_flags_path=station_qc, gcm_config=configs,
+                     historical_period=HISTORICAL_PERIOD),
+        python_stage('regression_downscaling', os.path.join(DAY2, 'python', 'regression_downscaling.py'), 'regression_downscaling',
+                     inputs=[station_data, station_qc, raw_gcm_dir], outputs=[downscaled_dir],
+                     station_data_path=station_data, gcm_raw_dir=raw_gcm_dir,
+                     output_dir=downscaled_dir, qc_flags_path=station_qc,
+                     gcm_config=configs, historical_period=HISTORICAL_PERIOD),
+        python_stage('evaluation', os.path.join(DAY3, '04_evaluation_python.py'), 'evaluate_bias_correction',
+                     inputs=[station_data, station_qc, processed_gcm_dir, bias_corrected_dir], outputs=[evaluation_dir],
+                     optional_inputs=r_outputs,
+                     station_data_path=station_data, processed_gcm_dir=processed_gcm_dir,
+                     bias_corrected_dir=bias_corrected_dir, bias_corrected_r_dir=bias_corrected_r_dir,
+                     output_dir=evaluation_dir, qc_flags_path=station_qc, gcm_config_to_eval=historical_configs),
+        python_stage('visualization', os.path.join(DAY3, '05_visualization__python.py'), 'visualize_results',
+                     inputs=[station_data, processed_gcm_dir, bias_corrected_dir, natural_earth_dir], outputs=[plots_dir],
+                     optional_inputs=r_outputs,
+                     station_data_path=station_data, processed_gcm_dir=processed_gcm_dir,
+                     bias_corrected_dir=bias_corrected_dir, bias_corrected_r_dir=bias_corrected_r_dir,
+                     output_dir=plots_dir, natural_earth_dir=natural_earth_dir,
+                     model_to_visualize=MODELS[0], scenarios_to_visualize=SCENARIOS,
+                     historical_period=HISTORICAL_PERIOD, future_period=FUTURE_PERIOD),
+    ]
+    if include_r:
+        stages.append(r_stage('bias_correction_r_cdft', os.path.join(DAY2, 'r', '07_cdt_bias_correction_cdft.R'),
+                              inputs=[station_data, station_qc, processed_gcm_dir], outputs=[bias_corrected_r_dir],
+                              env={'STATION_DATA_PATH': station_data, 'QC_FLAGS_PATH': station_qc,
+                                   'PROCESSED_GCM_DIR': processed_gcm_dir,
+                                   'BC_R_OUTPUT_DIR': bias_corrected_r_dir,
+                                   'GCM_MODELS': ','.join(MODELS), 'GCM_SCENARIOS': ','.join(SCENARIOS),
+                                   'HISTORICAL_PERIOD': HISTORICAL_PERIOD, 'FUTURE_PERIOD': FUTURE_PERIOD}))
+    return stages
+
+
+def run_pipeline(data_dir=os.path.join(ROOT, 'data'), output_dir=os.path.join(ROOT, 'output'),
+                 include_r=None, max_workers=None, force=False):
+    """
+    Runs the pipeline stage DAG. The R stage is included when Rscript is available (include_r=None)
+    or as requested. Stage state, logs and run reports are kept in output_dir/pipeline_state.
+    """
+    if include_r is None:
+        include_r = shutil.which('Rscript') is not None
+        if not include_r:
+            print("Rscript not found: the R/CDFt bias-correction stage is left out.")
+    stages = pipeline_stages(os.path.abspath(data_dir), os.path.abspath(output_dir), include_r)
+    return run_dag(stages, os.path.join(output_dir, 'pipeline_state'), max_workers=max_workers, force=force)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the downscaling/bias-correction pipeline as a stage DAG.")
+    parser.add_argument('--data-dir', default=os.path.join(ROOT, 'data'))
+    parser.add_argument('--output-dir', default=os.path.join(ROOT, 'output'))
+    parser.add_argument('--workers', type=int, default=None, help="Maximum number of stages run at once")
+    parser.add_argument('--no-r', action='store_true', help="Leave out the R/CDFt stage")
+    parser.add_argument('--force', action='store_true', help="Rerun every stage regardless of the cache")
+    parser.add_argument('--trace', default=None, help="JSON-lines file for per-step timing/memory/counter events")
+    parser.add_argument('--profile', default=None, choices=['cprofile', 'pyinstrument'], help="Profile each stage's outermost step (with --trace)")
+    args = parser.parse_args()
+    # Stage subprocesses inherit these and configure common/instrumentation.py from them
+    if args.trace:
+        os.environ['PIPELINE_TRACE'] = os.path.abspath(args.trace)
+    if args.profile:
+        os.environ['PIPELINE_PROFILE'] = args.profile
+    report = run_pipeline(args.data_dir, args.output_dir, include_r=False if args.no_r else None,
+                          max_workers=args.workers, force=args.force)
+    sys.exit(0 if all(s['status'] in ('ran', 'cached') for s in report['stages'].values()) else 1)